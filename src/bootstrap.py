@@ -0,0 +1,123 @@
+import numpy as np
+
+from clean_results import fairness_scores
+
+
+# the fairness metrics of clean_results
+METRICS = ('nDCG', 'DCF', 'DPF', 'mCPF')
+# per-user columns whose sums give the metrics
+COLUMNS = ('ndcg', 'evaluated', 'ndcg_active', 'evaluated_active', 'ndcg_inactive', 'evaluated_inactive',
+           'short', 'long')
+
+
+def user_columns(ndcg: np.array, active: np.array, inactive: np.array, short: np.array, long: np.array) -> np.array:
+    """
+    The users x COLUMNS matrix of one setting: the nDCG of every user (nan without ground truth) split
+    over the user groups, and the number of shorthead and longtail items recommended to every user
+    """
+    evaluated = ~np.isnan(ndcg)
+    ndcg = np.where(evaluated, ndcg, 0.0)
+    return np.column_stack([ndcg, evaluated, ndcg * active, evaluated & active, ndcg * inactive,
+                            evaluated & inactive, short, long]).astype(np.float64)
+
+
+def fairness_metrics(sums: np.array) -> np.array:
+    """
+    nDCG, DCF, DPF and mCPF (last axis, as METRICS) from column sums (last axis, as COLUMNS), for any
+    number of leading replicate and setting axes
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ndcg = sums[..., 0] / sums[..., 1]
+        active = sums[..., 2] / sums[..., 3]
+        inactive = sums[..., 4] / sums[..., 5]
+        recommended = sums[..., 6] + sums[..., 7]
+        dcf, dpf, mcpf = fairness_scores(active, inactive, sums[..., 6] / recommended, sums[..., 7] / recommended)
+    return np.stack([ndcg, dcf, dpf, mcpf], axis=-1)
+
+
+class Bootstrap():
+    """
+    Paired bootstrap over users for the metrics of all settings of a cell
+
+    Every replicate draws the users with replacement once, as a vector of counts, and all settings
+    are evaluated on that same draw, so differences between settings are paired. The column sums of
+    a block of replicates are a single counts x columns matrix product, the draws are made by
+    bincounting vectorised index samples.
+
+    Parameters
+    ----------
+    replicates:
+      Number of bootstrap replicates
+    confidence:
+      Level of the percentile confidence intervals
+    seed:
+      Seed of the draws, the same seed gives the same intervals
+    block_elements:
+      Replicates are drawn in blocks of at most this many counts (replicates x users), bounding memory
+    """
+
+    def __init__(self, replicates: int = 2000, confidence: float = 0.95, seed: int = 0,
+                 block_elements: int = 2 ** 23):
+        self.replicates = replicates
+        self.confidence = confidence
+        self.seed = seed
+        self.block_elements = block_elements
+
+    def resampled_sums(self, columns: np.array) -> np.array:
+        """
+        The replicates x columns sums of a users x columns matrix over the bootstrap draws
+        """
+        rng = np.random.default_rng(self.seed)
+        users = len(columns)
+        block = max(1, min(self.replicates, self.block_elements // max(users, 1)))
+        sums = []
+        for start in range(0, self.replicates, block):
+            size = min(block, self.replicates - start)
+            draws = rng.integers(0, users, size=(size, users))
+            counts = np.bincount((draws + users * np.arange(size)[:, None]).ravel(), minlength=size * users)
+            sums.append(counts.reshape(size, users).astype(np.float64) @ columns)
+        return np.concatenate(sums)
+
+    def compare(self, settings: list, baseline: int = None) -> list:
+        """
+        Confidence intervals of the metrics of every setting and, against a baseline setting, of
+        their differences with a two-sided bootstrap p-value, 2 (1 + tail) / (replicates + 1) clipped
+        to 1 with tail the replicates on the smaller side of 0
+
+        Parameters
+        ----------
+        settings:
+          A list of users x COLUMNS matrices (user_columns), one per setting, of the same users
+        baseline:
+          The position of the baseline setting (e.g. 'N') in settings, None for no comparisons
+
+        Returns
+        ----------
+        rows:
+          Per setting and metric a dictionary with 'Metric', 'Estimate', 'CI_Low', 'CI_High' and, for
+          the settings other than the baseline, 'Difference', 'Diff_CI_Low', 'Diff_CI_High' and 'P_Value'
+        """
+        stacked = np.concatenate(settings, axis=1)
+        no_columns = len(COLUMNS)
+        estimates = fairness_metrics(stacked.sum(axis=0).reshape(len(settings), no_columns))
+        replicated = fairness_metrics(self.resampled_sums(stacked).reshape(-1, len(settings), no_columns))
+        tails = [50 * (1 - self.confidence), 100 - 50 * (1 - self.confidence)]
+        low, high = np.nanpercentile(replicated, tails, axis=0)
+
+        rows = []
+        for setting in range(len(settings)):
+            for metric, name in enumerate(METRICS):
+                row = {'Metric': name, 'Estimate': estimates[setting, metric], 'CI_Low': low[setting, metric],
+                       'CI_High': high[setting, metric]}
+                if baseline is not None and setting != baseline:
+                    differences = replicated[:, setting, metric] - replicated[:, baseline, metric]
+                    differences = differences[~np.isnan(differences)]
+                    diff_low, diff_high = np.percentile(differences, tails) if len(differences) else (np.nan,) * 2
+                    # replicates on the smaller side of 0 with the add-one correction, so that a p-value
+                    # is never 0 with finitely many replicates, doubled for a two-sided test
+                    tail = min(np.sum(differences <= 0), np.sum(differences >= 0))
+                    p_value = 2 * (1 + tail) / (len(differences) + 1) if len(differences) else np.nan
+                    row.update(Difference=estimates[setting, metric] - estimates[baseline, metric],
+                               Diff_CI_Low=diff_low, Diff_CI_High=diff_high, P_Value=min(p_value, 1.0))
+                rows.append(row)
+        return rows
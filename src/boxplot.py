@@ -1,28 +1,38 @@
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 ### CHANGE - ENTIRE FILE
 
-def create_boxplots(path, dataset, df):
-    # create new folder to save boxplots
-    os.makedirs(path, exist_ok=True)
+def boxplot_figure(df):
+    """
+    The mCPF boxplot of every fairness type with the average nDCG (column 'All') on top, drawn on its
+    own Figure without the pyplot global state, so that figures can be drawn from any thread or process
+    """
+    # imported here, so that runs without boxplots never load matplotlib and seaborn
+    from matplotlib.figure import Figure
+    import seaborn as sns
 
-    ax = sns.boxplot(x='Type', y='mCPF', data=df, order=['N', 'C', 'P', 'CP'])
+    figure = Figure()
+    ax = figure.subplots()
+    order = ['N', 'C', 'P', 'CP']
+    sns.boxplot(x='Type', y='mCPF', data=df, order=order, ax=ax)
 
     # Calculate the average per 'Type' for the 'All' column
     averages = df.groupby('Type')['All'].mean().round(5)
 
-    plt.xlabel('Type', fontsize=15, weight='bold')
-    plt.ylabel('mCPF', fontsize=15)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=14)
-    
+    ax.set_xlabel('Type', fontsize=15, weight='bold')
+    ax.set_ylabel('mCPF', fontsize=15)
+    ax.tick_params(labelsize=14)
+
     # Add average annotations on top of the boxes
-    y_min, y_max = plt.ylim()
+    y_min, y_max = ax.get_ylim()
     for i in range(4):
-        average = averages[i]
+        # by label, the averages are sorted alphabetically and the boxes in the order above
+        average = averages[order[i]]
         ax.text(i, y_max + 0.03, average, ha='center', va='center', weight='bold', size=15)
+    return figure
 
-    plt.savefig(os.path.join(path, f'{dataset}.png'), bbox_inches='tight')
-    plt.close()
\ No newline at end of file
+
+def create_boxplots(path, dataset, df):
+    # create new folder to save boxplots
+    os.makedirs(path, exist_ok=True)
+    boxplot_figure(df).savefig(os.path.join(path, f'{dataset}.png'), bbox_inches='tight')
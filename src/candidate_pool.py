@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+from mip import Model, OptimizationStatus, maximize, xsum
+
+from optimisation import _optimize
+
+
+class CandidatePoolGeneration():
+    """
+    Column generation over the ranked candidates of every user
+
+    The optimisation of one fairness setting is first solved over a short prefix of every user's
+    candidates. The reduced cost of a candidate outside a user's pool is its objective coefficient minus
+    the dual price of the user's list length constraint; users with positive reduced costs get their
+    most improving candidates added to the pool and the restricted problem is solved again, until no
+    candidate of the topk improves, which proves the solution optimal over all topk candidates. Most
+    users keep a pool of little more than the list length, so the solver model has a fraction of the
+    users x topk variables of the full one.
+
+    The restricted problems are written in W alone: for fixed epsilons the user and item group totals of
+    the optimisation are linear in W, so its objective is the sum of the objective coefficients of the
+    selected candidates (reranking.problem_coefficients) under one list length constraint per user.
+
+    Parameters
+    ----------
+    k:
+      The length of the recommendation lists
+    initial:
+      The prefix of every user in the first round, at least k
+    columns:
+      Candidates added to the pool of a user per round at most, by default k
+    tolerance:
+      Reduced costs up to tolerance are not improving
+    max_rounds:
+      Maximum number of restricted problems; the last solution is returned with status ROUND_LIMIT if
+      candidates still improve
+    max_seconds, max_gap, threads:
+      The solver settings, as the optimisation functions; max_seconds bounds all rounds together
+    """
+
+    def __init__(self, k: int = 10, initial: int = 15, columns: int = None, tolerance: float = 1e-9,
+                 max_rounds: int = 20, max_seconds: float = None, max_gap: float = None, threads: int = None):
+        self.k = k
+        self.initial = max(initial, k)
+        self.columns = columns or k
+        self.tolerance = tolerance
+        self.max_rounds = max_rounds
+        self.max_seconds = max_seconds
+        self.max_gap = max_gap
+        self.threads = threads
+
+    def _restricted(self, coefficients: np.array, pool: np.array, max_seconds: float):
+        # the optimisation over the pools: the selection and the dual price of every user, None if the
+        # solver found no optimum in time
+        model = Model()
+        model.verbose = 0
+        W, rows = [], []
+        for i in range(len(pool)):
+            W.append({j: model.add_var(ub=1.0) for j in np.flatnonzero(pool[i]).tolist()})
+            rows.append(model.add_constr(xsum(W[i].values()) == self.k))
+        model.objective = maximize(xsum(coefficients[i, j] * var for i, variables in enumerate(W)
+                                        for j, var in variables.items()))
+        info = {}
+        _optimize(model, None, max_seconds=max_seconds, max_gap=self.max_gap, info=info, threads=self.threads)
+        if info['status'] != OptimizationStatus.OPTIMAL.name:
+            return None, None, info['status']
+
+        selection = np.zeros(coefficients.shape, dtype=bool)
+        for i, variables in enumerate(W):
+            for j, var in variables.items():
+                selection[i, j] = var.x > 0.5
+        return selection, np.array([row.pi for row in rows]), info['status']
+
+    def solve(self, coefficients: np.array):
+        """
+        Parameters
+        ----------
+        coefficients:
+          The users x topk objective coefficients of the candidates, in ranking order
+
+        Returns
+        ----------
+        (selection, info):
+          The boolean users x topk selection, None if a restricted problem was not solved in time, and
+          the status ('OPTIMAL' when no candidate improves, 'ROUND_LIMIT' when max_rounds is reached
+          first, otherwise the solver status), objective, dual bound, gap, rounds and the number of
+          candidates in the pool of every user
+        """
+        start = time.time()
+        topk = coefficients.shape[1]
+        pool = np.zeros(coefficients.shape, dtype=bool)
+        pool[:, :min(self.initial, topk)] = True
+        for rounds in range(1, self.max_rounds + 1):
+            remaining = None if self.max_seconds is None else max(self.max_seconds - (time.time() - start), 0)
+            selection, prices, status = self._restricted(coefficients, pool, remaining)
+            if selection is None:
+                return None, dict(status=status, objective=None, bound=None, gap=None, rounds=rounds,
+                                  converged=False, pool=pool.sum(axis=1))
+            # reduced costs of the candidates outside the pools
+            reduced = np.where(pool, -np.inf, coefficients - prices[:, None])
+            expanded = (reduced > self.tolerance).any(axis=1)
+            if not expanded.any():
+                break
+            # the most improving candidates of every expanded user
+            users = np.flatnonzero(expanded)
+            best = np.argsort(-reduced[users], axis=1, kind='stable')[:, :self.columns]
+            improving = np.take_along_axis(reduced[users], best, axis=1) > self.tolerance
+            pool[np.repeat(users[:, None], best.shape[1], axis=1)[improving], best[improving]] = True
+
+        converged = not expanded.any()
+        objective = float(coefficients[selection].sum())
+        # the LP dual of the full problem with the last prices: k * price + the positive reduced costs
+        bound = float((self.k * prices).sum() + np.maximum(coefficients - prices[:, None], 0).sum())
+        info = dict(status='OPTIMAL' if converged else 'ROUND_LIMIT', objective=objective, bound=bound,
+                    gap=abs(bound - objective) / max(abs(objective), 1e-10), rounds=rounds, converged=converged,
+                    pool=pool.sum(axis=1))
+        return selection, info
@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+import pandas as pd
+from cornac.eval_methods import BaseMethod
+
+
+def _id_index(id_map: dict) -> (pd.Index, np.array):
+    # raw id (as read by Cornac, i.e. a string) -> position, and position -> Cornac index
+    raw_ids = pd.Index(list(id_map.keys()))
+    return raw_ids, np.fromiter(id_map.values(), dtype=np.int64, count=len(id_map))
+
+
+def _map_ids(raw_ids: np.array, index: pd.Index, idx: np.array) -> np.array:
+    # map raw ids to Cornac indices, -1 for ids Cornac has not seen
+    positions = index.get_indexer(np.asarray(raw_ids).astype(str).ravel())
+    mapped = np.where(positions >= 0, idx[positions], -1)
+    return mapped.reshape(np.shape(raw_ids))
+
+
+def _fill_rows(S: np.array, P: np.array, filled: np.array, users: np.array, items: np.array, scores: np.array):
+    # write the topk highest scored known items of every user row into S and P
+    topk = S.shape[1]
+    scores = np.where(items >= 0, scores, -np.inf)
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :topk]
+    items = np.take_along_axis(items, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+
+    too_short = ~np.isfinite(scores).all(axis=1) if scores.shape[1] >= topk else np.ones(len(users), dtype=bool)
+    if too_short.any():
+        raise ValueError(f"{too_short.sum()} users have fewer than {topk} known candidate items!")
+    S[users] = scores
+    P[users] = items
+    filled[users] = True
+
+
+def read_candidate_arrays(candidate_path: str, eval_method: BaseMethod, topk: int, chunk_size: int = 100000):
+    """
+    Read external top-k lists stored as memory-mapped NumPy arrays
+
+    Parameters
+    ----------
+    candidate_path:
+      A directory with users.npy (n,), items.npy (n, k) and scores.npy (n, k) holding the raw
+      user id, the raw item ids and their scores of n candidate lists, with k >= topk
+
+    Returns
+    ----------
+    S:
+      The users x topk matrix of candidate scores, best first
+    P:
+      The users x topk matrix of candidate item indices
+    """
+    users = np.load(os.path.join(candidate_path, 'users.npy'), mmap_mode='r')
+    items = np.load(os.path.join(candidate_path, 'items.npy'), mmap_mode='r')
+    scores = np.load(os.path.join(candidate_path, 'scores.npy'), mmap_mode='r')
+
+    user_index, user_idx = _id_index(eval_method.train_set.uid_map)
+    item_index, item_idx = _id_index(eval_method.train_set.iid_map)
+
+    S = np.zeros((eval_method.total_users, topk))
+    P = np.zeros((eval_method.total_users, topk))
+    filled = np.zeros(eval_method.total_users, dtype=bool)
+    # the memory-mapped arrays are only paged in chunk by chunk
+    for start in range(0, len(users), chunk_size):
+        stop = min(start + chunk_size, len(users))
+        chunk_users = _map_ids(users[start:stop], user_index, user_idx)
+        known = chunk_users >= 0
+        _fill_rows(S, P, filled, users=chunk_users[known],
+                   items=_map_ids(items[start:stop], item_index, item_idx)[known],
+                   scores=np.asarray(scores[start:stop], dtype=np.float64)[known])
+    _check_all_users(filled)
+    return S, P
+
+
+def read_candidate_table(candidate_path: str, eval_method: BaseMethod, topk: int):
+    """
+    Read external candidates stored as a Parquet (or tab separated text) table with one
+    (user, item, score) row per candidate, returning S and P as read_candidate_arrays
+    """
+    if candidate_path.endswith('.parquet'):
+        table = pd.read_parquet(candidate_path, columns=['user', 'item', 'score'])
+    else:
+        table = pd.read_csv(candidate_path, sep='\t', names=['user', 'item', 'score'], dtype={'user': str, 'item': str})
+
+    user_index, user_idx = _id_index(eval_method.train_set.uid_map)
+    item_index, item_idx = _id_index(eval_method.train_set.iid_map)
+    table['user'] = _map_ids(table['user'].values, user_index, user_idx)
+    table['item'] = _map_ids(table['item'].values, item_index, item_idx)
+    table = table[(table['user'] >= 0) & (table['item'] >= 0)]
+    table = table.sort_values(['user', 'score'], ascending=[True, False], kind='stable')
+    table = table[table.groupby('user').cumcount() < topk]
+
+    counts = table.groupby('user').size()
+    if (counts < topk).any():
+        raise ValueError(f"{(counts < topk).sum()} users have fewer than {topk} known candidate items!")
+
+    S = np.zeros((eval_method.total_users, topk))
+    P = np.zeros((eval_method.total_users, topk))
+    filled = np.zeros(eval_method.total_users, dtype=bool)
+    users = counts.index.values
+    S[users] = table['score'].values.reshape(-1, topk)
+    P[users] = table['item'].values.reshape(-1, topk)
+    filled[users] = True
+    _check_all_users(filled)
+    return S, P
+
+
+def _check_all_users(filled: np.array):
+    if not filled.all():
+        raise ValueError(f"No candidates were given for {(~filled).sum()} of the {len(filled)} users!")
+
+
+class ExternalCandidates():
+    """
+    Scored top-k lists produced by an external recommender, used in place of a trained Cornac model
+    """
+
+    def __init__(self, candidate_path: str, name: str = 'External'):
+        if not os.path.exists(candidate_path):
+            raise ValueError(f"The path to the candidates '{candidate_path}' was invalid!")
+        self.candidate_path = candidate_path
+        self.name = name
+
+    def load(self, eval_method: BaseMethod, topk: int):
+        print(f"Reading candidates from '{self.candidate_path}'")
+        if os.path.isdir(self.candidate_path):
+            return read_candidate_arrays(self.candidate_path, eval_method=eval_method, topk=topk)
+        return read_candidate_table(self.candidate_path, eval_method=eval_method, topk=topk)
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+
+def epsilon_grid(config: dict, fair_mode: str) -> list:
+    # (user epsilon, item epsilon) pairs to optimise for a fairness mode
+    if fair_mode == 'N':
+        return [(None, None)]
+    if fair_mode == 'C':
+        return [(user_eps, None) for user_eps in config['user_epsilon']]
+    if fair_mode == 'P':
+        return [(None, item_eps) for item_eps in config['item_epsilon']]
+    if fair_mode == 'CP':
+        return [(user_eps, item_eps) for user_eps in config['user_epsilon']
+                for item_eps in config['item_epsilon']]
+    return []
+
+
+def recall_sizes(train_checkins, total_users: int) -> np.array:
+    # number of train interactions of every user, the only part of train_checkins the optimisation uses
+    return np.array([len(train_checkins[uid]) for uid in range(total_users)])
+
+
+def cell_path(cells_dir: str, dataset: str, model_name: str, user_group: str, i_group: str) -> str:
+    return os.path.join(cells_dir, dataset, model_name, f"{user_group}_{i_group}.npz")
+
+
+def save_cell(path: str, S, P, U, Ahelp, Ihelp, recall_sizes, total_users: int, total_items: int, model_index: int):
+    """
+    Write the arrays of one (dataset, model, user group, item group) cell, everything its optimisation
+    problems need, so that they can be solved by another process (python -m cpfair solve)
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written under a temporary name first, so an interrupted write is never read as a cell
+    temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(temporary_path, S=S, P=P, U=U, Ahelp=Ahelp, Ihelp=Ihelp, recall_sizes=recall_sizes,
+             totals=np.array([total_users, total_items]), model_index=np.array(model_index))
+    os.replace(temporary_path, path)
+
+
+def load_cell(path: str) -> dict:
+    with np.load(path) as cell:
+        return {name: cell[name] for name in cell.files}
+
+
+def iter_cells(cells_dir: str, datasets: list = None):
+    """
+    The (dataset, model name, user group, item group, path) of every cell written by save_cell
+
+    Yields
+    ----------
+    cell:
+      The cells in order of dataset, model and groups
+    """
+    if not os.path.isdir(cells_dir):
+        return
+    for dataset in sorted(os.listdir(cells_dir)):
+        if datasets is not None and dataset not in datasets:
+            continue
+        for model_name in sorted(os.listdir(os.path.join(cells_dir, dataset))):
+            for name in sorted(os.listdir(os.path.join(cells_dir, dataset, model_name))):
+                if not name.endswith('.npz') or '.tmp' in name:
+                    continue
+                user_group, i_group = name[:-len('.npz')].split('_', 1)
+                yield dataset, model_name, user_group, i_group, os.path.join(cells_dir, dataset, model_name, name)
@@ -1,16 +1,29 @@
+import numpy as np
 import pandas as pd
 ### CHANGE - ENTIRE FILE
+
+# the weight of DPF in mCPF = w * DPF + (1 - w) * DCF
+MCPF_WEIGHT = 0.5
+
+
+def fairness_scores(active, inactive, short, long):
+    """
+    DCF, DPF and mCPF from the nDCG of the active and inactive users and the short-head and longtail
+    shares of the recommended items, for numbers, arrays and columns alike (nan where both nDCG are 0)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dcf = abs((active - inactive) / (active + inactive))
+    dpf = short - long
+    return dcf, dpf, MCPF_WEIGHT * dpf + (1 - MCPF_WEIGHT) * dcf
+
     
 def clean_results(df: pd.DataFrame) -> pd.DataFrame:
     # calculates and creates all extra needed columns
-    w = 0.5
-    df['DCF'] = abs((df['ndcg_ACT']-df['ndcg_INACT'])/(df['ndcg_ACT']+df['ndcg_INACT']))
     df['Cov.'] = df['Cov_ALL']/100
     df['All_Items'] = df['All_Items'].str.extract(r'(\d+)==\d+\.0').astype(int)
     df['Short.'] = df['Short_Items'] / df['All_Items']
     df['Long.'] = df['Long_Items'] / df['All_Items']
-    df["DPF"] = df['Short.'] - df['Long.']
-    df['mCPF'] = w * df['DPF'] + (1 - w) * df['DCF']
+    df['DCF'], df['DPF'], df['mCPF'] = fairness_scores(df['ndcg_ACT'], df['ndcg_INACT'], df['Short.'], df['Long.'])
     df['mCPF/All'] = df['mCPF'] / df['ndcg_ALL']
     df['delta (%)'] = ((df['mCPF'].iloc[0] - df['mCPF']) / df['mCPF'].iloc[0]) * 100
 
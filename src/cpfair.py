@@ -0,0 +1,567 @@
+"""
+Command line entry point for batch nodes:
+
+    python -m cpfair run <config>        train, rank, re-rank and evaluate, as run.ipynb
+    python -m cpfair plan <config>[:<formulation>]...   run several configs sharing their common stages
+    python -m cpfair preflight <config> --memory-gb 16  estimate a run and fit it to a memory and time budget
+    python -m cpfair rank <config>       train and rank, writing the arrays of every cell to --cells
+    python -m cpfair solve <config>      solve the problems of the written cells into the solution cache
+    python -m cpfair evaluate <config>   evaluate the solved cells and write the results
+    python -m cpfair report <results>... tables and figures of the results of one or more runs
+    python -m cpfair simulate <config>   feedback loop simulation of the config's simulation key
+    python -m cpfair ingest <config>     ingest the lines appended to the config's interaction logs
+    python -m cpfair equivalence <config> check the backends against the reference path on the written cells
+
+Distributed over hosts sharing a directory (see work_queue.WorkQueue):
+
+    python -m cpfair coordinate <config> --queue <dir>   enqueue the ranking of every dataset and model
+    python -m cpfair work --queue <dir>                  claim and run tasks until the queue is finished
+    python -m cpfair reduce --queue <dir>                evaluate the finished queue into the result tables
+    python -m cpfair distribute <config> --queue <dir> --workers 4   all of them with local workers
+    python -m cpfair monitor --queue <dir>               publish the progress of all workers (monitor key)
+
+Every subcommand imports only what it needs, so that e.g. a worker solving cached cells starts without
+loading Cornac, pandas or matplotlib.
+"""
+import argparse
+import csv
+from datetime import datetime
+import os
+import sys
+
+import yaml
+
+from reranking import FORMULATIONS
+
+
+# the optimisation function of every formulation, as the qualified name in the solution cache keys
+OPTIMISATIONS = {
+    'reproduction': 'optimisation.fairness_optimisation',
+    'dcg_change': 'optimisation.fairness_optimisation_dcg_change',
+    'proportional': 'optimisation.fairness_optimisation_proportional',
+}
+# the models of run.ipynb, used when the config has no models key
+DEFAULT_MODELS = [{'class': 'HPF', 'k': 50, 'seed': 123, 'hierarchical': False, 'name': 'PF'}]
+
+
+def _read_config(config_path: str) -> dict:
+    if not os.path.exists(config_path):
+        raise ValueError("The path to the config file of the experiment was invalid!")
+    with open(config_path, 'r') as config_file:
+        return yaml.safe_load(config_file)
+
+
+def _solution_cache(config: dict):
+    from solution_cache import SolutionCache
+
+    settings = config.get('solution_cache') or {}
+    return SolutionCache(settings.get('path', 'solution_cache'), max_mb=settings.get('max_mb', 512))
+
+
+def _experiment(config_path: str, formulation: str):
+    # the experiment of a formulation with the models of the config, e.g.
+    # models: [{class: HPF, k: 50, seed: 123, hierarchical: False, name: PF}]
+    import cornac
+
+    if formulation == 'dcg_change':
+        from experiment_dcg_change import ExperimentDCG as experiment_class
+    elif formulation == 'proportional':
+        from extension_proportional import ExtensionProportional as experiment_class
+    else:
+        from experiment import Experiment as experiment_class
+
+    models = []
+    for model in _read_config(config_path).get('models') or DEFAULT_MODELS:
+        model = dict(model)
+        models.append(getattr(cornac.models, model.pop('class'))(**model))
+    metrics = [cornac.metrics.AUC(), cornac.metrics.MAP(), cornac.metrics.MRR(), cornac.metrics.NDCG(k=10),
+               cornac.metrics.Recall(k=10)]
+    return experiment_class(config_path, models=models, metrics=metrics)
+
+
+def run(args):
+    _experiment(args.config, args.formulation).run_experiment()
+    return 0
+
+
+def plan(args):
+    from planner import ExperimentPlanner
+
+    experiments = []
+    for argument in args.configs:
+        # table_dcg_change.yaml:dcg_change, the formulation of a config without one being --formulation
+        config_path, _, formulation = argument.partition(':')
+        formulation = formulation or args.formulation
+        if formulation not in FORMULATIONS:
+            raise ValueError(f"Unknown formulation '{formulation}' of {config_path}, choose from {FORMULATIONS}")
+        name = f"{os.path.splitext(os.path.basename(config_path))[0]}_{formulation}"
+        experiments.append((name, _experiment(config_path, formulation)))
+    ExperimentPlanner(experiments).build().execute()
+    return 0
+
+
+def preflight(args):
+    import pandas as pd
+
+    from preflight import apply_plan, plan
+
+    config = _read_config(args.config)
+    models = args.models or len(config.get('models') or DEFAULT_MODELS)
+    planned = plan(config, memory_gb=args.memory_gb, hours=args.hours, cores=args.cores, models=models)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(planned.round(3).to_string(index=False))
+
+    planned_config = apply_plan(config, planned)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            yaml.safe_dump(planned_config, output_file, sort_keys=False)
+    return 0 if planned_config['ds_names'] else 1
+
+
+def simulate(args):
+    _experiment(args.config, args.formulation).run_simulation()
+    return 0
+
+
+def ingest(args):
+    experiment = _experiment(args.config, args.formulation)
+    for dataset in (experiment.config.get('interaction_logs') or {}):
+        experiment._load_dataset_groups(dataset)
+    return 0
+
+
+def _write_cells(experiment, cells_dir: str, dataset: str, data: dict, model_index: int, model) -> list:
+    # rank one trained model and write the arrays of every (user group, item group) cell
+    from cells import cell_path, recall_sizes, save_cell
+    from matrices import load_ground_truth_index, read_item_index
+
+    topk = experiment.config['topk']
+    total_users, total_items = data['eval_method'].total_users, data['eval_method'].total_items
+    S, P = experiment._load_ranking(model=model, dataset=dataset, eval_method=data['eval_method'],
+                                    train_checkins=data['train_checkins'])
+    Ahelp = load_ground_truth_index(total_users=total_users, topk=topk, P=P,
+                                    train_checkins=data['train_checkins'])
+    sizes = recall_sizes(data['train_checkins'], total_users)
+    paths = []
+    for user_group, (U, _, _) in data['user_groups'].items():
+        for i_group, (shorthead_item_ids, longtail_item_ids) in data['item_groups'].items():
+            Ihelp = read_item_index(total_users=total_users, topk=topk,
+                                    no_item_groups=experiment.config['no_of_item_groups'], P=P,
+                                    shorthead_item_ids=shorthead_item_ids, longtail_item_ids=longtail_item_ids)
+            path = cell_path(cells_dir, dataset, model.name, user_group, i_group)
+            save_cell(path, S=S, P=P, U=U, Ahelp=Ahelp, Ihelp=Ihelp, recall_sizes=sizes, total_users=total_users,
+                      total_items=total_items, model_index=model_index)
+            print(f"Wrote {path}")
+            paths.append(path)
+    return paths
+
+
+def rank(args):
+    experiment = _experiment(args.config, args.formulation)
+    experiment._start_reports()
+    for dataset, data, model_index, model, _ in experiment._trained_models():
+        _write_cells(experiment, args.cells, dataset, data, model_index, model)
+    return 0
+
+
+def solve(args):
+    from cells import epsilon_grid, iter_cells, load_cell
+    from solution_cache import array_digest
+
+    config = _read_config(args.config)
+    cache = _solution_cache(config)
+    paths = args.cell or [path for *_, path in iter_cells(args.cells, config['ds_names'])]
+    cached, reports = 0, []
+    for path in paths:
+        cell = load_cell(path)
+        # the digest of Experiment._inputs_digest, so run_experiment and the CLI share the cache entries
+        inputs_digest = array_digest(cell['S'], cell['Ahelp'], cell['U'], cell['Ihelp'], cell['recall_sizes'])
+        for fair_mode in config['fairness_categories']:
+            for user_eps, item_eps in epsilon_grid(config, fair_mode):
+                report = _solve_into_cache(args.formulation, config, cache, cell, inputs_digest, fair_mode,
+                                           user_eps, item_eps)
+                if report is None:
+                    cached += 1
+                else:
+                    reports.append(dict(Cell=path, **report))
+
+    print(f"Solved {len(reports)} problems, {cached} were cached")
+    if reports:
+        report_path = os.path.join(args.cells, 'solves.csv')
+        os.makedirs(args.cells, exist_ok=True)
+        new_file = not os.path.exists(report_path)
+        with open(report_path, 'a', newline='') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=list(reports[0]))
+            if new_file:
+                writer.writeheader()
+            writer.writerows(reports)
+    return 0
+
+
+def _solve_into_cache(formulation: str, config: dict, cache, cell: dict, inputs_digest: str, fair_mode: str,
+                      user_eps, item_eps):
+    # solve one problem of a cell into the solution cache, the solve report or None if it was cached
+    from solution_cache import problem_key
+
+    key = problem_key(inputs_digest, config, formulation=formulation, optimisation=OPTIMISATIONS[formulation],
+                      fair_mode=fair_mode, user_eps=user_eps, item_eps=item_eps)
+    if cache.get(key) is not None:
+        return None
+    selection, item_totals, report = _solve_cell_problem(formulation, config, cell, fair_mode, user_eps, item_eps)
+    cache.put(key, selection, item_totals)
+    return report
+
+
+def _solve_cell_problem(formulation: str, config: dict, cell: dict, fair_mode: str, user_eps, item_eps):
+    # imported here, only workers that actually solve load the solver
+    from types import SimpleNamespace
+
+    import optimisation
+    from experiment import solve_problem
+
+    total_users, total_items = (int(total) for total in cell['totals'])
+    # the optimisation reads only the totals of the eval method and the sizes of the train check-ins
+    eval_method = SimpleNamespace(total_users=total_users, total_items=total_items)
+    train_checkins = [range(size) for size in cell['recall_sizes']]
+    return solve_problem(getattr(optimisation, OPTIMISATIONS[formulation].split('.')[1]), config, fair_mode,
+                         user_eps, item_eps, eval_method=eval_method, S=cell['S'], U=cell['U'],
+                         Ihelp=cell['Ihelp'], Ahelp=cell['Ahelp'], train_checkins=train_checkins,
+                         formulation=formulation)
+
+
+def evaluate(args):
+    _evaluate(args)
+    return 0
+
+
+def _evaluate(args) -> str:
+    # evaluate the solved cells, returning the directory of the results
+    import pandas as pd
+
+    from boxplot import create_boxplots
+    from cells import epsilon_grid, iter_cells, load_cell
+    from clean_results import clean_results
+    from metrics import CUTOFF_COLUMNS, RESULT_COLUMNS, SelectionEvaluator
+    from reranking import selected_items
+    from solution_cache import array_digest, problem_key
+
+    experiment = _experiment(args.config, args.formulation)
+    config = experiment.config
+    cache = _solution_cache(config)
+    list_length, cutoffs = experiment._cutoffs()
+    results_path = os.path.join('results', datetime.now().strftime('%d%m%Y%H%M%S'))
+    os.makedirs(results_path)
+
+    for dataset in config['ds_names']:
+        cells = [cell for cell in iter_cells(args.cells, [dataset])
+                 if cell[2] in config['ds_user_groups'] and cell[3] in config['ds_item_groups']]
+        if not cells:
+            print(f"No cells of {dataset} in {args.cells}, run 'python -m cpfair rank' first")
+            continue
+        data = experiment._load_dataset_groups(dataset)
+        frames = []
+        for _, model_name, user_group, i_group, path in cells:
+            cell = load_cell(path)
+            results_df = pd.DataFrame(columns=RESULT_COLUMNS)
+            cutoff_df = pd.DataFrame(columns=CUTOFF_COLUMNS)
+            U, P = cell['U'], cell['P']
+            evaluator = SelectionEvaluator(ground_truth=data['ground_truth'], pop_items=data['pop_items'],
+                                           total_users=data['eval_method'].total_users,
+                                           total_items=data['eval_method'].total_items, cutoffs=cutoffs,
+                                           active=U[:, 0] == 1, inactive=U[:, 1] == 1)
+            inputs_digest = array_digest(cell['S'], cell['Ahelp'], U, cell['Ihelp'], cell['recall_sizes'])
+            for fair_mode in config['fairness_categories']:
+                for user_eps, item_eps in epsilon_grid(config, fair_mode):
+                    solution = cache.get(problem_key(
+                        inputs_digest, config, formulation=args.formulation,
+                        optimisation=OPTIMISATIONS[args.formulation], fair_mode=fair_mode, user_eps=user_eps,
+                        item_eps=item_eps))
+                    if solution is None:
+                        raise ValueError(f"'{fair_mode}', {user_eps}, {item_eps} of {path} is not solved, "
+                                         f"run 'python -m cpfair solve' first")
+                    selection, item_totals = solution
+                    experiment._write_cell_results(
+                        results_df=results_df, cutoff_df=cutoff_df, fair_mode=fair_mode, dataset=dataset,
+                        model_name=model_name, user_group=user_group, i_group=i_group, user_eps=user_eps,
+                        item_eps=item_eps, evaluation=evaluator.evaluate(selected_items(selection, P)),
+                        item_totals=tuple(item_totals), total_users=len(U))
+            # in the row order of run_experiment: user group, item group, model
+            order = (config['ds_user_groups'].index(user_group), config['ds_item_groups'].index(i_group),
+                     int(cell['model_index']))
+            frames.append((order, clean_results(results_df), cutoff_df))
+
+        frames.sort(key=lambda frame: frame[0])
+        results = pd.concat([frame[1] for frame in frames])
+        results.to_csv(os.path.join(results_path, f"results_{dataset}.csv"), index=False)
+        if config.get('cutoffs'):
+            pd.concat([frame[2] for frame in frames]).to_csv(
+                os.path.join(results_path, f"results_{dataset}_cutoffs.csv"), index=False)
+        if config['boxplot']:
+            create_boxplots(os.path.join(results_path, 'boxplots'), dataset, results)
+    print(f"Results written to {results_path}")
+    return results_path
+
+
+def _queue(queue_dir: str, lease_seconds: float = 300, max_attempts: int = 3):
+    from work_queue import WorkQueue
+
+    os.makedirs(queue_dir, exist_ok=True)
+    return WorkQueue(os.path.join(queue_dir, 'queue.sqlite'), lease_seconds=lease_seconds, max_attempts=max_attempts)
+
+
+def coordinate(args):
+    # one rank task per dataset and model; every finished rank task enqueues the solves of its cells
+    config = _read_config(args.config)
+    cells_dir = args.cells or os.path.join(args.queue, 'cells')
+    queue = _queue(args.queue, args.lease, args.max_attempts)
+    queue.set_metadata(config=os.path.abspath(args.config), formulation=args.formulation,
+                       cells=os.path.abspath(cells_dir), monitor=config.get('monitor'))
+    models = config.get('models') or DEFAULT_MODELS
+    tasks = []
+    for dataset in config['ds_names']:
+        # external candidates replace the models of a dataset
+        external = dataset in (config.get('external_candidates') or {})
+        tasks += [('rank', {'dataset': dataset, 'model_index': model_index})
+                  for model_index in range(1 if external else len(models))]
+    print(f"Enqueued {queue.enqueue(tasks)} of {len(tasks)} rank tasks in {args.queue}")
+    return 0
+
+
+def _queue_handlers(metadata: dict) -> dict:
+    # the task functions of a worker, with the experiment, datasets and last cell kept between tasks
+    from copy import deepcopy
+
+    from cells import epsilon_grid, load_cell
+    from solution_cache import array_digest
+    from training import _fit
+
+    experiment = _experiment(metadata['config'], metadata['formulation'])
+    experiment._start_reports()
+    config = experiment.config
+    cache = _solution_cache(config)
+    datasets, loaded = {}, {}
+
+    def rank_task(payload):
+        dataset, model_index = payload['dataset'], payload['model_index']
+        if dataset not in datasets:
+            datasets[dataset] = experiment._load_dataset_groups(dataset)
+        data = datasets[dataset]
+        model = experiment._external_candidates(dataset)
+        report = {}
+        if model is None:
+            _, model, _, report = _fit(((dataset, model_index), deepcopy(experiment.models[model_index]),
+                                              data['eval_method'], experiment.metrics))
+        paths = _write_cells(experiment, metadata['cells'], dataset, data, model_index, model)
+        followups = [('solve', {'cell': path, 'fair_mode': fair_mode, 'user_eps': user_eps, 'item_eps': item_eps})
+                     for path in paths for fair_mode in config['fairness_categories']
+                     for user_eps, item_eps in epsilon_grid(config, fair_mode)]
+        return dict(report, Model=model.name), followups
+
+    def solve_task(payload):
+        if loaded.get('path') != payload['cell']:
+            cell = load_cell(payload['cell'])
+            loaded.update(path=payload['cell'], cell=cell, digest=array_digest(
+                cell['S'], cell['Ahelp'], cell['U'], cell['Ihelp'], cell['recall_sizes']))
+        report = _solve_into_cache(metadata['formulation'], config, cache, loaded['cell'], loaded['digest'],
+                                   payload['fair_mode'], payload['user_eps'], payload['item_eps'])
+        return report, []
+
+    return {'rank': rank_task, 'solve': solve_task}
+
+
+def work(args):
+    import socket
+
+    from work_queue import run_worker
+
+    from monitor import INTERVAL_VARIABLE, MONITOR_VARIABLE
+
+    queue = _queue(args.queue, args.lease, args.max_attempts)
+    metadata = queue.metadata()
+    if metadata.get('monitor'):
+        # the counters of every worker go to the queue directory, see 'python -m cpfair monitor'
+        os.environ.setdefault(MONITOR_VARIABLE, args.queue)
+        os.environ.setdefault(INTERVAL_VARIABLE, str(metadata['monitor'].get('interval', 5)))
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    completed = run_worker(queue, worker, _queue_handlers(metadata), poll_seconds=args.poll,
+                           max_tasks=args.max_tasks)
+    print(f"{worker} completed {completed} tasks")
+    return 0
+
+
+def reduce(args):
+    # the result tables of a finished queue, with the training and solve reports of its tasks
+    from work_queue import result_rows
+
+    queue = _queue(args.queue)
+    counts = queue.counts()
+    if not queue.finished():
+        print(f"The queue is not finished yet: {counts}")
+        return 1
+    for kind, payload, _, attempts, error, _ in queue.tasks(state='failed'):
+        print(f"Failed after {attempts} attempts: {kind} {payload}: {error}")
+    if counts.get('failed'):
+        return 1
+
+    metadata = queue.metadata()
+    results_path = _evaluate(argparse.Namespace(config=metadata['config'], formulation=metadata['formulation'],
+                                                cells=metadata['cells']))
+    for kind, name in (('rank', 'training.csv'), ('solve', 'solves.csv')):
+        rows = result_rows(queue, kind)
+        if rows:
+            with open(os.path.join(results_path, name), 'w', newline='') as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=list(dict.fromkeys(
+                    column for row in rows for column in row)))
+                writer.writeheader()
+                writer.writerows(rows)
+    return 0
+
+
+def distribute(args):
+    # the distributed mode on one host: a coordinator, local worker processes and the reducer
+    import subprocess
+
+    coordinate(args)
+    command = [sys.executable, '-m', 'cpfair'] + (['--no-progress'] if args.no_progress else []) + \
+        ['work', '--queue', args.queue, '--lease', str(args.lease), '--max-attempts', str(args.max_attempts),
+         '--poll', str(args.poll)]
+    monitor = _queue_monitor(args.queue)
+    workers = [subprocess.Popen(command) for _ in range(args.workers)]
+    for worker in workers:
+        worker.wait()
+    if monitor is not None:
+        monitor.stop('finished' if all(worker.returncode == 0 for worker in workers) else 'failed')
+    return reduce(args)
+
+
+def _queue_monitor(queue_dir: str):
+    # the monitor of a queue whose config has a monitor key, publishing the counters of all its workers
+    from monitor import RunMonitor
+
+    queue = _queue(queue_dir)
+    settings = queue.metadata().get('monitor')
+    if not settings:
+        return None
+    return RunMonitor(queue_dir, tasks=queue.counts, interval=settings.get('interval', 5)).start()
+
+
+def monitor(args):
+    # publish the status of a queue worked on by other hosts until it is finished
+    import time
+
+    queue = _queue(args.queue)
+    run_monitor = _queue_monitor(args.queue)
+    if run_monitor is None:
+        print("The config of the queue has no monitor key")
+        return 1
+    while not queue.finished():
+        time.sleep(run_monitor.interval)
+    run_monitor.stop('failed' if queue.counts().get('failed') else 'finished')
+    return 0
+
+
+def report(args):
+    from report import ReportGenerator, result_files
+
+    runs = [run for run in args.results if result_files(run)]
+    for run in set(args.results) - set(runs):
+        print(f"No results in {run}")
+    if not runs:
+        return 1
+    counts = ReportGenerator(runs, output=args.output, processes=args.processes, force=args.force,
+                             in_place=args.in_place).run()
+    print(f"Rendered {counts['rendered']} outputs, {counts['skipped']} were up to date")
+    return 0
+
+
+def equivalence(args):
+    import optimisation
+    from equivalence import EquivalenceHarness, summary
+
+    experiment = _experiment(args.config, args.formulation)
+    settings = experiment.config.get('equivalence') or {}
+    harness = EquivalenceHarness(experiment, args.formulation,
+                                 getattr(optimisation, OPTIMISATIONS[args.formulation].split('.')[1]),
+                                 backends=args.backends or settings.get('backends'),
+                                 tolerances=settings.get('tolerances'))
+    comparison = harness.run(args.cells, golden_path=args.golden or settings.get('golden'))
+    if comparison.empty:
+        return 1
+    results_path = os.path.join('results', datetime.now().strftime('%d%m%Y%H%M%S'))
+    os.makedirs(results_path)
+    comparison.to_csv(os.path.join(results_path, 'equivalence.csv'), index=False)
+    backends = summary(comparison)
+    backends.to_csv(os.path.join(results_path, 'equivalence_summary.csv'), index=False)
+    print(backends.to_string(index=False))
+    print(f"Comparison written to {results_path}")
+    # a failing comparison fails the command, so that it can gate a change
+    return 0 if comparison['Passed'].all() else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cpfair', description="Run CPFair experiments without a notebook")
+    parser.add_argument('--no-progress', action='store_true', help="disable the progress bars")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, function in (('run', run), ('rank', rank), ('solve', solve), ('evaluate', evaluate),
+                           ('simulate', simulate), ('ingest', ingest), ('equivalence', equivalence)):
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument('config', help="a table_*.yaml experiment config")
+        subparser.add_argument('--formulation', choices=FORMULATIONS, default='reproduction')
+        if name not in ('run', 'simulate', 'ingest'):
+            subparser.add_argument('--cells', default='cells', help="directory of the ranked cells")
+        if name == 'solve':
+            subparser.add_argument('--cell', action='append', help="solve only this cell file (repeatable)")
+        if name == 'equivalence':
+            subparser.add_argument('--backends', nargs='+', help="backends to check (default: all)")
+            subparser.add_argument('--golden', help="results/<run> to compare the reference path with")
+        subparser.set_defaults(function=function)
+    subparser = subparsers.add_parser('plan')
+    subparser.add_argument('configs', nargs='+',
+                           help="table_*.yaml experiment configs, each optionally followed by :<formulation>")
+    subparser.add_argument('--formulation', choices=FORMULATIONS, default='reproduction',
+                           help="the formulation of the configs without one")
+    subparser.set_defaults(function=plan)
+    subparser = subparsers.add_parser('preflight')
+    subparser.add_argument('config', help="a table_*.yaml experiment config")
+    subparser.add_argument('--memory-gb', type=float, required=True, help="memory budget of the run")
+    subparser.add_argument('--hours', type=float, help="time budget per cell")
+    subparser.add_argument('--cores', type=int, help="cores of the run (default: the cores of this host)")
+    subparser.add_argument('--models', type=int, help="models trained per dataset (default: the config's models)")
+    subparser.add_argument('--output', help="write the planned config to this path")
+    subparser.set_defaults(function=preflight)
+    subparser = subparsers.add_parser('report')
+    subparser.add_argument('results', nargs='+', help="results/<run> directories")
+    subparser.add_argument('--output', help="directory of the outputs, one subdirectory per run (default: report)")
+    subparser.add_argument('--in-place', action='store_true',
+                           help="write the outputs of every run into its own results directory")
+    subparser.add_argument('--processes', type=int, help="worker processes (default: the number of cores)")
+    subparser.add_argument('--force', action='store_true', help="render outputs whose inputs did not change too")
+    subparser.set_defaults(function=report)
+    for name, function in (('coordinate', coordinate), ('work', work), ('reduce', reduce),
+                           ('distribute', distribute), ('monitor', monitor)):
+        subparser = subparsers.add_parser(name)
+        if name in ('coordinate', 'distribute'):
+            subparser.add_argument('config', help="a table_*.yaml experiment config")
+            subparser.add_argument('--formulation', choices=FORMULATIONS, default='reproduction')
+            subparser.add_argument('--cells', help="directory of the ranked cells (default: <queue>/cells)")
+        subparser.add_argument('--queue', required=True, help="the shared queue directory")
+        subparser.add_argument('--lease', type=float, default=300, help="lease of a claimed task in seconds")
+        subparser.add_argument('--max-attempts', type=int, default=3, help="claims of a task before it fails")
+        if name in ('work', 'distribute'):
+            subparser.add_argument('--poll', type=float, default=5, help="seconds between claims of a waiting worker")
+        if name == 'work':
+            subparser.add_argument('--max-tasks', type=int, help="stop after this many tasks")
+        if name == 'distribute':
+            subparser.add_argument('--workers', type=int, default=os.cpu_count(), help="local worker processes")
+        subparser.set_defaults(function=function)
+    args = parser.parse_args(argv)
+
+    if args.no_progress:
+        os.environ['CPFAIR_PROGRESS'] = '0'
+    # figures are only ever written to files
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
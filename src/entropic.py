@@ -0,0 +1,94 @@
+import numpy as np
+
+from reranking import select_topk
+
+
+def _sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+class EntropicReranking():
+    """
+    Soft fair re-ranking with entropic regularisation, an alternative to solving the optimisation
+    problem for very large populations
+
+    Maximises sum_ij c_ij w_ij + temperature * H(w) over 0 <= w_ij <= 1 with sum_j w_ij = k per user,
+    where c are the objective coefficients of the fairness problem (reranking.objective_coefficients)
+    and H the Fermi-Dirac entropy. The optimum is w_ij = sigmoid((c_ij - alpha_i) / temperature -
+    beta * g_ij), found by iterative scaling: the user potentials alpha by vectorised bisection per
+    chunk of users, and, for a longtail exposure target, the item group potential beta by bisection
+    over passes of the chunks (g_ij: +1 for shorthead, -1 for longtail candidates). The soft
+    assignment is rounded to the k largest w_ij per user.
+
+    Parameters
+    ----------
+    k:
+      The length of the recommendation lists
+    temperature:
+      The entropic regularisation, in the unit of the coefficients; the selection approaches the exact
+      one as it goes to 0
+    long_tail_share:
+      Optional target share of the longtail item group (group 1) in the soft exposure
+    iterations:
+      Bisection steps of the potentials
+    """
+
+    def __init__(self, k: int = 10, temperature: float = 0.05, long_tail_share: float = None,
+                 iterations: int = 40):
+        self.k = k
+        self.temperature = temperature
+        self.long_tail_share = long_tail_share
+        self.iterations = iterations
+
+    def transport(self, coefficients: np.array, Ihelp: np.array, beta: float = 0.0) -> np.array:
+        """
+        The soft chunk x topk assignment w with row sums k for item group potential beta
+        """
+        logits = coefficients / self.temperature
+        if beta:
+            logits = logits - beta * (Ihelp[:, :, 0] - Ihelp[:, :, 1])
+        # row sums are decreasing in alpha: k or more at min - 40, almost 0 at max + 40
+        low = logits.min(axis=1, keepdims=True) - 40.0
+        high = logits.max(axis=1, keepdims=True) + 40.0
+        for _ in range(self.iterations):
+            alpha = (low + high) / 2
+            too_large = _sigmoid(logits - alpha).sum(axis=1, keepdims=True) > self.k
+            low = np.where(too_large, alpha, low)
+            high = np.where(too_large, high, alpha)
+        return _sigmoid(logits - (low + high) / 2)
+
+    def fit(self, coefficient_chunks, total_users: int) -> float:
+        """
+        The item group potential beta reaching the longtail share, 0 without a target
+
+        Parameters
+        ----------
+        coefficient_chunks:
+          A function returning an iterator over the (coefficients, Ihelp) of every chunk of users
+        """
+        if self.long_tail_share is None:
+            return 0.0
+
+        def share(beta):
+            exposure = sum(float((self.transport(coefficients, Ihelp, beta) * Ihelp[:, :, 1]).sum())
+                           for coefficients, Ihelp in coefficient_chunks())
+            return exposure / (self.k * total_users)
+
+        # the longtail share increases with beta, bracket the target first
+        low, high = 0.0, 1.0
+        while share(high) < self.long_tail_share:
+            if high >= 2 ** 10:
+                print(f"A longtail share of {self.long_tail_share} is not reachable within the candidates")
+                return high
+            low, high = high, 2 * high
+        for _ in range(self.iterations // 2):
+            middle = (low + high) / 2
+            if share(middle) < self.long_tail_share:
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def select(self, coefficients: np.array, Ihelp: np.array, beta: float = 0.0) -> np.array:
+        # boolean chunk x topk selection: the rounded soft assignment
+        return select_topk(self.transport(coefficients, Ihelp, beta), self.k)
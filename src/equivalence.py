@@ -0,0 +1,345 @@
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from cells import epsilon_grid, iter_cells, load_cell
+from clean_results import clean_results
+from experiment import _append_results_row, _eps_string, solve_problem
+from matrices import item_group_labels
+from metrics import RESULT_COLUMNS, SelectionEvaluator, metric_on_all, metric_per_group, selection_from_W
+from optimisation import greedy_selection
+from reranking import problem_coefficients, selected_items
+from streaming import StreamingCell, ranking_chunks
+
+
+# the columns of the clean results that are compared, as clean_results writes them
+COMPARED_COLUMNS = ['All', 'Active', 'Inactive', 'DCF', 'Nov.', 'Cov.', 'Short.', 'Long.', 'DPF', 'mCPF',
+                    'mCPF/All', 'delta (%)']
+# objective: relative difference of the objective values, metrics: difference of the compared columns
+# relative to 1 + the reference value (the clean results are rounded to four decimals), totals: relative
+# difference of the item and user group totals, selection: share of users with another selection
+DEFAULT_TOLERANCES = {'objective': 1e-6, 'metrics': 1e-4, 'totals': 1e-6, 'selection': 0.0}
+
+
+def solver_backend(harness, cell: dict, setting: tuple) -> dict:
+    # the optimisation with the solver settings of the config, evaluated in one vectorised pass
+    fair_mode, user_eps, item_eps = setting
+    selection, item_totals, report = solve_problem(
+        harness.optimisation, harness.config, fair_mode, user_eps, item_eps, eval_method=cell['eval_method'],
+        S=cell['S'], U=cell['U'], Ihelp=cell['Ihelp'], Ahelp=cell['Ahelp'], train_checkins=cell['train_checkins'],
+        formulation=harness.formulation)
+    return dict(selection=selection, item_totals=item_totals,
+                evaluation=cell['evaluator'].evaluate(selected_items(selection, cell['P']))[harness.list_length])
+
+
+def candidate_pool_backend(harness, cell: dict, setting: tuple) -> dict:
+    # the solver backend by column generation over the ranked candidates (solver: {candidate_pool: ...})
+    solver = dict(harness.config.get('solver') or {})
+    solver['candidate_pool'] = solver.get('candidate_pool') or {}
+    return solver_backend(SimpleNamespace(optimisation=harness.optimisation, formulation=harness.formulation,
+                                          list_length=harness.list_length, config=dict(harness.config, solver=solver)),
+                          cell, setting)
+
+
+def closed_form_backend(harness, cell: dict, setting: tuple) -> dict:
+    # the k largest objective coefficients of every user, the optimum for fixed epsilons
+    fair_mode, user_eps, item_eps = setting
+    selection = greedy_selection(harness.formulation, fair_mode, user_eps, item_eps, harness.config['topk'],
+                                 cell['eval_method'], cell['S'], cell['U'], cell['Ihelp'], cell['Ahelp'],
+                                 harness.list_length)
+    item_totals = (cell['Ihelp'][:, :selection.shape[1]] * selection[:, :, None]).sum(axis=(0, 1))
+    return dict(selection=selection, item_totals=item_totals,
+                evaluation=cell['evaluator'].evaluate(selected_items(selection, cell['P']))[harness.list_length])
+
+
+def streaming_backend(harness, cell: dict, setting: tuple) -> dict:
+    # the chunked re-ranking and evaluation of streaming.StreamingCell over the frozen score matrices;
+    # the selection is never materialised, its objective is summed chunk by chunk
+    total_users, total_items = cell['eval_method'].total_users, cell['eval_method'].total_items
+    chunks = ranking_chunks(harness.formulation, topk=harness.config['topk'],
+                            chunk_size=(harness.config.get('streaming') or {}).get('chunk_size', 4096),
+                            total_users=total_users, total_items=total_items, S=cell['S'], P=cell['P'])
+    streaming = StreamingCell(chunks, formulation=harness.formulation, U=cell['U'], item_labels=cell['item_labels'],
+                              train_checkins=cell['train_checkins'], ground_truth=harness.data['ground_truth'],
+                              pop_items=harness.data['pop_items'], total_users=total_users, total_items=total_items,
+                              no_item_groups=harness.config['no_of_item_groups'], k=harness.list_length)
+    result = streaming.run([setting], active=cell['U'][:, 0] == 1, inactive=cell['U'][:, 1] == 1)[0]
+    return dict(selection=None, item_totals=result['item_totals'], evaluation=result,
+                objective=lambda: streaming.objective_gap(setting)['Objective'])
+
+
+# the backends checked against the reference path, by name; a backend is called with the harness, the
+# cell and the (fairness mode, user epsilon, item epsilon) setting and returns the 'selection' (None if
+# it never exists), the 'item_totals' and the 'evaluation' at the list length (SelectionEvaluator.result),
+# optionally with an 'objective' callable when there is no selection
+BACKENDS = {
+    'solver': solver_backend,
+    'candidate_pool': candidate_pool_backend,
+    'closed_form': closed_form_backend,
+    'streaming': streaming_backend,
+}
+
+
+def _relative_difference(value, reference) -> float:
+    return float(np.max(np.abs(np.asarray(value, dtype=float) - np.asarray(reference, dtype=float)) /
+                        np.maximum(np.abs(np.asarray(reference, dtype=float)), 1e-10)))
+
+
+def compare_columns(frame: pd.DataFrame, reference: pd.DataFrame) -> list:
+    """
+    Per row the largest difference of the compared columns of two clean results in the same row order,
+    relative to 1 + the absolute reference value (absolute for small values, relative for large ones),
+    and the column it is in
+
+    Returns
+    ----------
+    differences:
+      (difference, column) per row, infinite where only one of the two values is missing
+    """
+    differences = []
+    for index in range(len(reference)):
+        worst, worst_column = 0.0, '-'
+        for column in COMPARED_COLUMNS:
+            value, expected = float(frame[column].iloc[index]), float(reference[column].iloc[index])
+            if np.isnan(value) and np.isnan(expected):
+                continue
+            difference = abs(value - expected) / (1 + abs(expected))
+            if np.isnan(difference):
+                difference = np.inf
+            if difference > worst:
+                worst, worst_column = difference, column
+        differences.append((worst, worst_column))
+    return differences
+
+
+class EquivalenceHarness():
+    """
+    Checks the alternative backends against the reference path on frozen score matrices
+
+    For every cell written by 'python -m cpfair rank' and every fairness setting of the config, the
+    reference path of the original code (the optimisation without solver settings, solved by CBC, and
+    the metrics of metric_per_group and metric_on_all read from the solved W) and every backend of
+    BACKENDS re-rank and evaluate the same arrays. Per setting and backend it compares the objective
+    value (the sum of the objective coefficients of the selection), the selected items, every column of
+    the clean results and the item and user group totals against the reference, with the tolerances of
+    DEFAULT_TOLERANCES, and records the seconds of both and the speed-up. Everything runs offline on the
+    CPU: the cells hold the scores, and the datasets are read from datasets/.
+
+    Parameters
+    ----------
+    experiment:
+      The Experiment of the formulation, for its config and dataset loading
+    formulation:
+      'reproduction', 'dcg_change' or 'proportional'
+    optimisation:
+      The optimisation function of the formulation, the reference solver
+    backends:
+      Names of BACKENDS to check, by default all
+    tolerances:
+      Tolerances overriding DEFAULT_TOLERANCES
+    """
+
+    def __init__(self, experiment, formulation: str, optimisation, backends: list = None, tolerances: dict = None):
+        self.experiment = experiment
+        self.config = experiment.config
+        self.formulation = formulation
+        self.optimisation = optimisation
+        self.backends = list(backends or BACKENDS)
+        unknown = [name for name in self.backends if name not in BACKENDS]
+        if unknown:
+            raise ValueError(f"Unknown backends {unknown}, choose from {list(BACKENDS)}")
+        self.tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+        self.list_length, _ = experiment._cutoffs()
+        self.data = None
+
+    def _cell(self, path: str, user_group: str, i_group: str) -> dict:
+        # the frozen arrays of a cell with the data of its dataset
+        cell = load_cell(path)
+        U, active_user_ids, inactive_user_ids = self.data['user_groups'][user_group]
+        shorthead_item_ids, longtail_item_ids = self.data['item_groups'][i_group]
+        eval_method = self.data['eval_method']
+        cell.update(eval_method=eval_method, train_checkins=self.data['train_checkins'],
+                    active_user_ids=active_user_ids, inactive_user_ids=inactive_user_ids,
+                    item_labels=item_group_labels(eval_method.total_items, shorthead_item_ids, longtail_item_ids))
+        cell['evaluator'] = SelectionEvaluator(
+            ground_truth=self.data['ground_truth'], pop_items=self.data['pop_items'],
+            total_users=eval_method.total_users, total_items=eval_method.total_items, cutoffs=[self.list_length],
+            active=cell['U'][:, 0] == 1, inactive=cell['U'][:, 1] == 1)
+        return cell
+
+    def _reference(self, cell: dict, setting: tuple) -> dict:
+        # the path of the original code: solve, then evaluate every user from the mip variables
+        fair_mode, user_eps, item_eps = setting
+        info = {}
+        W, item_group = self.optimisation(
+            fairness_mode=fair_mode, uepsilon=user_eps, iepsilon=item_eps, topk=self.config['topk'],
+            eval_method=cell['eval_method'], no_item_groups=self.config['no_of_item_groups'],
+            no_user_groups=self.config['no_of_user_groups'], S=cell['S'], U=cell['U'], Ihelp=cell['Ihelp'],
+            Ahelp=cell['Ahelp'], train_checkins=cell['train_checkins'], list_length=self.list_length, info=info)
+        metrics = dict(ground_truth=self.data['ground_truth'], pop_items=self.data['pop_items'], P=cell['P'],
+                       eval_method=cell['eval_method'], k=self.list_length)
+        evaluation = {'active': metric_per_group(group=cell['active_user_ids'], W=W, **metrics),
+                      'inactive': metric_per_group(group=cell['inactive_user_ids'], W=W, **metrics),
+                      'all': metric_on_all(W=W, **metrics)}
+        return dict(selection=selection_from_W(W), item_totals=[group.x for group in item_group],
+                    evaluation=evaluation, solver_objective=info.get('objective'))
+
+    def _objective(self, cell: dict, setting: tuple, selection: np.array) -> float:
+        fair_mode, user_eps, item_eps = setting
+        eval_method = cell['eval_method']
+        coefficients = problem_coefficients(self.formulation, fair_mode, user_eps, item_eps, self.config['topk'],
+                                            cell['S'], cell['U'], cell['Ihelp'], cell['Ahelp'],
+                                            eval_method.total_users, eval_method.total_items, k=self.list_length)
+        return float(coefficients[selection[:, :coefficients.shape[1]]].sum())
+
+    def _user_group_totals(self, cell: dict, selection: np.array) -> np.array:
+        # the dcg of every user group (group_ndcg_v of the optimisation)
+        topk = selection.shape[1]
+        return (cell['U'] * (cell['Ahelp'][:, :topk] * selection).sum(axis=1)[:, None]).sum(axis=0)
+
+    def _results(self, dataset: str, model_name: str, user_group: str, i_group: str, outcomes: list,
+                 total_users: int) -> pd.DataFrame:
+        # the clean results of the outcomes of every setting of a cell, as run_experiment writes them
+        results_df = pd.DataFrame(columns=RESULT_COLUMNS)
+        for (fair_mode, user_eps, item_eps), outcome in outcomes:
+            evaluation = outcome['evaluation']
+            _append_results_row(
+                results_df=results_df, fair_mode=fair_mode, dataset=dataset, model_name=model_name,
+                u_group=user_group, i_group=i_group, user_eps=user_eps, item_eps=item_eps,
+                metrics_all=evaluation['all'], metrics_active=evaluation['active'],
+                metrics_inactive=evaluation['inactive'], item_totals=tuple(outcome['item_totals']),
+                total_users=total_users, list_length=self.list_length)
+        return clean_results(results_df)
+
+    def compare_cell(self, dataset: str, model_name: str, user_group: str, i_group: str, path: str):
+        """
+        Run the reference path and every backend on all settings of one cell
+
+        Returns
+        ----------
+        (rows, reference):
+          The comparison row of every setting and backend, and the clean results of the reference path
+        """
+        cell = self._cell(path, user_group, i_group)
+        total_users = cell['eval_method'].total_users
+        settings = [(fair_mode, user_eps, item_eps) for fair_mode in self.config['fairness_categories']
+                    for user_eps, item_eps in epsilon_grid(self.config, fair_mode)]
+
+        runs = {}
+        for name in ['reference'] + self.backends:
+            function = self._reference if name == 'reference' else \
+                (lambda cell, setting, backend=BACKENDS[name]: backend(self, cell, setting))
+            outcomes = []
+            for setting in settings:
+                print(f"{dataset} {model_name} {user_group}_{i_group}: '{setting[0]}' with {name}")
+                start = time.time()
+                outcome = function(cell, setting)
+                outcome['seconds'] = time.time() - start
+                if outcome['selection'] is not None:
+                    outcome['objective'] = self._objective(cell, setting, outcome['selection'])
+                    outcome['user_totals'] = self._user_group_totals(cell, outcome['selection'])
+                elif callable(outcome.get('objective')):
+                    outcome['objective'] = outcome['objective']()
+                outcomes.append((setting, outcome))
+            runs[name] = (outcomes, self._results(dataset, model_name, user_group, i_group, outcomes, total_users))
+
+        reference_outcomes, reference = runs['reference']
+        rows = []
+        for name, (outcomes, results) in runs.items():
+            differences = compare_columns(results, reference)
+            for index, ((fair_mode, user_eps, item_eps), outcome) in enumerate(outcomes):
+                expected = reference_outcomes[index][1]
+                selection_share = np.nan
+                user_totals = np.nan
+                if outcome['selection'] is not None:
+                    selection_share = float((outcome['selection'] != expected['selection']).any(axis=1).mean())
+                    user_totals = _relative_difference(outcome['user_totals'], expected['user_totals'])
+                objective = _relative_difference(outcome['objective'], expected['objective'])
+                item_totals = _relative_difference(outcome['item_totals'], expected['item_totals'])
+                metric_difference, column = differences[index]
+                passed = (objective <= self.tolerances['objective'] and
+                          metric_difference <= self.tolerances['metrics'] and
+                          item_totals <= self.tolerances['totals'] and
+                          not user_totals > self.tolerances['totals'] and
+                          not selection_share > self.tolerances['selection'])
+                rows.append(dict(
+                    Dataset=dataset, Model=model_name, GUser=user_group, GItem=i_group, Type=fair_mode,
+                    User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps), Backend=name,
+                    Objective=outcome['objective'], Solver_Objective=outcome.get('solver_objective'),
+                    Objective_Diff=objective, Selection_Diff=selection_share,
+                    Metric_Diff=metric_difference, Metric_Column=column,
+                    Item_Totals_Diff=item_totals, User_Totals_Diff=user_totals,
+                    Seconds=round(outcome['seconds'], 4), Reference_Seconds=round(expected['seconds'], 4),
+                    Speedup=round(expected['seconds'] / max(outcome['seconds'], 1e-9), 2), Passed=passed))
+        return rows, reference
+
+    def compare_golden(self, reference: pd.DataFrame, golden_path: str, dataset: str) -> list:
+        """
+        The clean results of the reference path against the stored results of a run (e.g.
+        results/26062023105703), row by row per model and fairness type
+        """
+        path = os.path.join(golden_path, f"results_{dataset}.csv")
+        if not os.path.exists(path):
+            print(f"No golden results of {dataset} in {golden_path}")
+            return []
+        golden = pd.read_csv(path)
+        rows = []
+        for model_name, results in reference.groupby('Model', sort=False):
+            expected = golden[golden['Model'] == model_name]
+            if expected.empty:
+                print(f"No golden results of {dataset} {model_name}")
+                continue
+            if len(expected) != len(results) or list(expected['Type']) != list(results['Type']):
+                print(f"The golden results of {dataset} {model_name} have other settings, not compared")
+                continue
+            for index, (difference, column) in enumerate(compare_columns(results, expected)):
+                rows.append(dict(Dataset=dataset, Model=model_name, Type=results['Type'].iloc[index],
+                                 Backend='golden', Metric_Diff=difference, Metric_Column=column,
+                                 Passed=difference <= self.tolerances['metrics']))
+        return rows
+
+    def run(self, cells_dir: str, golden_path: str = None) -> pd.DataFrame:
+        """
+        Compare every cell of the config's datasets and groups in cells_dir
+
+        Returns
+        ----------
+        comparison:
+          One row per cell, setting and backend (the reference itself included, with its seconds), and
+          with golden_path one row per setting of the reference against the stored results
+        """
+        rows = []
+        for dataset in self.config['ds_names']:
+            cells = [cell for cell in iter_cells(cells_dir, [dataset])
+                     if cell[2] in self.config['ds_user_groups'] and cell[3] in self.config['ds_item_groups']]
+            if not cells:
+                print(f"No cells of {dataset} in {cells_dir}, run 'python -m cpfair rank' first")
+                continue
+            self.data = self.experiment._load_dataset_groups(dataset)
+            references = []
+            for cell in cells:
+                cell_rows, reference = self.compare_cell(*cell)
+                rows += cell_rows
+                references.append(reference)
+            if golden_path:
+                rows += self.compare_golden(pd.concat(references), golden_path, dataset)
+        return pd.DataFrame(rows)
+
+
+def summary(comparison: pd.DataFrame) -> pd.DataFrame:
+    # per backend the settings compared and passed, the largest differences and the speed-up
+    columns = ['Objective_Diff', 'Selection_Diff', 'Metric_Diff', 'Item_Totals_Diff', 'User_Totals_Diff']
+    comparison = comparison.reindex(columns=list(comparison.columns) + [
+        column for column in columns + ['Seconds', 'Reference_Seconds'] if column not in comparison.columns])
+    rows = []
+    for backend, results in comparison.groupby('Backend', sort=False):
+        row = dict(Backend=backend, Settings=len(results), Passed=int(results['Passed'].sum()))
+        row.update({f"Max_{column}": results[column].max() for column in columns})
+        seconds, reference_seconds = results['Seconds'].sum(), results['Reference_Seconds'].sum()
+        row.update(Seconds=round(seconds, 2), Reference_Seconds=round(reference_seconds, 2),
+                   Speedup=round(reference_seconds / seconds, 2) if seconds > 0 else np.nan)
+        rows.append(row)
+    return pd.DataFrame(rows)
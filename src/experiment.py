@@ -1,65 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 import os
+import time
+import warnings
 import yaml
 import cornac
 from cornac.eval_methods import BaseMethod
 import pandas as pd
 
 from clean_results import clean_results
-from boxplot import create_boxplots
 from dataset_utils import *
 from matrices import *
-from metrics import metric_per_group, metric_on_all
-from optimisation import fairness_optimisation
-
-
-def _write_experiment_results(
+from monitor import RunMonitor, record
+from metrics import CUTOFF_COLUMNS, RESULT_COLUMNS, SelectionEvaluator, selection_from_W
+from bootstrap import METRICS, Bootstrap, user_columns
+from candidate_pool import CandidatePoolGeneration
+from candidates import ExternalCandidates
+from cells import epsilon_grid, recall_sizes
+from entropic import EntropicReranking
+from groups import group_ids, group_matrix, load_group_membership, parse_group_threshold
+from interactions import InteractionState, TopShareGroups
+from item_exposure import ItemExposureDualAscent, exposure_bounds, exposure_incidence
+from optimisation import fairness_optimisation, greedy_selection
+from preflight import apply_plan, plan
+from replication import ReplicationRunner
+from reranking import problem_coefficients, select_topk, selected_items
+from simulation import FeedbackSimulation
+from solution_cache import SolutionCache, array_digest, problem_key
+from retrieval import build_item_index, cpfair_metrics, load_approximate_ranking_matrices, recall_report
+from streaming import StreamingCell, ranking_chunks
+from training import TrainingScheduler
+from writer import ResultWriter
+
+
+def _eps_string(eps) -> str:
+    if eps is not None:
+        return format(eps, '.7f')
+    return '-'
+
+
+def _append_cutoff_rows(
+        cutoff_df: pd.DataFrame,
+        fair_mode: str,
+        dataset: str,
+        model_name: str,
+        u_group: int,
+        i_group: int,
+        user_eps: float,
+        item_eps: float,
+        evaluation: dict,
+        cutoffs: list):
+    # one row per cutoff of a SelectionEvaluator result, metrics ordered as in the results rows
+    for cutoff in cutoffs:
+        groups = evaluation[cutoff]
+        metrics = [groups[group][metric] for metric in range(5) for group in ('all', 'active', 'inactive')]
+        cutoff_df.loc[len(cutoff_df)] = [dataset, model_name, u_group, i_group, fair_mode, _eps_string(user_eps),
+                                         _eps_string(item_eps), cutoff] + metrics
+    return cutoff_df
+
+
+def _append_results_row(
         results_df: pd.DataFrame,
         fair_mode: str,
-        W: np.array,
-        active_user_ids: set,
-        inactive_user_ids: set,
         dataset: str,
         model_name: str,
         u_group: int,
         i_group: int,
         user_eps: float,
         item_eps: float,
-        eval_method: BaseMethod,
-        item_group,
-        ground_truth,
-        pop_items,
-        P):
-
-    # Calculate the metrics for both groups and all users/items
-    ndcg_ac, pre_ac, rec_ac, novelty_ac, coverage_ac = metric_per_group(
-        group=active_user_ids, W=W, ground_truth=ground_truth, pop_items=pop_items, P=P, eval_method=eval_method)
-    ndcg_iac, pre_iac, rec_iac, novelty_iac, coverage_iac = metric_per_group(
-        group=inactive_user_ids, W=W, ground_truth=ground_truth, pop_items=pop_items, P=P, eval_method=eval_method)
-    ndcg_all, pre_all, rec_all, novelty_all, coverage_all = metric_on_all(
-        W=W, ground_truth=ground_truth, pop_items=pop_items, P=P, eval_method=eval_method)
-
-    if user_eps is not None:
-        user_eps_string = format(user_eps, '.7f')
-    else:
-        user_eps_string = '-'
-
-    if item_eps is not None:
-        item_eps_string = format(item_eps, '.7f')
-    else:
-        item_eps_string = '-'
-
-    results = [dataset, model_name, u_group, i_group, fair_mode, user_eps_string, item_eps_string,
+        metrics_all: tuple,
+        metrics_active: tuple,
+        metrics_inactive: tuple,
+        item_totals: tuple,
+        total_users: int,
+        list_length: int = 10):
+    # metrics_* are (ndcg, precision, recall, novelty, coverage) tuples
+    ndcg_all, pre_all, rec_all, novelty_all, coverage_all = metrics_all
+    ndcg_ac, pre_ac, rec_ac, novelty_ac, coverage_ac = metrics_active
+    ndcg_iac, pre_iac, rec_iac, novelty_iac, coverage_iac = metrics_inactive
+
+    results = [dataset, model_name, u_group, i_group, fair_mode, _eps_string(user_eps), _eps_string(item_eps),
                ndcg_all, ndcg_ac, ndcg_iac, pre_all, pre_ac, pre_iac, rec_all, rec_ac, rec_iac,
                novelty_all, novelty_ac, novelty_iac, coverage_all, coverage_ac, coverage_iac,
-               item_group[0].x, item_group[1].x, f"{eval_method.total_users*10}=={item_group[0].x + item_group[1].x}"]
+               item_totals[0], item_totals[1], f"{total_users*list_length}=={item_totals[0] + item_totals[1]}"]
     results_df.loc[len(results_df)] = results
 
     return results_df
 
 
-def _run_cornac_experiment(dataset: str, models: list, metrics: list):
+def _load_dataset(dataset: str):
     print(f"Datasets: {dataset}")
     # read train, tune, test datasets
     train_data, _, test_data = read_data(dataset=dataset)
@@ -80,14 +110,101 @@ def _run_cornac_experiment(dataset: str, models: list, metrics: list):
     # load ground truth dict
     ground_truth = read_ground_truth(f"datasets/{dataset}/{dataset}_test.txt", eval_method=eval_method)
 
-    # run Cornac models and create experiment object including models' results
-    exp = cornac.Experiment(eval_method=eval_method, models=models, metrics=metrics)
-    exp.run()
-
-    return eval_method, total_users, total_items, train_checkins, pop_items, ground_truth, exp
+    return eval_method, total_users, total_items, train_checkins, pop_items, ground_truth
+
+
+def solve_problem(optimisation, config: dict, fair_mode: str, user_eps, item_eps, eval_method, S, U, Ihelp, Ahelp,
+                  train_checkins, formulation: str = 'reproduction', threads: int = None):
+    """
+    Solve the optimisation problem of one fairness setting with the solver settings of the config,
+    with at most threads solver threads (the solver's default if None)
+
+    With a candidate_pool in the solver settings the problem is solved by column generation over the
+    ranked candidates (candidate_pool.CandidatePoolGeneration) instead of the optimisation function,
+    which keeps the solver model to the pooled candidates of every user
+
+    Returns
+    ----------
+    (selection, item_totals, report):
+      The boolean users x topk selection of W, the exposure of every item group and the row of the
+      setting in solves.csv, with the Backend that gave the selection ('solver', 'candidate_pool' or the
+      'greedy' fallback) and the number of W Variables of the solver model
+    """
+    info = {}
+    solve_start = time.time()
+    solver = dict(config.get('solver') or {})
+    candidate_pool = solver.pop('candidate_pool', None)
+    # accepted from older configs: the problems are linear programs, for which CBC does not use a start
+    solver.pop('warm_start', None)
+    if threads is not None:
+        solver['threads'] = threads
+    list_length = config.get('list_length', 10)
+    selection, backend = None, 'solver'
+    if candidate_pool is not None:
+        coefficients = problem_coefficients(formulation, fair_mode, user_eps, item_eps, config['topk'], S, U, Ihelp,
+                                            Ahelp, eval_method.total_users, eval_method.total_items, k=list_length)
+        selection, info = CandidatePoolGeneration(k=list_length, **dict(solver, **candidate_pool)).solve(
+            coefficients)
+        if selection is not None:
+            item_totals = list((Ihelp[:, :config['topk']] * selection[:, :, None]).sum(axis=(0, 1)))
+            report = dict(Type=fair_mode, User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps),
+                          Backend='candidate_pool', Status=info['status'], Objective=info['objective'],
+                          Bound=info['bound'], Gap=info['gap'], Seconds=round(time.time() - solve_start, 2),
+                          Variables=int(info['pool'].sum()), Rounds=info['rounds'],
+                          Candidates=round(float(info['pool'].mean()), 2), Converged=info['converged'])
+            record(stage='solving', status=report['Status'], seconds=report['Seconds'])
+            return selection, item_totals, report
+        info['heuristic'] = select_topk(coefficients, list_length)
+    else:
+        W, item_group = optimisation(
+            fairness_mode=fair_mode,
+            uepsilon=user_eps,
+            iepsilon=item_eps,
+            topk=config['topk'],
+            eval_method=eval_method,
+            no_item_groups=config['no_of_item_groups'],
+            no_user_groups=config['no_of_user_groups'],
+            S=S,
+            U=U,
+            Ihelp=Ihelp,
+            Ahelp=Ahelp,
+            train_checkins=train_checkins,
+            list_length=list_length,
+            info=info,
+            # max_seconds, max_gap and threads of the optimisation
+            **solver)
+        if info['status'] in ('OPTIMAL', 'FEASIBLE'):
+            selection = selection_from_W(W)
+            item_totals = [group.x for group in item_group]
+
+    if selection is None:
+        # the time budget ran out before the solver found a solution
+        print(f"No solution within the time budget ({info['status']}), using the greedy selection")
+        backend = 'greedy'
+        selection = info['heuristic']
+        item_totals = list((Ihelp[:, :config['topk']] * selection[:, :, None]).sum(axis=(0, 1)))
+        # for fixed epsilons the problem separates per user, so the objective of the greedy selection is
+        # also the optimum and bounds it
+        coefficients = problem_coefficients(formulation, fair_mode, user_eps, item_eps, config['topk'], S, U, Ihelp,
+                                            Ahelp, eval_method.total_users, eval_method.total_items, k=list_length)
+        objective = float(coefficients[selection].sum())
+        info.update(objective=objective, bound=objective, gap=0.0)
+    # the backend that gave the selection and the W variables of its model, which the pre-flight
+    # planner calibrates its time estimates with
+    report = dict(Type=fair_mode, User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps),
+                  Backend=backend, Status=info['status'], Objective=info['objective'], Bound=info['bound'],
+                  Gap=info['gap'], Seconds=round(time.time() - solve_start, 2),
+                  Variables=eval_method.total_users * config['topk'])
+    record(stage='solving', status=report['Status'], seconds=report['Seconds'])
+    return selection, item_totals, report
 
 
 class Experiment():
+    # the optimisation problem solved for every fairness mode, overridden by the extensions
+    optimisation = staticmethod(fairness_optimisation)
+    # the name of that problem for the vectorised re-ranking (reranking.FORMULATIONS)
+    formulation = 'reproduction'
+
     def __init__(self, config_path: str, models: list, metrics: list):
         if not os.path.exists(config_path):
             raise ValueError(
@@ -100,16 +217,662 @@ class Experiment():
             self.config = yaml.safe_load(config_file)
 
         self.fairness_categories = self.config['fairness_categories']
+        self._check_config()
         self.download_data()
 
+    @classmethod
+    def from_config(cls, config: dict, models: list, metrics: list):
+        # an experiment of a loaded config whose data is already downloaded, e.g. in a worker process
+        experiment = cls.__new__(cls)
+        experiment.models = models
+        experiment.metrics = metrics
+        experiment.config = config
+        experiment.fairness_categories = config['fairness_categories']
+        experiment._check_config()
+        return experiment
+
+    def _check_config(self):
+        # combinations of config keys and the formulation that the run does not support
+        if self.config.get('retrieval') and self.formulation == 'reproduction':
+            # the reproduction reads the first topk columns of the unsorted exhaustive S, which are the
+            # scores of the first topk items and not of the ranked candidates; the approximate S only
+            # holds the scores of the retrieved candidates, best first, so the problems would differ
+            raise ValueError("Approximate retrieval is not supported with the reproduction formulation, "
+                             "use dcg_change or proportional!")
+        if self.config.get('replication') and self.config.get('external_candidates'):
+            # the replicated runs retrain the models with every seed, external candidates have no model to seed
+            raise ValueError("External candidates are not supported with replication, run them without it!")
+
+    def _start_reports(self):
+        # empty reports of a run, filled by the cells and written next to the results
+        self.retrieval_reports = []
+        self.retrieval_metric_reports = []
+        self.training_reports = []
+        self.solve_reports = []
+        self.entropic_reports = []
+        self.item_exposure_reports = []
+        self.bootstrap_reports = []
+        self.bootstrap_pool = None
+        if self.config.get('bootstrap'):
+            self.bootstrap_pool = ThreadPoolExecutor(max_workers=self.config['bootstrap'].get('workers', 2))
+
     def download_data(self):
         # Download all the datasets in the configuration and create their user and item groups.
         download_datasets(self.config['ds_names'])
+        if self.config.get('group_source', 'files') == 'derived':
+            # groups are derived from the train interactions instead
+            return
         download_user_groups(
             self.config['ds_names'], self.config['ds_user_groups'])
         download_item_groups(
             self.config['ds_names'], self.config['ds_item_groups'])
 
+    def _epsilon_grid(self, fair_mode: str) -> list:
+        # (user epsilon, item epsilon) pairs to optimise for a fairness mode
+        return epsilon_grid(self.config, fair_mode)
+
+    def _user_groups(self, dataset: str, user_group: str, eval_method: BaseMethod, state=None):
+        if self.config.get('group_source', 'files') == 'derived':
+            if state is not None:
+                # the live groups of the interaction store, for the users of the train set
+                membership = self._live_membership(state.users, user_group, eval_method.total_users)
+            else:
+                membership = load_group_membership(dataset, 'users', user_group, eval_method)
+            U = group_matrix(membership, self.config['no_of_user_groups'])
+            return U, group_ids(membership, 0), group_ids(membership, 1)
+
+        # read matrix U for users and their groups
+        U = np.zeros((eval_method.total_users, self.config['no_of_user_groups']))
+
+        # load active and inactive users
+        active_user_ids = read_user_groups(
+            user_group_fpath=os.getcwd() + f"/user_groups/{dataset}/{user_group}/active_ids.txt", gid=0,
+            U=U, eval_method=eval_method)
+        inactive_user_ids = read_user_groups(
+            user_group_fpath=os.getcwd() + f"/user_groups/{dataset}/{user_group}/inactive_ids.txt", gid=1,
+            U=U, eval_method=eval_method)
+        return U, active_user_ids, inactive_user_ids
+
+    def _item_groups(self, dataset: str, i_group: str, eval_method: BaseMethod, state=None):
+        if self.config.get('group_source', 'files') == 'derived':
+            if state is not None:
+                membership = self._live_membership(state.items, i_group, eval_method.total_items)
+            else:
+                membership = load_group_membership(dataset, 'items', i_group, eval_method)
+            return group_ids(membership, 0), group_ids(membership, 1)
+
+        # read matrix I for items and their groups
+        I = np.zeros((eval_method.total_items, self.config['no_of_item_groups']))
+
+        # read item groups
+        shorthead_item_ids = read_item_groups(
+            item_group_fpath=os.getcwd() + f"/item_groups/{dataset}/{i_group}/shorthead_items.txt", gid=0,
+            eval_method=eval_method, I=I)
+        longtail_item_ids = read_item_groups(
+            item_group_fpath=os.getcwd() + f"/item_groups/{dataset}/{i_group}/longtail_items.txt", gid=1,
+            eval_method=eval_method, I=I)
+        return shorthead_item_ids, longtail_item_ids
+
+    @staticmethod
+    def _live_membership(groups: TopShareGroups, group: str, total: int) -> np.array:
+        # the membership of the store's groups, or of groups with the share of another group name
+        if groups.share != parse_group_threshold(group):
+            groups = TopShareGroups(groups.counts, parse_group_threshold(group))
+        return groups.membership[:total]
+
+    def _interaction_state(self, dataset: str, eval_method: BaseMethod, train_checkins, pop_items, log: str):
+        """
+        The interaction store of a dataset with the lines appended to its interaction log ingested
+
+        The store is read from <interaction_store>/<dataset>_<train size>.npz, or built from the train
+        interactions the first time, and saved with the read offset of the log, so that every run only
+        reads the lines appended since the previous one.
+        """
+        store_dir = self.config.get('interaction_store', 'interaction_store')
+        store_path = os.path.join(store_dir, f"{dataset}_{len(eval_method.train_set.uir_tuple[0])}.npz")
+        if os.path.exists(store_path):
+            state = InteractionState.load(store_path)
+        else:
+            state = InteractionState(train_checkins, eval_method.total_users, eval_method.total_items,
+                                     parse_group_threshold(self.config['ds_user_groups'][0]),
+                                     parse_group_threshold(self.config['ds_item_groups'][0]),
+                                     uid_map=eval_method.train_set.uid_map, iid_map=eval_method.train_set.iid_map,
+                                     pop_items=pop_items)
+        uids, _, switched_users, switched_items = state.ingest_file(log)
+        print(f"Ingested {len(uids)} new interactions of {dataset} ({len(state)} in total, "
+              f"{state.total_users - eval_method.total_users} unseen users, "
+              f"{state.total_items - eval_method.total_items} unseen items, "
+              f"{len(switched_users)} users and {len(switched_items)} items changed group)")
+        state.save(store_path)
+        return state
+
+    def _external_candidates(self, dataset: str):
+        # external candidate lists configured for the dataset, either a path or {path:, name:}
+        candidates = (self.config.get('external_candidates') or {}).get(dataset)
+        if candidates is None:
+            return None
+        if isinstance(candidates, str):
+            return ExternalCandidates(candidates)
+        return ExternalCandidates(candidates['path'], name=candidates.get('name', 'External'))
+
+    def _load_ranking(self, model, dataset: str, eval_method: BaseMethod, train_checkins, reports: list = None):
+        # exhaustive ranking, or approximate candidate retrieval when the config enables it
+        total_users, total_items = eval_method.total_users, eval_method.total_items
+        record(stage='scoring')
+        if isinstance(model, ExternalCandidates):
+            return model.load(eval_method=eval_method, topk=self.config['topk'])
+
+        retrieval = self.config.get('retrieval')
+        block_size = self.config.get('score_block_size', 1024)
+        if retrieval:
+            index = build_item_index(model, total_items, n_clusters=retrieval.get('n_clusters'))
+            if index is not None:
+                if retrieval.get('report', False):
+                    report = recall_report(model, total_users=total_users, total_items=total_items,
+                                           topk=self.config['topk'], train_checkins=train_checkins,
+                                           n_clusters=retrieval.get('n_clusters'))
+                    report.insert(0, 'Model', model.name)
+                    report.insert(0, 'Dataset', dataset)
+                    (self.retrieval_reports if reports is None else reports).append(report)
+                ranking = load_approximate_ranking_matrices(model=model, total_users=total_users,
+                                                            total_items=total_items, topk=self.config['topk'],
+                                                            index=index, n_probe=retrieval.get('n_probe', 8),
+                                                            block_size=block_size)
+                record(users=total_users)
+                return ranking
+            print(f"{model.name} does not expose its factors, ranking it exhaustively")
+        ranking = load_ranking_matrices(model=model, total_users=total_users, total_items=total_items,
+                                        topk=self.config['topk'], block_size=block_size)
+        record(users=total_users)
+        return ranking
+
+    def _solution_cache(self):
+        # the solution cache of the config, None when it is not enabled
+        settings = self.config.get('solution_cache')
+        if not settings:
+            return None
+        return SolutionCache(cache_dir=settings.get('path', 'solution_cache'), max_mb=settings.get('max_mb', 512))
+
+    def _concurrent_solves(self, settings: int):
+        # (solve threads, solver threads per solve) of the settings of a cell, (1, None) to solve them in turn
+        concurrent = self.config.get('concurrent_solves')
+        if not concurrent or settings < 2:
+            return 1, None
+        cores = os.cpu_count() or 1
+        workers = max(1, min(concurrent.get('workers') or cores, settings, cores))
+        # the solver threads of all concurrent solves together do not exceed the cores
+        solver_threads = concurrent.get('solver_threads') or max(1, cores // workers)
+        return workers, max(1, min(solver_threads, cores // workers))
+
+    def _entropic_backend(self, list_length: int):
+        # the entropic soft re-ranking of the config, None for the exact selection
+        entropic = self.config.get('entropic')
+        if not entropic:
+            return None
+        return EntropicReranking(k=list_length, temperature=entropic.get('temperature', 0.05),
+                                 long_tail_share=entropic.get('long_tail_share'))
+
+    def _item_exposure_selection(self, coefficients, P, total_items, list_length, dataset, model_name,
+                                 user_group, i_group, fair_mode, user_eps, item_eps):
+        # re-ranking with per-item exposure floors and ceilings (multiples of the mean item exposure)
+        exposure = self.config['item_exposure']
+        incidence = exposure_incidence(P[:, :self.config['topk']])
+        floors, ceilings = exposure_bounds(incidence, total_items, list_length, floor=exposure.get('floor', 0.0),
+                                           ceiling=exposure.get('ceiling'))
+        solver = ItemExposureDualAscent(k=list_length, iterations=exposure.get('iterations', 200))
+        selection, info = solver.solve(coefficients, incidence, floors, ceilings)
+        self.item_exposure_reports.append(dict(
+            Dataset=dataset, Model=model_name, GUser=user_group, GItem=i_group, Type=fair_mode,
+            User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps), Status=info['status'],
+            Objective_Unbounded=coefficients[select_topk(coefficients, list_length)].sum(),
+            Objective=info['objective'], Violation=info['violation'],
+            Largest_Violation=info['largest_violation'], Iterations=info['iterations']))
+        if info['status'] != 'CONVERGED':
+            # a selection violating the bounds is not a result of them, its '+IE' row is left out
+            reason = 'no selection meets them' if info['status'] == 'INFEASIBLE' else \
+                f"a violation of {info['violation']:.1f} is left after {info['iterations']} iterations"
+            warnings.warn(f"Item exposure bounds of {model_name} on {dataset}, '{fair_mode}', {user_eps}, {item_eps}: "
+                          f"{reason}; the '{fair_mode}+IE' row is not written (see item_exposure.csv)")
+            return None
+        return selection
+
+    def _cutoffs(self):
+        # the recommended list length and the cutoffs to evaluate, always including the list length
+        list_length = self.config.get('list_length', 10)
+        cutoffs = sorted(set(self.config.get('cutoffs') or []) | {list_length})
+        if cutoffs[-1] > list_length:
+            print(f"Cutoffs above the list length {list_length} are not evaluated")
+            cutoffs = [cutoff for cutoff in cutoffs if cutoff <= list_length]
+        return list_length, cutoffs
+
+    def _write_cell_results(self, results_df, cutoff_df, fair_mode, dataset, model_name, user_group, i_group,
+                            user_eps, item_eps, evaluation, item_totals, total_users):
+        list_length, cutoffs = self._cutoffs()
+        _append_results_row(
+            results_df=results_df, fair_mode=fair_mode, dataset=dataset, model_name=model_name, u_group=user_group,
+            i_group=i_group, user_eps=user_eps, item_eps=item_eps, metrics_all=evaluation[list_length]['all'],
+            metrics_active=evaluation[list_length]['active'], metrics_inactive=evaluation[list_length]['inactive'],
+            item_totals=item_totals, total_users=total_users, list_length=list_length)
+        if self.config.get('cutoffs'):
+            _append_cutoff_rows(
+                cutoff_df=cutoff_df, fair_mode=fair_mode, dataset=dataset, model_name=model_name, u_group=user_group,
+                i_group=i_group, user_eps=user_eps, item_eps=item_eps, evaluation=evaluation, cutoffs=cutoffs)
+
+    def _inputs_digest(self, S, Ahelp, U, Ihelp, train_checkins) -> str:
+        # content hash of the arrays of a cell's optimisation problems, see solution_cache
+        return array_digest(S, Ahelp, U, Ihelp, recall_sizes(train_checkins, len(U)))
+
+    def _solve_setting(self, fair_mode, user_eps, item_eps, eval_method, S, U, Ihelp, Ahelp, train_checkins,
+                       cell: dict, cache: SolutionCache = None, inputs_digest: str = None, threads: int = None,
+                       reports: list = None):
+        """
+        Solve the optimisation problem of one fairness setting, or read it from the solution cache
+
+        Parameters
+        ----------
+        cell:
+          The Dataset, Model, GUser and GItem of the cell, for the solve report
+        threads:
+          Solver threads of the optimisation, the solver's default if None
+        reports:
+          The list the solve report is appended to, by default solve_reports
+
+        Returns
+        ----------
+        (selection, item_totals):
+          The boolean users x topk selection of W and the exposure of every item group
+        """
+        key = None
+        if cache is not None:
+            key = problem_key(inputs_digest, self.config, formulation=self.formulation,
+                              optimisation=f"{self.optimisation.__module__}.{self.optimisation.__name__}",
+                              fair_mode=fair_mode, user_eps=user_eps, item_eps=item_eps)
+            cached = cache.get(key)
+            if cached is not None:
+                print(f"Solution of '{fair_mode}', {user_eps}, {item_eps} read from the cache")
+                return cached
+
+        selection, item_totals, report = solve_problem(
+            self.optimisation, self.config, fair_mode, user_eps, item_eps, eval_method=eval_method, S=S, U=U,
+            Ihelp=Ihelp, Ahelp=Ahelp, train_checkins=train_checkins, formulation=self.formulation, threads=threads)
+        (self.solve_reports if reports is None else reports).append(dict(cell, **report))
+        if key is not None:
+            cache.put(key, selection, item_totals)
+        return selection, item_totals
+
+    def _run_in_memory(self, results_df, cutoff_df, model, dataset, user_group, i_group, eval_method, U,
+                       active_user_ids, inactive_user_ids, shorthead_item_ids, longtail_item_ids, train_checkins,
+                       ground_truth, pop_items):
+        total_users = eval_method.total_users
+        list_length, cutoffs = self._cutoffs()
+        # load matrix S and P
+        S, P = self._load_ranking(model=model, dataset=dataset, eval_method=eval_method,
+                                  train_checkins=train_checkins)
+
+        # load matrix Ahelp
+        Ahelp = load_ground_truth_index(total_users=total_users, topk=self.config['topk'],
+                                        P=P, train_checkins=train_checkins)
+
+        # load matrix Ihelp
+        Ihelp = read_item_index(total_users=total_users, topk=self.config['topk'],
+                                no_item_groups=self.config['no_of_item_groups'],
+                                P=P, shorthead_item_ids=shorthead_item_ids,
+                                longtail_item_ids=longtail_item_ids)
+
+        # all cutoffs are evaluated from the one ranked selection of every optimisation
+        evaluator = SelectionEvaluator(ground_truth=ground_truth, pop_items=pop_items, total_users=total_users,
+                                       total_items=eval_method.total_items, cutoffs=cutoffs,
+                                       active=U[:, 0] == 1, inactive=U[:, 1] == 1)
+
+        cache = self._solution_cache()
+        inputs_digest = None
+        if cache is not None:
+            # the arrays are hashed once per cell, the settings of every optimisation are added to the key
+            inputs_digest = self._inputs_digest(S, Ahelp, U, Ihelp, train_checkins)
+
+        # per-user columns of every setting for the bootstrap intervals
+        bootstrap_settings = [] if self.config.get('bootstrap') else None
+
+        # iterate on fairness mode: user, item, user-item
+        settings = [(fair_mode, user_eps, item_eps) for fair_mode in self.config['fairness_categories']
+                    for user_eps, item_eps in self._epsilon_grid(fair_mode)]
+        workers, threads = self._concurrent_solves(len(settings))
+        # the solve reports of every setting, added to solve_reports in the order of the settings
+        reports = [[] for _ in settings]
+
+        def solve(position):
+            fair_mode, user_eps, item_eps = settings[position]
+            return self._solve_setting(
+                fair_mode, user_eps, item_eps, eval_method=eval_method, S=S, U=U, Ihelp=Ihelp, Ahelp=Ahelp,
+                train_checkins=train_checkins, cell=dict(Dataset=dataset, Model=model.name, GUser=user_group,
+                                                         GItem=i_group),
+                cache=cache, inputs_digest=inputs_digest, threads=threads, reports=reports[position])
+
+        if workers > 1:
+            # the settings share S, P, U, Ahelp and Ihelp read-only; the threads overlap in the solver,
+            # which runs without the interpreter lock (building the python-mip models does not)
+            print(f"Solving {len(settings)} settings in {workers} threads with {threads} solver threads each")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                solutions = list(pool.map(solve, range(len(settings))))
+        else:
+            solutions = map(solve, range(len(settings)))
+
+        for position, ((fair_mode, user_eps, item_eps), (selection, item_totals)) in \
+                enumerate(zip(settings, solutions)):
+            self.solve_reports.extend(reports[position])
+            predicted = selected_items(selection, P)
+            self._write_cell_results(
+                results_df=results_df, cutoff_df=cutoff_df, fair_mode=fair_mode, dataset=dataset,
+                model_name=model.name, user_group=user_group, i_group=i_group, user_eps=user_eps,
+                item_eps=item_eps, evaluation=evaluator.evaluate(predicted),
+                item_totals=tuple(item_totals), total_users=total_users)
+            if bootstrap_settings is not None:
+                ndcg = evaluator.user_vectors(predicted, list_length)['ndcg']
+                bootstrap_settings.append(((fair_mode, user_eps, item_eps), user_columns(
+                    ndcg, active=U[:, 0] == 1, inactive=U[:, 1] == 1,
+                    short=(Ihelp[:, :, 0] * selection).sum(axis=1), long=(Ihelp[:, :, 1] * selection).sum(axis=1))))
+
+            if self.config.get('item_exposure'):
+                # the same setting with individual item exposure bounds, written as type '<mode>+IE'
+                coefficients = problem_coefficients(
+                    self.formulation, fair_mode, user_eps, item_eps, self.config['topk'], S, U, Ihelp, Ahelp,
+                    total_users, eval_method.total_items, k=list_length)
+                selection = self._item_exposure_selection(
+                    coefficients, P, eval_method.total_items, list_length, dataset=dataset,
+                    model_name=model.name, user_group=user_group, i_group=i_group, fair_mode=fair_mode,
+                    user_eps=user_eps, item_eps=item_eps)
+                if selection is None:
+                    continue
+                self._write_cell_results(
+                    results_df=results_df, cutoff_df=cutoff_df, fair_mode=f"{fair_mode}+IE", dataset=dataset,
+                    model_name=model.name, user_group=user_group, i_group=i_group, user_eps=user_eps,
+                    item_eps=item_eps, evaluation=evaluator.evaluate(selected_items(selection, P)),
+                    item_totals=tuple((Ihelp[:, :, :2] * selection[:, :, None]).sum(axis=(0, 1))),
+                    total_users=total_users)
+
+        if bootstrap_settings:
+            self._submit_bootstrap(dict(Dataset=dataset, Model=model.name, GUser=user_group, GItem=i_group),
+                                   bootstrap_settings)
+
+        retrieval = self.config.get('retrieval')
+        if retrieval and retrieval.get('report', False) and not isinstance(model, ExternalCandidates) and \
+                get_model_factors(model) is not None:
+            self._retrieval_metrics(dataset, model, user_group, i_group, settings, eval_method, U, train_checkins,
+                                    shorthead_item_ids, longtail_item_ids, evaluator, approximate=(S, P))
+
+    def _retrieval_metrics(self, dataset, model, user_group, i_group, settings, eval_method, U, train_checkins,
+                           shorthead_item_ids, longtail_item_ids, evaluator, approximate: tuple):
+        """
+        The downstream effect of the approximate retrieval of a cell: nDCG, DCF, DPF and mCPF of every
+        setting re-ranked from the approximate and from the exhaustive ranking, written to
+        retrieval_metrics.csv. Both are re-ranked in closed form (reranking.select_topk), the optimum of
+        the problems for fixed epsilons, so that the difference is that of the rankings alone.
+        """
+        total_users, topk = eval_method.total_users, self.config['topk']
+        list_length, _ = self._cutoffs()
+        exact = load_ranking_matrices(model=model, total_users=total_users, total_items=eval_method.total_items,
+                                      topk=topk, block_size=self.config.get('score_block_size', 1024))
+        metrics = {}
+        for name, (S, P) in (('exact', exact), ('approximate', approximate)):
+            Ahelp = load_ground_truth_index(total_users=total_users, topk=topk, P=P, train_checkins=train_checkins)
+            Ihelp = read_item_index(total_users=total_users, topk=topk, no_item_groups=self.config['no_of_item_groups'],
+                                    P=P, shorthead_item_ids=shorthead_item_ids, longtail_item_ids=longtail_item_ids)
+            for setting in settings:
+                selection = greedy_selection(self.formulation, *setting, topk, eval_method, S, U, Ihelp, Ahelp,
+                                             list_length)
+                evaluation = evaluator.evaluate(selected_items(selection, P))[list_length]
+                item_totals = (Ihelp[:, :, :2] * selection[:, :, None]).sum(axis=(0, 1))
+                metrics[name, setting] = cpfair_metrics(evaluation, item_totals, total_users, list_length)
+
+        for fair_mode, user_eps, item_eps in settings:
+            row = dict(Dataset=dataset, Model=model.name, GUser=user_group, GItem=i_group, Type=fair_mode,
+                       User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps))
+            exact_metrics = metrics['exact', (fair_mode, user_eps, item_eps)]
+            approximate_metrics = metrics['approximate', (fair_mode, user_eps, item_eps)]
+            for metric in exact_metrics:
+                row[f"{metric}_exact"] = exact_metrics[metric]
+                row[f"{metric}_approximate"] = approximate_metrics[metric]
+                row[f"{metric}_difference"] = approximate_metrics[metric] - exact_metrics[metric]
+            self.retrieval_metric_reports.append(row)
+
+    def _submit_bootstrap(self, cell: dict, settings: list):
+        # the intervals of a cell are computed in the background while the next cells are solved
+        bootstrap = self.config['bootstrap']
+        keys = [key for key, _ in settings]
+        baseline = next((position for position, (fair_mode, _, _) in enumerate(keys) if fair_mode == 'N'), None)
+        engine = Bootstrap(replicates=bootstrap.get('replicates', 2000), confidence=bootstrap.get('confidence', 0.95),
+                           seed=bootstrap.get('seed', 0))
+        future = self.bootstrap_pool.submit(engine.compare, [columns for _, columns in settings], baseline)
+        self.bootstrap_reports.append((cell, keys, future))
+
+    def _bootstrap_rows(self) -> list:
+        # the rows of bootstrap.csv, waiting for the cells that are still being resampled
+        rows = []
+        for cell, keys, future in self.bootstrap_reports:
+            for position, row in enumerate(future.result()):
+                fair_mode, user_eps, item_eps = keys[position // len(METRICS)]
+                rows.append(dict(cell, Type=fair_mode, User_EPS=_eps_string(user_eps),
+                                 Item_EPS=_eps_string(item_eps), **row))
+        return rows
+
+    def _run_streaming(self, results_df, cutoff_df, model, dataset, user_group, i_group, eval_method, U,
+                       active_user_ids, inactive_user_ids, shorthead_item_ids, longtail_item_ids, train_checkins,
+                       ground_truth, pop_items):
+        # chunked scoring -> indicators -> re-ranking -> metric accumulation, see streaming.StreamingCell
+        streaming = self.config.get('streaming') or {}
+        total_users, total_items = eval_method.total_users, eval_method.total_items
+        chunk_size = streaming.get('chunk_size', 4096)
+        list_length, cutoffs = self._cutoffs()
+
+        if isinstance(model, ExternalCandidates) or self.config.get('retrieval'):
+            S, P = self._load_ranking(model=model, dataset=dataset, eval_method=eval_method,
+                                      train_checkins=train_checkins)
+            chunks = ranking_chunks(self.formulation, topk=self.config['topk'], chunk_size=chunk_size,
+                                    total_users=total_users, total_items=total_items, S=S, P=P)
+        else:
+            chunks = ranking_chunks(self.formulation, topk=self.config['topk'], chunk_size=chunk_size,
+                                    total_users=total_users, total_items=total_items, model=model)
+
+        cell = StreamingCell(chunks, formulation=self.formulation, U=U,
+                             item_labels=item_group_labels(total_items, shorthead_item_ids, longtail_item_ids),
+                             train_checkins=train_checkins, ground_truth=ground_truth, pop_items=pop_items,
+                             total_users=total_users, total_items=total_items,
+                             no_item_groups=self.config['no_of_item_groups'], k=list_length, cutoffs=cutoffs,
+                             backend=self._entropic_backend(list_length))
+
+        settings = []
+        for fair_mode in self.config['fairness_categories']:
+            for user_eps, item_eps in self._epsilon_grid(fair_mode):
+                if fair_mode in ('P', 'CP') and streaming.get('long_tail_share') is not None:
+                    # iteratively refined instead of fixed item group multiplier
+                    item_eps = cell.refine_item_epsilon(fair_mode, user_eps, streaming['long_tail_share'])
+                settings.append((fair_mode, user_eps, item_eps))
+
+        for (fair_mode, user_eps, item_eps), result in zip(settings, cell.run(
+                settings, active=U[:, 0] == 1, inactive=U[:, 1] == 1)):
+            self._write_cell_results(
+                results_df=results_df, cutoff_df=cutoff_df, fair_mode=fair_mode, dataset=dataset,
+                model_name=model.name, user_group=user_group, i_group=i_group, user_eps=user_eps,
+                item_eps=item_eps, evaluation=result['cutoffs'], item_totals=result['item_totals'],
+                total_users=total_users)
+
+            setting = (fair_mode, user_eps, item_eps)
+            if cell.uses_backend(setting) and self.config['entropic'].get('report', False):
+                gap = cell.objective_gap(setting)
+                self.entropic_reports.append(dict(
+                    Dataset=dataset, Model=model.name, GUser=user_group, GItem=i_group, Type=fair_mode,
+                    User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps), **gap))
+
+    def _load_dataset_groups(self, dataset: str):
+        # the data of a dataset and its user and item groups, shared by all models
+        eval_method, total_users, total_items, train_checkins, pop_items, ground_truth = _load_dataset(dataset)
+        state = None
+        log = (self.config.get('interaction_logs') or {}).get(dataset)
+        if log:
+            # interactions logged after the train file: Ahelp, novelty and derived groups read the live
+            # store, limited to the users and items the models are trained on
+            state = self._interaction_state(dataset, eval_method, train_checkins, pop_items, log)
+            train_checkins, pop_items = state.train_checkins(total_users, total_items), state.pop_items(total_items)
+        data = dict(eval_method=eval_method, train_checkins=train_checkins, pop_items=pop_items,
+                    ground_truth=ground_truth, user_groups={}, item_groups={}, interaction_state=state)
+
+        for user_group in self.config['ds_user_groups']:
+            # matrix U for users and their groups, and the active and inactive users
+            U, active_user_ids, inactive_user_ids = self._user_groups(dataset, user_group, eval_method, state)
+            data['user_groups'][user_group] = (U, active_user_ids, inactive_user_ids)
+
+            print(f"ActiveU: {len(active_user_ids)}, \
+                  InActive: {len(inactive_user_ids)}, \
+                    All: {len(active_user_ids) + len(inactive_user_ids)}")
+
+        for i_group in self.config['ds_item_groups']:
+            # item groups
+            shorthead_item_ids, longtail_item_ids = self._item_groups(dataset, i_group, eval_method, state)
+            data['item_groups'][i_group] = (shorthead_item_ids, longtail_item_ids)
+
+            print(f"No. of Shorthead Items: {len(shorthead_item_ids)} \
+                  and No. of Longtaill Items: {len(longtail_item_ids)}")
+
+        return data
+
+    def _trained_models(self):
+        """
+        The rankers of every dataset as they become available
+
+        Yields
+        ----------
+        (dataset, data, model_index, model, last):
+          The dataset, its data (_load_dataset_groups), the position of the model in the models of the
+          experiment, the trained model (or external candidates) and whether it is the last of the dataset
+        """
+        training = self.config.get('training')
+        if not training:
+            for dataset in self.config['ds_names']:
+                external = self._external_candidates(dataset)
+                if external is not None:
+                    # candidates of an external recommender replace the trained Cornac models
+                    data = self._load_dataset_groups(dataset)
+                    yield dataset, data, 0, external, True
+                    continue
+                data = self._load_dataset_groups(dataset)
+                record(stage='training')
+                exp = cornac.Experiment(eval_method=data['eval_method'], models=deepcopy(self.models),
+                                        metrics=self.metrics)
+                exp.run()
+                for model_index, model in enumerate(exp.models):
+                    yield dataset, data, model_index, model, model_index == len(exp.models) - 1
+            return
+
+        # all (dataset, model) pairs are trained concurrently and ranked as soon as they finish
+        datasets, jobs, remaining = {}, [], {}
+        for dataset in self.config['ds_names']:
+            datasets[dataset] = self._load_dataset_groups(dataset)
+            external = self._external_candidates(dataset)
+            if external is not None:
+                yield dataset, datasets[dataset], 0, external, True
+                continue
+            remaining[dataset] = len(self.models)
+            jobs += [((dataset, model_index), model, datasets[dataset]['eval_method'], self.metrics)
+                     for model_index, model in enumerate(deepcopy(self.models))]
+
+        scheduler = TrainingScheduler(processes=training.get('processes'),
+                                      threads_per_job=training.get('threads_per_job', 1))
+        for (dataset, model_index), model, test_result, report in scheduler.run(jobs):
+            print(f"\nTEST ({dataset}):\n...\n{test_result}")
+            self.training_reports.append(dict(Dataset=dataset, Model=model.name, **report))
+            remaining[dataset] -= 1
+            yield dataset, datasets[dataset], model_index, model, remaining[dataset] == 0
+
+    def _rank_model(self, dataset: str, data: dict, model) -> dict:
+        # re-rank and evaluate one model for every user and item group, per (user group, item group) the
+        # results and cutoff frames; the config keys of dataset_overrides apply to this dataset only
+        overrides = (self.config.get('dataset_overrides') or {}).get(dataset)
+        if overrides:
+            config = self.config
+            # without the overrides, which apply once
+            self.config = dict(config, **overrides)
+            self.config.pop('dataset_overrides', None)
+            try:
+                return self._rank_model(dataset, data, model)
+            finally:
+                self.config = config
+
+        frames = {}
+        for user_group, (U, active_user_ids, inactive_user_ids) in data['user_groups'].items():
+            for i_group, (shorthead_item_ids, longtail_item_ids) in data['item_groups'].items():
+                results_df = pd.DataFrame(columns=RESULT_COLUMNS)
+
+                cutoff_df = pd.DataFrame(columns=CUTOFF_COLUMNS)
+
+                print(f"> Model: {model.name}")
+                record(stage='re-ranking')
+                cell = dict(results_df=results_df, cutoff_df=cutoff_df, model=model, dataset=dataset,
+                            user_group=user_group, i_group=i_group, eval_method=data['eval_method'], U=U,
+                            active_user_ids=active_user_ids, inactive_user_ids=inactive_user_ids,
+                            shorthead_item_ids=shorthead_item_ids, longtail_item_ids=longtail_item_ids,
+                            train_checkins=data['train_checkins'], ground_truth=data['ground_truth'],
+                            pop_items=data['pop_items'])
+                if self.config.get('streaming') or self.config.get('entropic'):
+                    # the entropic backend re-ranks chunk by chunk like the streaming mode
+                    self._run_streaming(**cell)
+                else:
+                    self._run_in_memory(**cell)
+                frames[user_group, i_group] = (results_df, cutoff_df)
+                record(cells=1)
+        return frames
+
+    def run_simulation(self):
+        """
+        Simulate the feedback loop of every re-ranking setting (simulation.FeedbackSimulation) for every
+        model and user and item group, each from the same initial state, and write the per-round
+        trajectories to simulation_<dataset>.csv
+
+        The groups of the simulation are the top shares of the user and item group names (e.g. '005')
+        by train interactions, as group_source 'derived', so that they can follow the interactions.
+        """
+        experiment_time_run = datetime.now().strftime('%d%m%Y%H%M%S')
+        os.makedirs(f"results/{experiment_time_run}")
+        self._start_reports()
+        simulation = dict(self.config['simulation'])
+        rounds = simulation.pop('rounds', 100)
+        list_length = self.config.get('list_length', 10)
+
+        trajectories = {}
+        for dataset, data, _, model, _ in self._trained_models():
+            eval_method = data['eval_method']
+            S, P = self._load_ranking(model=model, dataset=dataset, eval_method=eval_method,
+                                      train_checkins=data['train_checkins'])
+            for user_group in self.config['ds_user_groups']:
+                for i_group in self.config['ds_item_groups']:
+                    for fair_mode in self.config['fairness_categories']:
+                        for user_eps, item_eps in self._epsilon_grid(fair_mode):
+                            print(f"Simulating '{fair_mode}', {user_eps}, {item_eps} for {model.name} on {dataset}")
+                            state = InteractionState(data['train_checkins'], eval_method.total_users,
+                                                     eval_method.total_items, parse_group_threshold(user_group),
+                                                     parse_group_threshold(i_group), pop_items=data['pop_items'])
+                            simulator = FeedbackSimulation(
+                                self.formulation, (fair_mode, user_eps, item_eps), S=S, P=P, state=state,
+                                ground_truth=data['ground_truth'], topk=self.config['topk'], k=list_length,
+                                no_user_groups=self.config['no_of_user_groups'],
+                                no_item_groups=self.config['no_of_item_groups'], model=model, **simulation)
+                            for row in simulator.run(rounds):
+                                trajectories.setdefault(dataset, []).append(dict(
+                                    Dataset=dataset, Model=model.name, GUser=user_group, GItem=i_group,
+                                    Type=fair_mode, User_EPS=_eps_string(user_eps), Item_EPS=_eps_string(item_eps),
+                                    **row))
+
+        for dataset, rows in trajectories.items():
+            trajectories[dataset] = pd.DataFrame(rows)
+            trajectories[dataset].to_csv(f"results/{experiment_time_run}/simulation_{dataset}.csv", index=False)
+        return trajectories
+
+    def _total_cells(self) -> int:
+        # the (dataset, model, user group, item group) cells of a run, for the progress of the monitor
+        models = sum(1 if dataset in (self.config.get('external_candidates') or {}) else len(self.models)
+                     for dataset in self.config['ds_names'])
+        seeds = len((self.config.get('replication') or {}).get('seeds') or [None])
+        return models * seeds * len(self.config['ds_user_groups']) * len(self.config['ds_item_groups'])
+
     def run_experiment(self):
         experiment_time_run = datetime.now().strftime('%d%m%Y%H%M%S')
 
@@ -117,221 +880,78 @@ class Experiment():
             os.mkdir('results')
         os.mkdir('results/' + experiment_time_run)
 
-        experiment_results = {}
+        monitor = self.config.get('monitor')
+        if not monitor:
+            return self._run_experiment(experiment_time_run)
+        # progress, throughput, memory and solver statuses of all processes of the run, published to
+        # status.json and metrics.prom in the results directory
+        with RunMonitor(f"results/{experiment_time_run}", interval=monitor.get('interval', 5)) as self.monitor:
+            return self._run_experiment(experiment_time_run)
+
+    def _run_experiment(self, experiment_time_run: str):
+        if self.config.get('preflight'):
+            # fit the run to the memory and time budget before anything is trained
+            planned = plan(self.config, models=len(self.models), **self.config['preflight'])
+            print(planned.round(3).to_string(index=False))
+            planned.to_csv(f"results/{experiment_time_run}/preflight.csv", index=False)
+            self.config = apply_plan(self.config, planned)
+        if self.config.get('monitor'):
+            self.monitor.total_cells = self._total_cells()
+
+        self._start_reports()
+        if self.config.get('replication'):
+            # every model is trained, re-ranked and evaluated for several seeds, in parallel
+            replication = self.config['replication']
+            return ReplicationRunner(self, seeds=replication['seeds'], processes=replication.get('processes'),
+                                     threads_per_job=replication.get('threads_per_job', 1)).run(
+                f"results/{experiment_time_run}")
 
-        for dataset in self.config['ds_names']:
-
-            eval_method, total_users, total_items, \
-                train_checkins, pop_items, ground_truth, exp = _run_cornac_experiment(
-                    dataset, deepcopy(self.models), self.metrics)
-
-            for user_group in self.config['ds_user_groups']:
-                # read matrix U for users and their groups
-                U = np.zeros((total_users, self.config['no_of_user_groups']))
-
-                # load active and inactive users
-                active_user_ids = read_user_groups(
-                    user_group_fpath=os.getcwd() + f"/user_groups/{dataset}/{user_group}/active_ids.txt", gid=0,
-                    U=U, eval_method=eval_method)
-                inactive_user_ids = read_user_groups(
-                    user_group_fpath=os.getcwd() + f"/user_groups/{dataset}/{user_group}/inactive_ids.txt", gid=1,
-                    U=U, eval_method=eval_method)
-
-                print(f"ActiveU: {len(active_user_ids)}, \
-                      InActive: {len(inactive_user_ids)}, \
-                        All: {len(active_user_ids) + len(inactive_user_ids)}")
+        experiment_results = {}
+        ranked = {}
+        run_path = f"results/{experiment_time_run}"
+        written = {'solves': 0, 'training': 0}
+
+        # results, traces and boxplots are written in the background while the next models are computed
+        with ResultWriter(**(self.config.get('writer') or {})) as writer:
+            for dataset, data, model_index, model, last in self._trained_models():
+                ranked.setdefault(dataset, {})[model_index] = self._rank_model(dataset, data, model)
+                # the solve and training reports of the model's cells, appended as they come
+                for name, rows in (('solves', self.solve_reports), ('training', self.training_reports)):
+                    if len(rows) > written[name]:
+                        writer.write_csv(pd.DataFrame(rows[written[name]:]), f"{run_path}/{name}.csv", append=True)
+                        written[name] = len(rows)
+                if not last:
+                    continue
+
+                # all models of the dataset are ranked, its results are written in group and model order
+                results, cutoffs = [], []
+                for user_group in self.config['ds_user_groups']:
+                    for i_group in self.config['ds_item_groups']:
+                        for model_index in sorted(ranked[dataset]):
+                            results_df, cutoff_df = ranked[dataset][model_index][user_group, i_group]
+                            results.append(clean_results(results_df))
+                            cutoffs.append(cutoff_df)
+                del ranked[dataset]
+                experiment_results[dataset] = pd.concat(results)
+
+                writer.write_csv(experiment_results[dataset], f"{run_path}/results_{dataset}.csv")
+                if self.config.get('cutoffs'):
+                    writer.write_csv(pd.concat(cutoffs), f"{run_path}/results_{dataset}_cutoffs.csv")
+
+                if self.config['boxplot']:
+                    writer.boxplots(f"{run_path}/boxplots", dataset, experiment_results[dataset])
+
+            if self.retrieval_reports:
+                writer.write_csv(pd.concat(self.retrieval_reports), f"{run_path}/retrieval_recall.csv")
+            if self.retrieval_metric_reports:
+                writer.write_csv(pd.DataFrame(self.retrieval_metric_reports), f"{run_path}/retrieval_metrics.csv")
+            if self.item_exposure_reports:
+                writer.write_csv(pd.DataFrame(self.item_exposure_reports), f"{run_path}/item_exposure.csv")
+            if self.entropic_reports:
+                writer.write_csv(pd.DataFrame(self.entropic_reports), f"{run_path}/entropic_gap.csv")
+            if self.bootstrap_reports:
+                writer.write_csv(pd.DataFrame(self._bootstrap_rows()), f"{run_path}/bootstrap.csv")
+            if self.bootstrap_pool is not None:
+                self.bootstrap_pool.shutdown()
 
-                for i_group in self.config['ds_item_groups']:
-                    # read matrix I for items and their groups
-                    I = np.zeros(
-                        (total_items, self.config['no_of_item_groups']))
-
-                    # read item groups
-                    shorthead_item_ids = read_item_groups(
-                        item_group_fpath=os.getcwd() + f"/item_groups/{dataset}/{i_group}/shorthead_items.txt", gid=0,
-                        eval_method=eval_method, I=I)
-                    longtail_item_ids = read_item_groups(
-                        item_group_fpath=os.getcwd() + f"/item_groups/{dataset}/{i_group}/longtail_items.txt", gid=1,
-                        eval_method=eval_method, I=I)
-
-                    print(f"No. of Shorthead Items: {len(shorthead_item_ids)} \
-                          and No. of Longtaill Items: {len(longtail_item_ids)}")
-
-                    for model in exp.models:
-                        results_df = pd.DataFrame(columns=[
-                            "Dataset", "Model", "GUser", "GItem", "Type", "User_EPS", "Item_EPS",
-                            "ndcg_ALL", "ndcg_ACT", "ndcg_INACT", "Pre_ALL", "Pre_ACT", "Pre_INACT",
-                            "Rec_ALL", "Rec_ACT", "Rec_INACT", "Nov_ALL", "Nov_ACT", "Nov_INACT",
-                            "Cov_ALL", "Cov_ACT", "Cov_INACT", "Short_Items", "Long_Items", "All_Items"
-                        ])
-
-                        print(f"> Model: {model.name}")
-                        # load matrix S and P
-                        S, P = load_ranking_matrices(model=model, total_users=total_users,
-                                                     total_items=total_items, topk=self.config['topk'])
-
-                        # load matrix Ahelp
-                        Ahelp = load_ground_truth_index(total_users=total_users, topk=self.config['topk'],
-                                                        P=P, train_checkins=train_checkins)
-
-                        # load matrix Ihelp
-                        Ihelp = read_item_index(total_users=total_users, topk=50,
-                                                no_item_groups=self.config['no_of_item_groups'],
-                                                P=P, shorthead_item_ids=shorthead_item_ids,
-                                                longtail_item_ids=longtail_item_ids)
-
-                        # iterate on fairness mode: user, item, user-item
-                        for fair_mode in self.config['fairness_categories']:
-                            if fair_mode == 'N':
-                                W, item_group = fairness_optimisation(
-                                    fairness_mode=fair_mode,
-                                    uepsilon=None,
-                                    iepsilon=None,
-                                    topk=self.config['topk'],
-                                    eval_method=eval_method,
-                                    no_item_groups=self.config['no_of_item_groups'],
-                                    no_user_groups=self.config['no_of_user_groups'],
-                                    S=S,
-                                    U=U,
-                                    Ihelp=Ihelp,
-                                    Ahelp=Ahelp,
-                                    train_checkins=train_checkins)
-
-                                _write_experiment_results(
-                                    results_df=results_df,
-                                    fair_mode=fair_mode,
-                                    W=W,
-                                    active_user_ids=active_user_ids,
-                                    inactive_user_ids=inactive_user_ids,
-                                    dataset=dataset,
-                                    model_name=model.name,
-                                    u_group=user_group,
-                                    i_group=i_group,
-                                    user_eps=None,
-                                    item_eps=None,
-                                    eval_method=eval_method,
-                                    item_group=item_group,
-                                    ground_truth=ground_truth,
-                                    pop_items=pop_items,
-                                    P=P
-                                )
-
-                            if fair_mode == 'C':
-                                for user_eps in self.config['user_epsilon']:
-                                    W, item_group = fairness_optimisation(
-                                        fairness_mode=fair_mode,
-                                        uepsilon=user_eps,
-                                        iepsilon=None,
-                                        topk=self.config['topk'],
-                                        eval_method=eval_method,
-                                        no_item_groups=self.config['no_of_item_groups'],
-                                        no_user_groups=self.config['no_of_user_groups'],
-                                        S=S,
-                                        U=U,
-                                        Ihelp=Ihelp,
-                                        Ahelp=Ahelp,
-                                        train_checkins=train_checkins)
-
-                                    _write_experiment_results(
-                                        results_df=results_df,
-                                        fair_mode=fair_mode,
-                                        W=W,
-                                        active_user_ids=active_user_ids,
-                                        inactive_user_ids=inactive_user_ids,
-                                        dataset=dataset,
-                                        model_name=model.name,
-                                        u_group=user_group,
-                                        i_group=i_group,
-                                        user_eps=user_eps,
-                                        item_eps=None,
-                                        eval_method=eval_method,
-                                        item_group=item_group,
-                                        ground_truth=ground_truth,
-                                        pop_items=pop_items,
-                                        P=P
-                                    )
-
-                            if fair_mode == 'P':
-                                for item_eps in self.config['item_epsilon']:
-                                    W, item_group = fairness_optimisation(
-                                        fairness_mode=fair_mode,
-                                        uepsilon=None,
-                                        iepsilon=item_eps,
-                                        topk=self.config['topk'],
-                                        eval_method=eval_method,
-                                        no_item_groups=self.config['no_of_item_groups'],
-                                        no_user_groups=self.config['no_of_user_groups'],
-                                        S=S,
-                                        U=U,
-                                        Ihelp=Ihelp,
-                                        Ahelp=Ahelp,
-                                        train_checkins=train_checkins)
-
-                                    _write_experiment_results(
-                                        results_df=results_df,
-                                        fair_mode=fair_mode,
-                                        W=W,
-                                        active_user_ids=active_user_ids,
-                                        inactive_user_ids=inactive_user_ids,
-                                        dataset=dataset,
-                                        model_name=model.name,
-                                        u_group=user_group,
-                                        i_group=i_group,
-                                        user_eps=None,
-                                        item_eps=item_eps,
-                                        eval_method=eval_method,
-                                        item_group=item_group,
-                                        ground_truth=ground_truth,
-                                        pop_items=pop_items,
-                                        P=P
-                                    )
-
-                            if fair_mode == 'CP':
-                                for user_eps in self.config['user_epsilon']:
-                                    for item_eps in self.config['item_epsilon']:
-                                        W, item_group = fairness_optimisation(
-                                            fairness_mode=fair_mode,
-                                            uepsilon=user_eps,
-                                            iepsilon=item_eps,
-                                            topk=self.config['topk'],
-                                            eval_method=eval_method,
-                                            no_item_groups=self.config['no_of_item_groups'],
-                                            no_user_groups=self.config['no_of_user_groups'],
-                                            S=S,
-                                            U=U,
-                                            Ihelp=Ihelp,
-                                            Ahelp=Ahelp,
-                                            train_checkins=train_checkins)
-
-                                        _write_experiment_results(
-                                            results_df=results_df,
-                                            fair_mode=fair_mode,
-                                            W=W,
-                                            active_user_ids=active_user_ids,
-                                            inactive_user_ids=inactive_user_ids,
-                                            dataset=dataset,
-                                            model_name=model.name,
-                                            u_group=user_group,
-                                            i_group=i_group,
-                                            user_eps=user_eps,
-                                            item_eps=item_eps,
-                                            eval_method=eval_method,
-                                            item_group=item_group,
-                                            ground_truth=ground_truth,
-                                            pop_items=pop_items,
-                                            P=P
-                                        )
-
-                        if dataset in experiment_results:
-                            experiment_results[dataset] = pd.concat([experiment_results[dataset], clean_results(results_df)])
-                        else:
-                            experiment_results[dataset] = clean_results(results_df)
-
-            experiment_results[dataset].to_csv(
-                f"results/{experiment_time_run}/results_{dataset}.csv", index=False)
-            
-            if self.config['boxplot']:
-                create_boxplots(f"results/{experiment_time_run}/boxplots", dataset, experiment_results[dataset])
-                        
         return experiment_results
-                        
\ No newline at end of file
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+from cornac.eval_methods import BaseMethod
+
+
+def parse_group_threshold(group: str) -> float:
+    """
+    The share of a group name of the config, e.g. '005' -> 0.05 (top 5% users), '020' -> 0.20
+    """
+    return int(group) / 100
+
+
+def interaction_counts(eval_method: BaseMethod):
+    """
+    Number of train interactions of every user (activity) and every item (popularity) in one pass
+    over Cornac's train set index arrays
+    """
+    user_idx, item_idx, _ = eval_method.train_set.uir_tuple
+    return (np.bincount(user_idx, minlength=eval_method.total_users),
+            np.bincount(item_idx, minlength=eval_method.total_items))
+
+
+def bucket_groups(counts: np.array, shares: list) -> np.array:
+    """
+    Split users or items into groups by their interaction counts
+
+    Parameters
+    ----------
+    counts:
+      Interaction count of every user or item
+    shares:
+      The share of the population in every group, from the highest counts down, e.g. [0.05, 0.95]
+      for the top 5% and the rest. Group sizes are rounded, the last group takes the remainder.
+
+    Returns
+    ----------
+    membership:
+      The group id of every user or item
+    """
+    order = np.argsort(-counts, kind='stable')
+    sizes = np.round(np.cumsum(shares[:-1]) * len(counts)).astype(np.int64)
+    membership = np.empty(len(counts), dtype=np.int64)
+    membership[order] = np.searchsorted(sizes, np.arange(len(counts)), side='right')
+    return membership
+
+
+def top_share_groups(counts: np.array, threshold: float) -> np.array:
+    # group 0: the top threshold share by count (active users, shorthead items), group 1: the others
+    return bucket_groups(counts, [threshold, 1 - threshold])
+
+
+def load_group_membership(dataset: str, kind: str, group: str, eval_method: BaseMethod,
+                          cache_dir: str = 'group_cache') -> np.array:
+    """
+    Active/inactive (kind 'users') or shorthead/longtail (kind 'items') membership derived from the
+    train interactions, cached as .npy keyed by dataset, threshold and train set size
+
+    Parameters
+    ----------
+    group:
+      The group name of the config, whose threshold is parsed with parse_group_threshold
+    """
+    train_set = eval_method.train_set
+    key = f"{kind}_{group}_{eval_method.total_users}x{eval_method.total_items}_{len(train_set.uir_tuple[0])}"
+    cache_path = os.path.join(cache_dir, dataset, f"{key}.npy")
+    if os.path.exists(cache_path):
+        return np.load(cache_path)
+
+    user_counts, item_counts = interaction_counts(eval_method)
+    counts = user_counts if kind == 'users' else item_counts
+    membership = top_share_groups(counts, parse_group_threshold(group))
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    np.save(cache_path, membership)
+    return membership
+
+
+def group_matrix(membership: np.array, no_groups: int) -> np.array:
+    # one-hot membership matrix, the U and I matrices of the experiment
+    return (membership[:, None] == np.arange(no_groups)).astype(np.float64)
+
+
+def group_ids(membership: np.array, gid: int) -> set:
+    # the ids of the users or items in group gid, as read_user_groups and read_item_groups return them
+    return set(np.flatnonzero(membership == gid).tolist())
@@ -0,0 +1,357 @@
+from collections import defaultdict
+import heapq
+import json
+import os
+
+import numpy as np
+
+from groups import top_share_groups
+from matrices import contains_interactions, interaction_keys, item_index_block
+
+
+# the base of the uid * base + iid interaction keys: item ids stay below it, so the keys remain valid
+# while new items are added (uids below 2 ** 32 keep the keys within int64)
+KEY_BASE = 2 ** 31
+
+
+class TopShareGroups():
+    """
+    Group 0 (active users, shorthead items) as the top share by interaction count and group 1 as the
+    others, kept up to date while counts increase and new users or items are added
+
+    Only entities whose count changed can enter group 0 (the counts of the others are at most the
+    smallest count in group 0), so an update compares the changed outsiders, largest first, with the
+    smallest member of group 0, kept in a heap, and swaps them while the outsider has the larger
+    count, in O(changed log n). When the population grows, group 0 grows to its share of the new
+    population with the largest outsiders. Ties keep the current member, where top_share_groups would
+    break them by index.
+
+    Parameters
+    ----------
+    counts:
+      The interaction count of every user or item, updated in place by the owner
+    share:
+      The share of group 0, e.g. 0.05 for the top 5%
+    """
+
+    def __init__(self, counts: np.array, share: float):
+        self.counts = counts
+        self.share = share
+        self.membership = top_share_groups(counts, share)
+        self.size = int((self.membership == 0).sum())
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        members = np.flatnonzero(self.membership == 0)
+        self.heap = list(zip(self.counts[members].tolist(), members.tolist()))
+        heapq.heapify(self.heap)
+
+    def _smallest_member(self):
+        # drop entries of entities that left group 0 or whose count changed since they were pushed
+        while self.heap and (self.membership[self.heap[0][1]] != 0
+                             or self.heap[0][0] != self.counts[self.heap[0][1]]):
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def extend(self, counts: np.array):
+        # new entities (the counts grew) start in group 1, update moves them
+        self.membership = np.concatenate([self.membership, np.ones(len(counts) - len(self.membership),
+                                                                   dtype=self.membership.dtype)])
+        self.counts = counts
+
+    def update(self, changed: np.array) -> np.array:
+        """
+        Restore the groups after the counts of changed increased
+
+        Returns
+        ----------
+        switched:
+          The entities whose group changed
+        """
+        changed = np.unique(changed)
+        switched = []
+        target = int(np.round(self.share * len(self.counts)))
+        if target > self.size:
+            # the population grew: the largest outsiders join group 0
+            outsiders = np.flatnonzero(self.membership != 0)
+            joining = outsiders[np.argsort(-self.counts[outsiders], kind='stable')[:target - self.size]]
+            self.membership[joining] = 0
+            self.size += len(joining)
+            for entity in joining.tolist():
+                heapq.heappush(self.heap, (self.counts[entity], entity))
+            switched += joining.tolist()
+
+        members = changed[self.membership[changed] == 0]
+        for entity in members.tolist():
+            heapq.heappush(self.heap, (self.counts[entity], entity))
+
+        outsiders = changed[self.membership[changed] != 0]
+        outsiders = outsiders[np.argsort(-self.counts[outsiders], kind='stable')]
+        for entity in outsiders.tolist():
+            smallest = self._smallest_member()
+            if smallest is None or self.counts[entity] <= smallest[0]:
+                break
+            heapq.heappop(self.heap)
+            self.membership[smallest[1]] = 1
+            self.membership[entity] = 0
+            heapq.heappush(self.heap, (self.counts[entity], entity))
+            switched += [smallest[1], entity]
+
+        if len(self.heap) > 4 * self.size + 1024:
+            # stale entries pile up over many updates
+            self._rebuild_heap()
+        return np.array(switched, dtype=np.int64)
+
+
+def _raw_ids(id_map: dict, total: int) -> np.array:
+    # the raw id of every index of an id map, '' for indices without one
+    raw_ids = np.full(total, '', dtype=object)
+    for raw_id, index in id_map.items():
+        raw_ids[index] = raw_id
+    return raw_ids.astype(str)
+
+
+class InteractionState():
+    """
+    The train interactions of a dataset with the item popularity, user activity and the derived user
+    and item groups, updated in place as interactions are added
+
+    The interactions are kept as sorted uid * KEY_BASE + iid keys (matrices.interaction_keys), a CSR
+    layout in which the items of a user are one contiguous range. New keys form a new sorted run, and
+    runs are merged while the newer one is at least half the size of the one before (as the levels of a
+    log-structured merge tree), so there are O(log n) runs and adding interactions costs amortised
+    O(log n) per interaction instead of a rebuild of the whole dataset.
+
+    Interactions with raw user and item ids (as in the dataset files) are ingested in batches with
+    ingest, or with ingest_file from the lines appended to a log since the last call; unseen ids get the
+    next free index, growing the counts and groups. The state is saved and loaded as an .npz store with
+    the read offsets of the logs, so that a run only reads what was appended since the last one.
+
+    Item popularity counts every interaction, a repeated one as often as it occurs, as read_train_data
+    counts the lines of the train file; user activity counts the distinct items of a user, as the
+    derived groups count Cornac's train set (which drops duplicates).
+
+    Parameters
+    ----------
+    train_checkins:
+      The train items of every user, as read_train_data returns them
+    pop_items:
+      The popularity of the train items, as read_train_data returns it, by default one per user and item
+      of train_checkins
+    user_share, item_share:
+      The share of active users and shorthead items, e.g. parse_group_threshold('005')
+    uid_map, iid_map:
+      The indices of the raw user and item ids, e.g. eval_method.train_set.uid_map
+    rating_threshold:
+      Ingested interactions with a lower rating are ignored, by default all are kept as in read_train_data
+    """
+
+    def __init__(self, train_checkins, total_users: int, total_items: int, user_share: float, item_share: float,
+                 uid_map: dict = None, iid_map: dict = None, rating_threshold: float = None, pop_items: dict = None):
+        item_counts = None
+        if pop_items is not None:
+            item_counts = np.zeros(total_items, dtype=np.int64)
+            item_counts[list(pop_items)] = list(pop_items.values())
+        self._start(interaction_keys(train_checkins, KEY_BASE), total_users, total_items, user_share, item_share,
+                    uid_map, iid_map, rating_threshold, item_counts)
+
+    def _start(self, keys, total_users, total_items, user_share, item_share, uid_map, iid_map, rating_threshold,
+               item_counts=None):
+        self.total_users = total_users
+        self.total_items = total_items
+        self.runs = [keys]
+        self.uid_map = dict(uid_map or {})
+        self.iid_map = dict(iid_map or {})
+        self.rating_threshold = rating_threshold
+        # read offset of every ingested log
+        self.offsets = {}
+
+        self.user_counts = np.bincount(keys // KEY_BASE, minlength=total_users)
+        if item_counts is None:
+            item_counts = np.bincount(keys % KEY_BASE, minlength=total_items)
+        self.item_counts = np.asarray(item_counts, dtype=np.int64)
+        self.users = TopShareGroups(self.user_counts, user_share)
+        self.items = TopShareGroups(self.item_counts, item_share)
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, uids: np.array, P: np.array) -> np.array:
+        # boolean matrix: is P[row][j] an interaction of user uids[row]
+        found = np.zeros(P.shape, dtype=bool)
+        for run in self.runs:
+            found |= contains_interactions(run, uids, P, KEY_BASE)
+        return found
+
+    def items_of(self, uid: int) -> np.array:
+        # the items of one user, from its key range in every run
+        items = []
+        for keys in self.runs:
+            start, stop = np.searchsorted(keys, [uid * KEY_BASE, (uid + 1) * KEY_BASE])
+            items.append(keys[start:stop] - uid * KEY_BASE)
+        return np.concatenate(items)
+
+    def _grow(self, total_users: int, total_items: int):
+        # room for new users and items, which start with no interactions
+        if total_users > self.total_users:
+            self.user_counts = np.concatenate([self.user_counts, np.zeros(total_users - self.total_users,
+                                                                          dtype=self.user_counts.dtype)])
+            self.users.extend(self.user_counts)
+            self.total_users = total_users
+        if total_items > self.total_items:
+            self.item_counts = np.concatenate([self.item_counts, np.zeros(total_items - self.total_items,
+                                                                          dtype=self.item_counts.dtype)])
+            self.items.extend(self.item_counts)
+            self.total_items = total_items
+
+    def add(self, uids: np.array, iids: np.array):
+        """
+        Add interactions of user and item indices, updating the counts and the groups; interactions that
+        already exist only add to the item popularity, indices beyond the current users and items add new ones
+
+        Returns
+        ----------
+        (uids, iids, switched_users, switched_items):
+          The interactions that were new and the users and items that changed group
+        """
+        interacted = np.asarray(iids, dtype=np.int64)
+        keys = np.unique(np.asarray(uids, dtype=np.int64) * KEY_BASE + interacted)
+        uids, iids = keys // KEY_BASE, keys % KEY_BASE
+        if len(keys):
+            self._grow(max(self.total_users, int(uids.max()) + 1), max(self.total_items, int(iids.max()) + 1))
+        new = ~self.contains(uids, iids[:, None])[:, 0]
+        keys, uids, iids = keys[new], uids[new], iids[new]
+
+        if len(keys):
+            self.runs.append(keys)
+        while len(self.runs) > 1 and 2 * len(self.runs[-1]) >= len(self.runs[-2]):
+            newest = self.runs.pop()
+            self.runs[-1] = np.union1d(self.runs[-1], newest)
+
+        np.add.at(self.user_counts, uids, 1)
+        np.add.at(self.item_counts, interacted, 1)
+        return uids, iids, self.users.update(uids), self.items.update(interacted)
+
+    def _indices(self, id_map: dict, raw_ids, total: int) -> np.array:
+        # indices of raw ids, unseen ids get the next free index
+        indices = np.empty(len(raw_ids), dtype=np.int64)
+        for position, raw_id in enumerate(raw_ids):
+            index = id_map.get(str(raw_id))
+            if index is None:
+                index = id_map[str(raw_id)] = total
+                total += 1
+            indices[position] = index
+        return indices
+
+    def ingest(self, users: list, items: list, ratings: list = None):
+        """
+        Add a batch of (user, item, rating) interactions with raw ids, as add
+
+        Parameters
+        ----------
+        users, items:
+          The raw user and item ids, as in the dataset files
+        ratings:
+          The ratings, only used with a rating_threshold
+        """
+        if ratings is not None and self.rating_threshold is not None:
+            kept = [position for position, rating in enumerate(ratings) if float(rating) >= self.rating_threshold]
+            users, items = [users[position] for position in kept], [items[position] for position in kept]
+        uids = self._indices(self.uid_map, users, max(self.total_users, len(self.uid_map)))
+        iids = self._indices(self.iid_map, items, max(self.total_items, len(self.iid_map)))
+        return self.add(uids, iids)
+
+    def ingest_file(self, path: str):
+        """
+        Ingest the complete user, item, rating lines appended to a log (in the format of the train files)
+        since the last call; a log that became shorter than its offset is read again from the start
+
+        Returns
+        ----------
+        The result of add for the new lines
+        """
+        log = os.path.abspath(path)
+        offset = self.offsets.get(log, 0)
+        if os.path.getsize(log) < offset:
+            offset = 0
+        with open(log, 'rb') as log_file:
+            log_file.seek(offset)
+            appended = log_file.read()
+        # a last line without a newline may still be written, it is read with the next call
+        complete = appended.rfind(b'\n') + 1
+        self.offsets[log] = offset + complete
+
+        users, items, ratings = [], [], []
+        for line in appended[:complete].decode().splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                users.append(fields[0])
+                items.append(fields[1])
+                ratings.append(fields[2] if len(fields) > 2 else 1.0)
+        return self.ingest(users, items, ratings)
+
+    def keys(self) -> np.array:
+        # all interaction keys as one sorted run
+        if len(self.runs) > 1:
+            self.runs = [np.sort(np.concatenate(self.runs))]
+        return self.runs[0]
+
+    def train_checkins(self, total_users: int = None, total_items: int = None):
+        """
+        The items of every user as read_train_data returns them, optionally limited to the users and items
+        below total_users and total_items (e.g. the ones a model was trained on)
+        """
+        keys = self.keys()
+        uids, iids = keys // KEY_BASE, keys % KEY_BASE
+        kept = (uids < (total_users or self.total_users)) & (iids < (total_items or self.total_items))
+        uids, iids = uids[kept], iids[kept]
+
+        train_checkins = defaultdict(set)
+        if len(uids):
+            starts = np.flatnonzero(np.r_[True, uids[1:] != uids[:-1]])
+            for uid, items in zip(uids[starts].tolist(), np.split(iids, starts[1:])):
+                train_checkins[uid] = set(items.tolist())
+        return train_checkins
+
+    def pop_items(self, total_items: int = None) -> dict:
+        # the popularity of every item with interactions, as read_train_data returns it
+        counts = self.item_counts[:total_items or self.total_items]
+        items = np.flatnonzero(counts)
+        return dict(zip(items.tolist(), counts[items].tolist()))
+
+    def ground_truth_index(self, uids: np.array, P: np.array) -> np.array:
+        # Ahelp rows of users uids and their ranked items P from the current interactions
+        return self.contains(uids, P).astype(np.float64)
+
+    def item_index(self, P: np.array, no_item_groups: int) -> np.array:
+        # Ihelp rows of ranked items P from the current item groups, as read_item_index
+        Ihelp = np.zeros(P.shape + (no_item_groups,))
+        filled_groups = min(2, no_item_groups)
+        Ihelp[:, :, :filled_groups] = item_index_block(P, self.items.membership, filled_groups)
+        return Ihelp
+
+    def save(self, path: str):
+        # the store as .npz, written next to it first so that an interrupted save keeps the previous one
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary, keys=self.keys(), user_ids=_raw_ids(self.uid_map, self.total_users),
+                 item_ids=_raw_ids(self.iid_map, self.total_items),
+                 shares=np.array([self.users.share, self.items.share]),
+                 rating_threshold=np.array(np.nan if self.rating_threshold is None else self.rating_threshold),
+                 offsets=np.array(json.dumps(self.offsets)), item_counts=self.item_counts)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str):
+        # a saved store, with the groups derived again from the counts
+        store = np.load(path)
+        user_ids, item_ids = store['user_ids'].tolist(), store['item_ids'].tolist()
+        threshold = float(store['rating_threshold'])
+        state = cls.__new__(cls)
+        state._start(store['keys'], len(user_ids), len(item_ids), float(store['shares'][0]), float(store['shares'][1]),
+                     {raw_id: index for index, raw_id in enumerate(user_ids) if raw_id},
+                     {raw_id: index for index, raw_id in enumerate(item_ids) if raw_id},
+                     None if np.isnan(threshold) else threshold,
+                     store['item_counts'] if 'item_counts' in store.files else None)
+        state.offsets = json.loads(str(store['offsets']))
+        return state
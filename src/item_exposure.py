@@ -0,0 +1,187 @@
+import warnings
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_flow
+
+from reranking import select_topk
+
+
+def exposure_incidence(P: np.array, labels: np.array = None) -> np.array:
+    """
+    Sparse item x (user, slot) incidence of the candidates: the item (or, with labels mapping items to
+    providers, the provider) of every users x topk candidate slot, as a users x topk index matrix
+
+    The exposure of every item in a selection is a bincount over it, so the per-item constraints
+    never need a dense users x topk x items tensor such as Ihelp.
+    """
+    incidence = P.astype(np.int64)
+    if labels is not None:
+        incidence = labels[incidence]
+    return incidence
+
+
+def exposure_bounds(incidence: np.array, no_items: int, k: int, floor: float = 0.0, ceiling: float = None):
+    """
+    Per-item exposure floors and ceilings as multiples of the mean exposure k * users / items
+
+    Floors are capped at the number of candidate slots of an item, the most exposure it can get.
+    """
+    mean_exposure = k * len(incidence) / no_items
+    candidate_slots = np.bincount(incidence.ravel(), minlength=no_items)
+    floors = np.minimum(floor * mean_exposure, candidate_slots)
+    ceilings = np.full(no_items, np.inf) if ceiling is None else np.full(no_items, ceiling * mean_exposure)
+    return floors, ceilings
+
+
+def exposure_feasible(incidence: np.array, floors: np.array, ceilings: np.array, k: int) -> bool:
+    """
+    Whether some selection of k candidates per user meets all exposure bounds
+
+    The selections are the integral flows of a network source -> user (exactly k) -> candidate item
+    (at most 1 per slot) -> sink (between the floor and the ceiling of the item, rounded to whole
+    recommendations). Bounds with lower limits are feasible iff the maximum flow of the usual
+    transformation (a super source and sink carrying the lower limits) saturates them. The capacities
+    of scipy's maximum_flow are int32: a network whose total capacity does not fit is not checked (with a
+    warning) and reported feasible.
+    """
+    users, no_items = len(incidence), len(floors)
+    slots = np.bincount(incidence.ravel(), minlength=no_items)
+    lower = np.ceil(floors - 1e-9).astype(np.int64)
+    upper = np.minimum(np.floor(np.minimum(ceilings, slots) + 1e-9), slots).astype(np.int64)
+    if (lower > upper).any() or lower.sum() > k * users or upper.sum() < k * users:
+        return False
+    if k * users + upper.sum() > np.iinfo(np.int32).max:
+        warnings.warn(f"The exposure bounds of {users} users x {k} recommendations exceed the int32 capacities "
+                      f"of the maximum flow, their feasibility is not checked")
+        return True
+
+    # nodes: 0 super source, 1 super sink, 2 source, 3 sink, the users and the items
+    user_nodes, item_nodes = 4 + np.arange(users), 4 + users + np.arange(no_items)
+    tails = [np.zeros(users, np.int64), [0, 2, 3], np.repeat(user_nodes, incidence.shape[1]), item_nodes,
+             item_nodes]
+    heads = [user_nodes, [3, 1, 2], item_nodes[incidence.ravel()], np.full(no_items, 3), np.ones(no_items, np.int64)]
+    capacities = [np.full(users, k), [lower.sum(), k * users, k * users + upper.sum()],
+                  np.ones(incidence.size, np.int64), upper - lower, lower]
+    nodes = 4 + users + no_items
+    graph = csr_matrix((np.concatenate(capacities).astype(np.int32),
+                        (np.concatenate(tails).astype(np.int64), np.concatenate(heads).astype(np.int64))),
+                       shape=(nodes, nodes))
+    return maximum_flow(graph, 0, 1).flow_value == k * users + lower.sum()
+
+
+def item_exposure(selection: np.array, incidence: np.array, no_items: int) -> np.array:
+    # number of times every item (provider) is recommended by a users x topk selection
+    return np.bincount(incidence[selection], minlength=no_items)
+
+
+def _kth_smallest_per_item(items: np.array, values: np.array, ranks: np.array, no_items: int) -> np.array:
+    # per item the ranks[v]-th smallest (1-based) of its values, nan where it has fewer values or rank 0
+    order = np.lexsort((values, items))
+    items, values = items[order], values[order]
+    starts = np.searchsorted(items, np.arange(no_items))
+    counts = np.bincount(items, minlength=no_items)
+    result = np.full(no_items, np.nan)
+    valid = (ranks > 0) & (ranks <= counts)
+    result[valid] = values[starts[valid] + ranks[valid] - 1]
+    return result
+
+
+class ItemExposureDualAscent():
+    """
+    Re-ranking with individual item exposure floors and ceilings by dual ascent
+
+    The constraints floor_v <= exposure_v <= ceiling_v are moved into the objective with one price per
+    item: every candidate slot of item v gets the coefficient c_ij - price_v. For given prices the
+    problem separates per user (the k largest adjusted coefficients). Every iteration updates the prices
+    of all violated items at once, as in an auction: the price of an item above its ceiling rises just
+    enough for its excess users to prefer their best unselected candidate, the price of an item below
+    its floor drops just enough for the missing users to select it. The selection of the iterate with
+    the smallest total violation is returned.
+
+    Parameters
+    ----------
+    k:
+      The length of the recommendation lists
+    iterations:
+      Maximum number of price updates
+    epsilon:
+      The extra price change on top of every update, relative to the largest coefficient; larger values
+      reach feasibility in fewer iterations at the cost of objective, as the epsilon of an auction
+    """
+
+    def __init__(self, k: int = 10, iterations: int = 200, epsilon: float = 1e-4):
+        self.k = k
+        self.iterations = iterations
+        self.epsilon = epsilon
+
+    def solve(self, coefficients: np.array, incidence: np.array, floors: np.array, ceilings: np.array):
+        """
+        Parameters
+        ----------
+        coefficients:
+          The users x topk objective coefficients (reranking.objective_coefficients)
+        incidence:
+          The users x topk item index of every candidate slot (exposure_incidence)
+        floors, ceilings:
+          The exposure bounds of every item
+
+        Returns
+        ----------
+        selection:
+          Boolean users x topk selection, k items per user
+        info:
+          A dictionary with the 'status' ('CONVERGED' when all bounds are met, 'NOT_CONVERGED' when the
+          iterations ran out, 'INFEASIBLE' when no selection meets them, checked before any iteration,
+          which then returns the unbounded selection), the 'objective', the total and
+          'largest_violation' of the bounds and the 'iterations' used
+        """
+        no_items = len(floors)
+        if not exposure_feasible(incidence, floors, ceilings, self.k):
+            selection = select_topk(coefficients, self.k)
+            exposure = item_exposure(selection, incidence, no_items)
+            excess = np.maximum(np.where(np.isfinite(ceilings), exposure - ceilings, 0.0), 0)
+            missing = np.maximum(floors - exposure, 0)
+            return selection, {'status': 'INFEASIBLE', 'objective': float(coefficients[selection].sum()),
+                               'violation': float(excess.sum() + missing.sum()),
+                               'largest_violation': float(max(excess.max(), missing.max(), 0.0)), 'iterations': 0}
+
+        prices = np.zeros(no_items)
+        # the margin on top of every price change, so that updates do not stall on ties
+        margin = self.epsilon * max(float(np.abs(coefficients).max()), 1e-10)
+        incidence_flat = incidence.ravel()
+
+        best = None
+        for iteration in range(self.iterations):
+            adjusted = coefficients - prices[incidence]
+            selection = select_topk(adjusted, self.k)
+            exposure = item_exposure(selection, incidence, no_items)
+
+            excess = np.where(np.isfinite(ceilings), exposure - ceilings, 0.0)
+            missing = floors - exposure
+            violation = np.maximum(excess, 0).sum() + np.maximum(missing, 0).sum()
+            if best is None or violation < best[0]:
+                best = (violation, max(excess.max(), missing.max(), 0.0), selection, iteration + 1)
+            if violation == 0:
+                break
+
+            # weakest selected and best unselected adjusted coefficient of every user
+            ordered = -np.sort(-adjusted, axis=1)
+            weakest, best_unselected = ordered[:, self.k - 1], ordered[:, self.k]
+            # how much a selected slot's price can rise before the user drops it, and how much an
+            # unselected slot's price has to drop before the user takes it
+            keep_margin = np.where(selection, adjusted - best_unselected[:, None], np.inf).ravel()
+            take_margin = np.where(~selection, weakest[:, None] - adjusted, np.inf).ravel()
+
+            raise_by = _kth_smallest_per_item(incidence_flat, keep_margin,
+                                              np.ceil(np.maximum(excess, 0)).astype(np.int64), no_items)
+            drop_by = _kth_smallest_per_item(incidence_flat, take_margin,
+                                             np.ceil(np.maximum(missing, 0)).astype(np.int64), no_items)
+            raised, dropped = np.isfinite(raise_by), np.isfinite(drop_by)
+            prices[raised] += raise_by[raised] + margin
+            prices[dropped] -= drop_by[dropped] + margin
+
+        violation, largest, selection, iterations = best
+        return selection, {'status': 'CONVERGED' if violation == 0 else 'NOT_CONVERGED',
+                           'objective': float(coefficients[selection].sum()), 'violation': float(violation),
+                           'largest_violation': float(largest), 'iterations': iterations}
@@ -1,8 +1,97 @@
 import numpy as np
-from tqdm.notebook import tqdm
+from progress import tqdm
 
 
-def load_ranking_matrices(model, total_users, total_items, topk):
+# Cornac models whose score(uid) is item_factors.dot(user_factors[uid]), given as the names of
+# the (user factor, item factor) attributes. These can be scored for a block of users at once.
+FACTOR_MODELS = {
+    'WMF': ('U', 'V'),
+    'PMF': ('U', 'V'),
+    'HPF': ('Theta', 'Beta'),
+}
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def get_model_factors(model):
+    """
+    Get the latent factors of a trained factor model
+
+    Parameters
+    ----------
+    model:
+      A trained Cornac model
+
+    Returns
+    ----------
+    factors:
+      A tuple (user_factors, item_factors, link) such that model.score(uid) equals
+      link(item_factors.dot(user_factors[uid])), with link None for the identity.
+      None if the model does not expose its factors and has to be scored per user.
+    """
+    model_class = type(model).__name__
+    if model_class == 'BiVAECF':
+        bivae = getattr(model, 'bivae', None)
+        if bivae is None:
+            return None
+        # BiVAE decodes user scores as sigmoid(theta . beta)
+        user_factors = bivae.mu_theta.detach().cpu().numpy()
+        item_factors = bivae.mu_beta.detach().cpu().numpy()
+        return user_factors, item_factors, _sigmoid
+
+    if model_class not in FACTOR_MODELS:
+        return None
+    user_attr, item_attr = FACTOR_MODELS[model_class]
+    user_factors, item_factors = getattr(model, user_attr, None), getattr(model, item_attr, None)
+    if user_factors is None or item_factors is None:
+        return None
+    return np.asarray(user_factors), np.asarray(item_factors), None
+
+
+def topk_indices(scores: np.array, topk: int) -> np.array:
+    """
+    Column indices of the topk highest scores of every row of scores, best first.
+    """
+    if topk >= scores.shape[1]:
+        return np.argsort(-scores, axis=1, kind='stable')[:, :topk]
+    candidates = np.argpartition(-scores, topk - 1, axis=1)[:, :topk]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def iter_score_blocks(model, total_users: int, total_items: int, topk: int, block_size: int = 1024):
+    """
+    Score users in blocks of block_size and select their topk items
+
+    Factor models are scored with one matrix-matrix product per block, all other models fall
+    back to one model.score(uid) call per user. Peak memory is bounded by a block_size x
+    total_items score matrix.
+
+    Yields
+    ----------
+    (start, stop, scores, top):
+      The user range [start, stop), the (stop - start) x total_items score matrix of the block
+      and the (stop - start) x topk matrix of the indices of the highest scored items
+    """
+    factors = get_model_factors(model)
+    if factors is not None and factors[1].shape[0] != total_items:
+        factors = None
+
+    for start in range(0, total_users, block_size):
+        stop = min(start + block_size, total_users)
+        if factors is not None:
+            user_factors, item_factors, link = factors
+            scores = user_factors[start:stop].dot(item_factors.T)
+            if link is not None:
+                scores = link(scores)
+        else:
+            scores = np.vstack([model.score(uid) for uid in range(start, stop)])
+        yield start, stop, scores, topk_indices(scores, topk)
+
+
+def load_ranking_matrices(model, total_users, total_items, topk, block_size=1024):
     # S is a matrix to store user's scores on each item
     # P includes the indices of topk ranked items
     # Sprime saves the scores of topk ranked items
@@ -11,34 +100,67 @@ def load_ranking_matrices(model, total_users, total_items, topk):
 
     # for model in exp.models:
     print(model.name)
-    for uid in tqdm(range(total_users)):
-        S[uid] = model.score(uid)
-        P[uid] = np.array(list(reversed(model.score(uid).argsort()))[:topk])
+    blocks = iter_score_blocks(model=model, total_users=total_users, total_items=total_items,
+                               topk=topk, block_size=block_size)
+    for start, stop, scores, top in tqdm(blocks, total=-(-total_users // block_size)):
+        S[start:stop] = scores
+        P[start:stop] = top
 
     return S, P
 
 
+def interaction_keys(interactions: dict, base: int) -> np.array:
+    """
+    Sorted uid * base + iid keys of a dictionary of users and their item sets, such that membership
+    of (user, item) pairs can be tested for whole blocks at once with contains_interactions
+    """
+    keys = [uid * base + np.fromiter(items, dtype=np.int64, count=len(items))
+            for uid, items in interactions.items() if len(items) > 0]
+    return np.sort(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
+
+
+def contains_interactions(keys: np.array, uids: np.array, P: np.array, base: int) -> np.array:
+    # boolean matrix: is P[row][j] an item of user uids[row] in the interaction keys
+    if len(keys) == 0:
+        return np.zeros(P.shape, dtype=bool)
+    query = np.asarray(uids, dtype=np.int64)[:, None] * base + P.astype(np.int64)
+    positions = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return keys[positions] == query
+
+
+def item_group_labels(total_items: int, *group_item_ids) -> np.array:
+    """
+    Group id of every item, -1 for items in none of the groups. An item in several groups gets
+    the first one, as read_item_index does.
+    """
+    labels = -np.ones(total_items, dtype=np.int64)
+    for gid in reversed(range(len(group_item_ids))):
+        ids = np.fromiter(group_item_ids[gid], dtype=np.int64, count=len(group_item_ids[gid]))
+        labels[ids] = gid
+    return labels
+
+
+def item_index_block(P: np.array, labels: np.array, no_item_groups: int) -> np.array:
+    # Ihelp rows of a block of users: one-hot item group of every ranked item
+    return (labels[P.astype(np.int64)][:, :, None] == np.arange(no_item_groups)).astype(np.float64)
+
+
 def load_ground_truth_index(total_users: int, topk: int, P: np.array, train_checkins):
     # Ahelp is a binary matrix in which an element of its is 1 if the corresponding element in P (which is an item index) is in ground truth.
     # Actually is shows whether the rankied item in P is included in ground truth or not.
+    base = int(max([P.max() + 1] + [max(items) + 1 for items in train_checkins.values() if items]))
+    keys = interaction_keys(train_checkins, base)
     Ahelp = np.zeros((total_users, topk))
-    for uid in tqdm(range(total_users)):
-        for j in range(topk):
-            # convert user_ids to user_idx
-            # convert item_ids to item_idx
-            if P[uid][j] in train_checkins[uid]:
-                Ahelp[uid][j] = 1
+    Ahelp[:] = contains_interactions(keys, np.arange(total_users), P[:total_users, :topk], base)
     return Ahelp
 
 
 def read_item_index(total_users: int, topk: int, no_item_groups: int, P: np.array,
                     shorthead_item_ids: set, longtail_item_ids: set):
+    total_items = int(max([P.max() + 1] + [max(ids) + 1 for ids in (shorthead_item_ids, longtail_item_ids) if ids]))
+    labels = item_group_labels(total_items, shorthead_item_ids, longtail_item_ids)
     Ihelp = np.zeros((total_users, topk, no_item_groups))
-    for uid in range(total_users):
-        for lid in range(topk):
-            # convert item_ids to item_idx
-            if P[uid][lid] in shorthead_item_ids:
-                Ihelp[uid][lid][0] = 1
-            elif P[uid][lid] in longtail_item_ids:
-                Ihelp[uid][lid][1] = 1
+    # only the shorthead and longtail groups are filled, as before
+    filled_groups = min(2, no_item_groups)
+    Ihelp[:, :, :filled_groups] = item_index_block(P[:total_users, :topk], labels, filled_groups)
     return Ihelp
@@ -1,7 +1,19 @@
 import numpy as np
-from tqdm.notebook import tqdm
+from progress import tqdm
 from cornac.eval_methods import BaseMethod
 
+from matrices import contains_interactions, interaction_keys
+
+
+# the columns of the raw results of a cell (before clean_results), one row per setting, and of the rows
+# per cutoff; the metrics are ordered as SelectionEvaluator returns them, per group of users
+_KEY_COLUMNS = ["Dataset", "Model", "GUser", "GItem", "Type", "User_EPS", "Item_EPS"]
+_METRIC_COLUMNS = ["ndcg_ALL", "ndcg_ACT", "ndcg_INACT", "Pre_ALL", "Pre_ACT", "Pre_INACT",
+                   "Rec_ALL", "Rec_ACT", "Rec_INACT", "Nov_ALL", "Nov_ACT", "Nov_INACT",
+                   "Cov_ALL", "Cov_ACT", "Cov_INACT"]
+RESULT_COLUMNS = _KEY_COLUMNS + _METRIC_COLUMNS + ["Short_Items", "Long_Items", "All_Items"]
+CUTOFF_COLUMNS = _KEY_COLUMNS + ["Cutoff"] + _METRIC_COLUMNS
+
 
 def catalog_coverage(predicted: list, catalog: list) -> float:
     """
@@ -92,7 +104,8 @@ def ndcgk(actual, predicted):
 ### END CHANGE
 
 
-def metric_per_group(group: list, W: np.array, ground_truth, pop_items, P: np.array, eval_method: BaseMethod):
+def metric_per_group(group: list, W: np.array, ground_truth, pop_items, P: np.array, eval_method: BaseMethod,
+                     k: int = 10):
     NDCG10 = list()
     Pre10 = list()
     Rec10 = list()
@@ -102,7 +115,7 @@ def metric_per_group(group: list, W: np.array, ground_truth, pop_items, P: np.ar
 
     for uid in tqdm(group):
         if uid in ground_truth.keys():
-            for j in range(50):
+            for j in range(len(W[uid])):
                 if W[uid][j].x == 1:
                     predicted.append(P[uid][j])
             copy_predicted = predicted[:]
@@ -111,7 +124,7 @@ def metric_per_group(group: list, W: np.array, ground_truth, pop_items, P: np.ar
             Pre = precisionk(actual=ground_truth[uid], predicted=predicted)
             Rec = recallk(actual=ground_truth[uid], predicted=predicted)
             Novelty = novelty(predicted=predicted, pop=pop_items,
-                              u=eval_method.total_users, k=10)
+                              u=eval_method.total_users, k=k)
 
             NDCG10.append(NDCG)
             Pre10.append(Pre)
@@ -128,7 +141,7 @@ def metric_per_group(group: list, W: np.array, ground_truth, pop_items, P: np.ar
         round(np.mean(Rec10), 5), round(np.mean(Novelty10), 5), catalog
 
 
-def metric_on_all(W: np.array, ground_truth, pop_items, P: np.array, eval_method: BaseMethod):
+def metric_on_all(W: np.array, ground_truth, pop_items, P: np.array, eval_method: BaseMethod, k: int = 10):
     """
     """
     predicted_user = list()
@@ -140,7 +153,7 @@ def metric_on_all(W: np.array, ground_truth, pop_items, P: np.array, eval_method
 
     for uid in tqdm(range(eval_method.total_users)):
         if uid in ground_truth.keys():
-            for j in range(50):
+            for j in range(len(W[uid])):
                 if W[uid][j].x == 1:
                     predicted_user.append(P[uid][j])
 
@@ -154,7 +167,7 @@ def metric_on_all(W: np.array, ground_truth, pop_items, P: np.array, eval_method
             REC_user = recallk(
                 actual=ground_truth[uid], predicted=predicted_user)
             Novelty_user = novelty(
-                predicted=predicted_user, pop=pop_items, u=eval_method.total_users, k=10)
+                predicted=predicted_user, pop=pop_items, u=eval_method.total_users, k=k)
 
             NDCG_all.append(NDCG_user)
             PRE_all.append(PRE_user)
@@ -169,3 +182,169 @@ def metric_on_all(W: np.array, ground_truth, pop_items, P: np.array, eval_method
 
     return round(np.mean(NDCG_all), 5), round(np.mean(PRE_all), 5), round(np.mean(REC_all), 5), \
         round(np.mean(Novelty_all), 5), catalog
+
+
+def popularity_counts(pop_items: dict, total_items: int) -> np.array:
+    # pop_items as an array, 0 for items that do not occur in the training data
+    counts = np.zeros(total_items)
+    counts[np.fromiter(pop_items.keys(), dtype=np.int64, count=len(pop_items))] = list(pop_items.values())
+    return counts
+
+
+def ndcg_discounts(k: int) -> np.array:
+    # the position weights of ndcgk: 1 for the first two positions, 1 / log2(i + 1) after that
+    return np.concatenate([[1.0], 1.0 / np.log2(np.arange(k - 1) + 2)])
+
+
+def selection_from_W(W) -> np.array:
+    # boolean users x topk selection of a solved W (a matrix of mip variables)
+    return np.array([[var.x for var in row] for row in W]) > 0.5
+
+
+def user_metrics(uids: np.array, predicted: np.array, cutoffs: list, ground_truth_keys: np.array,
+                 ground_truth_sizes: np.array, base: int, pop_counts: np.array, total_users: int) -> dict:
+    """
+    Vectorised ndcgk, precisionk, recallk and novelty of a block of users at several cutoffs
+
+    All cutoffs are read off cumulative sums over one ranked list, the nDCG using a precomputed
+    discount table.
+
+    Parameters
+    ----------
+    uids:
+      The users of the block, all of which have a ground truth
+    predicted:
+      A len(uids) x k matrix of recommended item indices in ranked order
+    cutoffs:
+      List lengths to evaluate the first items of predicted at, all at most k
+    ground_truth_keys, base:
+      The ground truth as matrices.interaction_keys
+    ground_truth_sizes:
+      Number of ground truth items of every user
+    pop_counts:
+      The item popularity as popularity_counts
+
+    Returns
+    ----------
+    metrics:
+      Per cutoff a dictionary of per-user 'ndcg', 'precision', 'recall' and 'novelty' arrays
+    """
+    hits = contains_interactions(ground_truth_keys, uids, predicted, base)
+    discounts = ndcg_discounts(predicted.shape[1])
+    popularity = pop_counts[predicted]
+    self_information = np.where(popularity > 0, -np.log2(np.maximum(popularity, 1) / total_users), 0.0)
+
+    cumulative_dcg = np.cumsum(hits * discounts, axis=1)
+    cumulative_idcg = np.cumsum(discounts)
+    cumulative_hits = np.cumsum(hits, axis=1)
+    cumulative_information = np.cumsum(self_information, axis=1)
+    return {cutoff: {
+        'ndcg': cumulative_dcg[:, cutoff - 1] / cumulative_idcg[cutoff - 1],
+        'precision': cumulative_hits[:, cutoff - 1] / cutoff,
+        'recall': cumulative_hits[:, cutoff - 1] / ground_truth_sizes[uids],
+        'novelty': cumulative_information[:, cutoff - 1] / cutoff,
+    } for cutoff in cutoffs}
+
+
+class MetricAccumulator():
+    """
+    Running sums of the per-user metrics of one user group at one cutoff, fed block by block,
+    giving the same results as metric_per_group and metric_on_all
+    """
+
+    def __init__(self, total_items: int, catalog_size: int):
+        self.sums = {'ndcg': 0.0, 'precision': 0.0, 'recall': 0.0, 'novelty': 0.0}
+        self.count = 0
+        self.recommended = np.zeros(total_items, dtype=bool)
+        self.catalog_size = catalog_size
+
+    def add(self, metrics: dict, predicted: np.array, mask: np.array = None):
+        # add the users of a block of user_metrics, optionally only those in mask
+        if mask is not None:
+            metrics = {name: values[mask] for name, values in metrics.items()}
+            predicted = predicted[mask]
+        for name in self.sums:
+            self.sums[name] += metrics[name].sum()
+        self.count += len(predicted)
+        self.recommended[predicted.ravel()] = True
+
+    def result(self):
+        # mean nDCG, precision, recall and novelty, and the catalog coverage
+        means = [round(self.sums[name] / self.count, 5) if self.count else np.nan
+                 for name in ('ndcg', 'precision', 'recall', 'novelty')]
+        coverage = round(self.recommended.sum() / (self.catalog_size * 1.0) * 100, 2)
+        return tuple(means) + (coverage,)
+
+
+class SelectionEvaluator():
+    """
+    Evaluation of ranked recommendation lists for all, active and inactive users at a set of cutoffs
+    in a single pass, block by block
+
+    Usage: state = evaluator.new_state(), evaluator.add(state, uids, predicted) for every block of
+    users and evaluator.result(state), or evaluator.evaluate(predicted) for all users at once.
+    """
+
+    def __init__(self, ground_truth, pop_items: dict, total_users: int, total_items: int, cutoffs: list,
+                 active: np.array, inactive: np.array):
+        self.cutoffs = sorted(set(cutoffs))
+        self.total_users = total_users
+        self.total_items = total_items
+        self.active = active
+        self.inactive = inactive
+
+        self.ground_truth_keys = interaction_keys(ground_truth, total_items)
+        self.ground_truth_sizes = np.zeros(total_users)
+        for uid, items in ground_truth.items():
+            self.ground_truth_sizes[uid] = len(items)
+        self.has_ground_truth = np.zeros(total_users, dtype=bool)
+        self.has_ground_truth[list(ground_truth.keys())] = True
+        self.pop_counts = popularity_counts(pop_items, total_items)
+        self.catalog_size = len(pop_items)
+
+    def new_state(self) -> dict:
+        return {cutoff: {group: MetricAccumulator(self.total_items, self.catalog_size)
+                         for group in ('all', 'active', 'inactive')} for cutoff in self.cutoffs}
+
+    def add(self, state: dict, uids: np.array, predicted: np.array):
+        # add a block of users and their len(uids) x k recommendations; users without ground truth are skipped
+        evaluated = self.has_ground_truth[uids]
+        uids, predicted = uids[evaluated], predicted[evaluated]
+        metrics = user_metrics(uids, predicted, self.cutoffs, self.ground_truth_keys, self.ground_truth_sizes,
+                               self.total_items, self.pop_counts, self.total_users)
+        for cutoff in self.cutoffs:
+            accumulators, top = state[cutoff], predicted[:, :cutoff]
+            accumulators['all'].add(metrics[cutoff], top)
+            accumulators['active'].add(metrics[cutoff], top, mask=self.active[uids])
+            accumulators['inactive'].add(metrics[cutoff], top, mask=self.inactive[uids])
+
+    def result(self, state: dict) -> dict:
+        """
+        Per cutoff the (ndcg, precision, recall, novelty, coverage) tuples of 'all', 'active' and
+        'inactive' users
+        """
+        return {cutoff: {group: accumulator.result() for group, accumulator in accumulators.items()}
+                for cutoff, accumulators in state.items()}
+
+    def evaluate(self, predicted: np.array, block_size: int = 65536) -> dict:
+        # result for the users x k recommendations of all users
+        state = self.new_state()
+        for start in range(0, len(predicted), block_size):
+            stop = min(start + block_size, len(predicted))
+            self.add(state, np.arange(start, stop), predicted[start:stop])
+        return self.result(state)
+
+    def user_vectors(self, predicted: np.array, cutoff: int, block_size: int = 65536) -> dict:
+        """
+        Per-user 'ndcg', 'precision', 'recall' and 'novelty' at one cutoff for the users x k
+        recommendations of all users, nan for users without ground truth (the users the means skip)
+        """
+        vectors = {name: np.full(len(predicted), np.nan) for name in ('ndcg', 'precision', 'recall', 'novelty')}
+        for start in range(0, len(predicted), block_size):
+            uids = np.arange(start, min(start + block_size, len(predicted)))
+            uids = uids[self.has_ground_truth[uids]]
+            metrics = user_metrics(uids, predicted[uids, :cutoff], [cutoff], self.ground_truth_keys,
+                                   self.ground_truth_sizes, self.total_items, self.pop_counts, self.total_users)
+            for name, values in metrics[cutoff].items():
+                vectors[name][uids] = values
+        return vectors
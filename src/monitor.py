@@ -0,0 +1,270 @@
+import atexit
+import json
+import os
+import resource
+import socket
+import threading
+import time
+
+
+# the directory of the run that is monitored; processes started from a monitored process inherit it, so
+# that the training, replication, queue and writer workers all report into the same run
+MONITOR_VARIABLE = 'CPFAIR_MONITOR'
+INTERVAL_VARIABLE = 'CPFAIR_MONITOR_INTERVAL'
+STATUS_FILE = 'status.json'
+METRICS_FILE = 'metrics.prom'
+# per-process counters, merged into the status file
+PROCESS_DIR = 'monitor'
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def _current_memory_mb() -> float:
+    # resident memory of the current process, the peak where /proc is not available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def _write_atomic(path: str, text: str):
+    # written under a temporary name first, so that readers never see a partial file
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as output:
+        output.write(text)
+    os.replace(temporary_path, path)
+
+
+class ProcessRecorder():
+    """
+    The counters of one process of a monitored run, written to <run>/monitor/<host>-<pid>.json every
+    interval seconds by a thread, so that a process in a long computation keeps reporting its memory,
+    and when the process exits
+    """
+
+    def __init__(self, run_dir: str, interval: float = 5.0):
+        self.pid = os.getpid()
+        self.name = f"{socket.gethostname()}-{self.pid}"
+        self.path = os.path.join(run_dir, PROCESS_DIR, f"{self.name}.json")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counters = {'cells': 0, 'users_scored': 0, 'solves': 0, 'solve_seconds': 0.0}
+        self.statuses = {}
+        self.stage = None
+        self.started = time.time()
+        self.written = 0.0
+        self.finished = False
+        threading.Thread(target=self._beat, daemon=True).start()
+
+    def _beat(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def record(self, stage: str = None, cells: int = 0, users: int = 0, status: str = None,
+               seconds: float = 0.0):
+        with self.lock:
+            # a process recording new work is running again, e.g. a worker after its training job
+            self.finished = False
+            if stage is not None:
+                self.stage = stage
+            self.counters['cells'] += cells
+            self.counters['users_scored'] += users
+            if status is not None:
+                self.counters['solves'] += 1
+                self.counters['solve_seconds'] += seconds
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+        if time.time() - self.written >= self.interval:
+            self.write()
+
+    def write(self, finished: bool = False):
+        with self.lock:
+            # once finished, a late beat of the thread does not mark the process as running again
+            self.finished = self.finished or finished
+            self.written = time.time()
+            status = dict(process=self.name, pid=os.getpid(), stage=self.stage, started=self.started,
+                          updated=self.written, finished=self.finished, rss_mb=round(_current_memory_mb(), 1),
+                          statuses=dict(self.statuses), **self.counters)
+            _write_atomic(self.path, json.dumps(status))
+
+
+def record(stage: str = None, cells: int = 0, users: int = 0, status: str = None, seconds: float = 0.0):
+    """
+    Count work of the current process in the monitored run: the stage it is in, completed cells,
+    scored users and a solve with its solver status and seconds. Does nothing when no run is monitored.
+    """
+    global _recorder
+    run_dir = os.environ.get(MONITOR_VARIABLE)
+    if not run_dir:
+        return
+    with _recorder_lock:
+        if _recorder is None or _recorder.pid != os.getpid():
+            # the first record of this process, or of a forked child of a recording process
+            _recorder = ProcessRecorder(run_dir, interval=float(os.environ.get(INTERVAL_VARIABLE, 5)))
+            atexit.register(_recorder.write, True)
+    _recorder.record(stage=stage, cells=cells, users=users, status=status, seconds=seconds)
+
+
+def finish():
+    # mark the current process as finished, for worker processes that exit without running atexit
+    if _recorder is not None and _recorder.pid == os.getpid():
+        _recorder.write(finished=True)
+
+
+def _metric(lines: list, name: str, kind: str, description: str, samples: list):
+    lines += [f"# HELP cpfair_{name} {description}", f"# TYPE cpfair_{name} {kind}"]
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+        lines.append(f"cpfair_{name}{{{label_text}}} {value}")
+
+
+class RunMonitor():
+    """
+    Live progress of a run for schedulers and dashboards
+
+    Every process of the run (the main process and the training, replication, queue and writer
+    processes it starts, which inherit the CPFAIR_MONITOR environment variable) counts its work with
+    record into a file of its own. A thread of the monitoring process merges them every interval
+    seconds into <run>/status.json and the Prometheus text file <run>/metrics.prom (for the textfile
+    collector of node_exporter): completed and remaining cells, users scored per second, solves per
+    minute, solver status counts, the resident memory of the live processes and the estimated time
+    to completion. Both files are replaced atomically.
+
+    Parameters
+    ----------
+    run_dir:
+      The directory of the run, e.g. results/<run>
+    total_cells:
+      The number of cells of the run, for the remaining cells and the estimate
+    tasks:
+      Optional callable returning task counts per state (e.g. WorkQueue.counts), which replace the
+      cells for the remaining work and the estimate
+    interval:
+      Seconds between two updates
+    """
+
+    def __init__(self, run_dir: str, total_cells: int = None, tasks=None, interval: float = 5.0):
+        self.run_dir = run_dir
+        self.total_cells = total_cells
+        self.tasks = tasks
+        self.interval = interval
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        os.makedirs(os.path.join(self.run_dir, PROCESS_DIR), exist_ok=True)
+        os.environ[MONITOR_VARIABLE] = self.run_dir
+        os.environ[INTERVAL_VARIABLE] = str(self.interval)
+        self.thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def _publish_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.publish()
+
+    def status(self, state: str = 'running') -> dict:
+        """
+        The merged status of all processes of the run
+        """
+        now = time.time()
+        processes = []
+        process_dir = os.path.join(self.run_dir, PROCESS_DIR)
+        for name in sorted(os.listdir(process_dir)) if os.path.isdir(process_dir) else []:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(process_dir, name)) as status_file:
+                    processes.append(json.load(status_file))
+            except (OSError, ValueError):
+                # replaced while it was read
+                continue
+
+        totals = {key: sum(process[key] for process in processes)
+                  for key in ('cells', 'users_scored', 'solves', 'solve_seconds')}
+        statuses = {}
+        for process in processes:
+            for name, count in process['statuses'].items():
+                statuses[name] = statuses.get(name, 0) + count
+        # processes that did not write for a while are stuck or were killed
+        live = [process for process in processes if not process['finished'] and
+                now - process['updated'] <= 3 * max(self.interval, 1)]
+        # from the first process on, e.g. the first worker of a queue that is monitored later
+        started = min([self.started] + [process['started'] for process in processes])
+        elapsed = now - started
+
+        completed, total = totals['cells'], self.total_cells
+        tasks = self.tasks() if self.tasks is not None else None
+        if tasks:
+            completed, total = tasks.get('done', 0) + tasks.get('failed', 0), sum(tasks.values())
+        remaining = None if total is None else max(total - completed, 0)
+        eta = None
+        if remaining is not None and completed:
+            eta = round(elapsed / completed * remaining, 1)
+
+        return dict(state=state, run=os.path.basename(os.path.normpath(self.run_dir)), started=started,
+                    updated=now, elapsed_seconds=round(elapsed, 1), cells_completed=totals['cells'],
+                    cells_total=self.total_cells, completed=completed, remaining=remaining, tasks=tasks,
+                    eta_seconds=eta, users_scored=totals['users_scored'],
+                    users_scored_per_second=round(totals['users_scored'] / elapsed, 2) if elapsed else 0.0,
+                    solves=totals['solves'], solves_per_minute=round(totals['solves'] / elapsed * 60, 2)
+                    if elapsed else 0.0, solve_seconds=round(totals['solve_seconds'], 2),
+                    solver_statuses=statuses, rss_mb=round(sum(process['rss_mb'] for process in live), 1),
+                    processes=len(live), stages={process['process']: process['stage'] for process in live},
+                    stale_processes=[process['process'] for process in processes
+                                     if not process['finished'] and process not in live])
+
+    def publish(self, state: str = 'running') -> dict:
+        # write the status file and the metrics file from the counters of all processes
+        status = self.status(state)
+        _write_atomic(os.path.join(self.run_dir, STATUS_FILE), json.dumps(status, indent=1))
+
+        run = {'run': status['run']}
+        lines = []
+        _metric(lines, 'up', 'gauge', "1 while the run is running, 0 once it finished or failed",
+                [(run, int(state == 'running'))])
+        _metric(lines, 'cells_completed', 'gauge', "Cells (or queue tasks) completed", [(run, status['completed'])])
+        if status['remaining'] is not None:
+            _metric(lines, 'cells_remaining', 'gauge', "Cells (or queue tasks) remaining",
+                    [(run, status['remaining'])])
+        if status['eta_seconds'] is not None:
+            _metric(lines, 'eta_seconds', 'gauge', "Estimated seconds to completion", [(run, status['eta_seconds'])])
+        _metric(lines, 'elapsed_seconds', 'gauge', "Seconds since the run started", [(run, status['elapsed_seconds'])])
+        _metric(lines, 'users_scored_total', 'counter', "Users scored by the rankers", [(run, status['users_scored'])])
+        _metric(lines, 'users_scored_per_second', 'gauge', "Users scored per second of the run",
+                [(run, status['users_scored_per_second'])])
+        _metric(lines, 'solves_total', 'counter', "Optimisations solved", [(run, status['solves'])])
+        _metric(lines, 'solves_per_minute', 'gauge', "Optimisations solved per minute of the run",
+                [(run, status['solves_per_minute'])])
+        _metric(lines, 'solver_status_total', 'counter', "Optimisations per solver status",
+                [(dict(run, status=name), count) for name, count in sorted(status['solver_statuses'].items())])
+        _metric(lines, 'resident_memory_bytes', 'gauge', "Resident memory of the live processes of the run",
+                [(run, int(status['rss_mb'] * 1024 ** 2))])
+        _metric(lines, 'processes', 'gauge', "Live processes of the run", [(run, status['processes'])])
+        _metric(lines, 'stale_processes', 'gauge', "Processes that stopped reporting without finishing",
+                [(run, len(status['stale_processes']))])
+        _metric(lines, 'last_update_timestamp_seconds', 'gauge', "Time of the last update",
+                [(run, round(status['updated'], 3))])
+        _write_atomic(os.path.join(self.run_dir, METRICS_FILE), '\n'.join(lines) + '\n')
+        return status
+
+    def stop(self, state: str = 'finished'):
+        # the final update, after the counters of the current process are written
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        finish()
+        os.environ.pop(MONITOR_VARIABLE, None)
+        os.environ.pop(INTERVAL_VARIABLE, None)
+        return self.publish(state)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop('finished' if exc_type is None else 'failed')
@@ -2,6 +2,44 @@ import numpy as np
 from cornac.eval_methods import BaseMethod
 from mip import Model, xsum, maximize
 
+from reranking import dcg_change_idcg, problem_coefficients, reproduction_idcg, select_topk
+
+
+def greedy_selection(formulation: str, fairness_mode, uepsilon, iepsilon, topk: int, eval_method: BaseMethod,
+                     S: np.array, U: np.array, Ihelp: np.array, Ahelp: np.array, list_length: int = 10) -> np.array:
+    """
+    A feasible users x topk selection of W, list_length items per user, from one vectorised pass: every
+    user gets the largest objective coefficients of its candidates (reranking.objective_coefficients).
+    Used as the fallback when a time budget runs out before the solver found a solution. With the
+    epsilons fixed the problem separates per user, so the selection is also optimal.
+    """
+    coefficients = problem_coefficients(formulation, fairness_mode, uepsilon, iepsilon, topk, S, U, Ihelp, Ahelp,
+                                        eval_method.total_users, eval_method.total_items, k=list_length)
+    return select_topk(coefficients, list_length)
+
+
+def _optimize(model: Model, heuristic: np.array, max_seconds: float, max_gap: float, info: dict,
+              threads: int = None):
+    """
+    Solve the model within max_seconds, stopping at a relative gap of max_gap, with at most threads
+    solver threads (the solver's default if None). The status, objective, bound and gap of the best
+    solution and the greedy heuristic selection, the fallback when no solution is found, are written
+    to info. The problems are linear programs (W is continuous), so the heuristic is not passed to the
+    solver as a start, which CBC only uses for integer programs.
+    """
+    if threads is not None:
+        model.threads = threads
+    if max_gap is not None:
+        model.max_mip_gap = max_gap
+    status = model.optimize(max_seconds=max_seconds if max_seconds is not None else float('inf'))
+    if info is not None:
+        objective, bound = model.objective_value, model.objective_bound
+        # the relative gap, model.gap is only defined for integer programs
+        gap = None
+        if objective is not None and bound is not None:
+            gap = abs(bound - objective) / max(abs(objective), 1e-10)
+        info.update(status=status.name, objective=objective, bound=bound, gap=gap, heuristic=heuristic)
+
 
 def fairness_optimisation(
         fairness_mode,
@@ -15,7 +53,12 @@ def fairness_optimisation(
         U: np.array,
         Ihelp: np.array,
         Ahelp: np.array,
-        train_checkins):
+        train_checkins,
+        list_length: int = 10,
+        max_seconds: float = None,
+        max_gap: float = None,
+        threads: int = None,
+        info: dict = None):
     print(
         f"Runing fairness optimisation on '{fairness_mode}', {uepsilon}, {iepsilon}")
 
@@ -58,12 +101,12 @@ def fairness_optimisation(
             group_ndcg_v[0] - group_ndcg_v[1]) - iepsilon * (item_group[0] - item_group[1]))
 
     # first constraint: the number of 1 in W should be equal to top-k, recommending top-k best items
-    k = 10
+    k = list_length
     for i in V1:
         model += xsum(W[i][j] for j in V2) == k
 
     for i in V1:
-        user_idcg_i = 7.137938133620551
+        user_idcg_i = reproduction_idcg(list_length)
 
         model += user_dcg[i] == xsum((W[i][j] * Ahelp[i][j]) for j in V2)
         model += user_ndcg[i] == user_dcg[i] / user_idcg_i
@@ -86,8 +129,10 @@ def fairness_optimisation(
     for i in V1:
         for j in V2:
             model += W[i][j] <= 1
-    # optimizing
-    model.optimize()
+    # optimizing; the greedy selection is the fallback when the time budget leaves no solution
+    heuristic = greedy_selection('reproduction', fairness_mode, uepsilon, iepsilon, topk, eval_method,
+                                 S, U, Ihelp, Ahelp, list_length)
+    _optimize(model, heuristic, max_seconds=max_seconds, max_gap=max_gap, info=info, threads=threads)
 
     return W, item_group
 
@@ -104,7 +149,12 @@ def fairness_optimisation_proportional(
         U: np.array,
         Ihelp: np.array,
         Ahelp: np.array,
-        train_checkins):
+        train_checkins,
+        list_length: int = 10,
+        max_seconds: float = None,
+        max_gap: float = None,
+        threads: int = None,
+        info: dict = None):
     print(
         f"Runing fairness optimisation on '{fairness_mode}', {uepsilon}, {iepsilon}")
     print(f"Active users: {U[:, 0].sum()}, Inactive users: {U[:, 1].sum()}")
@@ -169,13 +219,13 @@ def fairness_optimisation_proportional(
 
 
     # first constraint: the number of 1 in W should be equal to top-k, recommending top-k best items
-    k = 10
+    k = list_length
     for i in V1:
         model += xsum(W[i][j] for j in V2) == k
 
     for i in V1:
         ### CHANGE
-        user_idcg_i = 4.543559338088346
+        user_idcg_i = dcg_change_idcg(list_length)
 
         model += user_dcg[i] == xsum((W[i][j] * Ahelp[i][j])/np.log2(j+2) for j in V2)
         model += user_ndcg[i] == user_dcg[i] / user_idcg_i
@@ -201,8 +251,10 @@ def fairness_optimisation_proportional(
     for i in V1:
         for j in V2:
             model += W[i][j] <= 1
-    # optimizing
-    model.optimize()
+    # optimizing; the greedy selection is the fallback when the time budget leaves no solution
+    heuristic = greedy_selection('proportional', fairness_mode, uepsilon, iepsilon, topk, eval_method,
+                                 S, U, Ihelp, Ahelp, list_length)
+    _optimize(model, heuristic, max_seconds=max_seconds, max_gap=max_gap, info=info, threads=threads)
 
     return W, item_group
 
@@ -219,7 +271,12 @@ def fairness_optimisation_dcg_change(
         U: np.array,
         Ihelp: np.array,
         Ahelp: np.array,
-        train_checkins):
+        train_checkins,
+        list_length: int = 10,
+        max_seconds: float = None,
+        max_gap: float = None,
+        threads: int = None,
+        info: dict = None):
     print(
         f"Runing fairness optimisation on '{fairness_mode}', {uepsilon}, {iepsilon}")
     print(f"Active users: {U[:, 0].sum()}, Inactive users: {U[:, 1].sum()}")
@@ -268,13 +325,13 @@ def fairness_optimisation_dcg_change(
              - iepsilon * (item_group[0] - item_group[1]))
 
     # first constraint: the number of 1 in W should be equal to top-k, recommending top-k best items
-    k = 10
+    k = list_length
     for i in V1:
         model += xsum(W[i][j] for j in V2) == k
 
     for i in V1:
         ### CHANGE
-        user_idcg_i = 4.543559338088346
+        user_idcg_i = dcg_change_idcg(list_length)
 
         model += user_dcg[i] == xsum((W[i][j] * Ahelp[i][j])/np.log2(j+2) for j in V2)
         model += user_ndcg[i] == user_dcg[i] / user_idcg_i
@@ -300,7 +357,9 @@ def fairness_optimisation_dcg_change(
     for i in V1:
         for j in V2:
             model += W[i][j] <= 1
-    # optimizing
-    model.optimize()
+    # optimizing; the greedy selection is the fallback when the time budget leaves no solution
+    heuristic = greedy_selection('dcg_change', fairness_mode, uepsilon, iepsilon, topk, eval_method,
+                                 S, U, Ihelp, Ahelp, list_length)
+    _optimize(model, heuristic, max_seconds=max_seconds, max_gap=max_gap, info=info, threads=threads)
 
     return W, item_group
\ No newline at end of file
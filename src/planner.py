@@ -0,0 +1,309 @@
+from copy import deepcopy
+from datetime import datetime
+import os
+
+import cornac
+import pandas as pd
+
+from boxplot import create_boxplots
+from clean_results import clean_results
+from experiment import Experiment
+from experiment_dcg_change import ExperimentDCG
+from extension_proportional import ExtensionProportional
+from matrices import load_ground_truth_index, read_item_index
+from metrics import CUTOFF_COLUMNS, RESULT_COLUMNS, SelectionEvaluator
+from reranking import selected_items
+
+
+EXPERIMENTS = {
+    'reproduction': Experiment,
+    'dcg_change': ExperimentDCG,
+    'proportional': ExtensionProportional,
+}
+
+# config keys of run modes the planner does not cover, these configs are run with run_experiment
+UNSUPPORTED_KEYS = ('streaming', 'entropic', 'item_exposure', 'training', 'external_candidates',
+                    'dataset_overrides', 'preflight')
+
+STAGES = ('load', 'train', 'rank', 'retrieval', 'indicators', 'solve', 'evaluate', 'report')
+
+
+def _model_signature(model) -> tuple:
+    # the class and scalar hyperparameters of an untrained model, so that models of different configs
+    # are only merged when they train the same
+    return (type(model).__name__,) + tuple(sorted(
+        (key, value) for key, value in vars(model).items() if isinstance(value, (bool, int, float, str))))
+
+
+class Node():
+    # one stage of the plan: function is called with the results of the dependencies
+    def __init__(self, key: tuple, stage: str, function, dependencies: list):
+        self.key = key
+        self.stage = stage
+        self.function = function
+        self.dependencies = dependencies
+        self.consumers = 0
+
+
+class ExperimentPlanner():
+    """
+    Runs several experiment configs as one DAG of stages, load -> train -> rank (-> retrieval) ->
+    indicators -> solve -> evaluate -> report, in which identical nodes are merged
+
+    Every node is keyed by everything its result depends on, so the configs share the loaded datasets,
+    trained models, S and P, the Ahelp and Ihelp indicators and every identical optimisation problem
+    (e.g. the 'N' programs of the dcg_change and proportional formulations, which are the same).
+    Results are released as soon as their last consumer has run. Reports travel with the node
+    results, so a merged solve is reported in the solves.csv of every experiment that uses it and a
+    merged ranking in its retrieval_recall.csv (through a retrieval node, which keeps only the reports
+    of the ranking).
+
+    Parameters
+    ----------
+    experiments:
+      A list of (name, experiment) pairs, the name being the results subdirectory of the experiment
+    """
+
+    def __init__(self, experiments: list):
+        self.experiments = experiments
+        self.nodes = {}
+        self.requested = {stage: 0 for stage in STAGES}
+        for name, experiment in experiments:
+            unsupported = [key for key in UNSUPPORTED_KEYS if experiment.config.get(key)]
+            if unsupported:
+                raise ValueError(f"The planner does not cover the config keys {unsupported} of '{name}'!")
+            experiment.retrieval_reports = []
+            experiment.solve_reports = []
+
+    def _node(self, key: tuple, stage: str, function, *dependencies) -> Node:
+        self.requested[stage] += 1
+        if key not in self.nodes:
+            self.nodes[key] = Node(key, stage, function, list(dependencies))
+            for dependency in dependencies:
+                dependency.consumers += 1
+        return self.nodes[key]
+
+    def build(self):
+        """
+        Create the nodes of all experiments, dataset by dataset so that the arrays of a dataset are
+        released before the next one is loaded
+        """
+        datasets = []
+        for _, experiment in self.experiments:
+            datasets += [dataset for dataset in experiment.config['ds_names'] if dataset not in datasets]
+
+        cells = {name: [] for name, _ in self.experiments}
+        retrievals = {name: [] for name, _ in self.experiments}
+        for dataset in datasets:
+            for name, experiment in self.experiments:
+                if dataset in experiment.config['ds_names']:
+                    dataset_cells, dataset_retrievals = self._build_dataset(experiment, dataset)
+                    cells[name] += dataset_cells
+                    retrievals[name] += dataset_retrievals
+
+        for name, experiment in self.experiments:
+            dependencies = [node for cell in cells[name] for node in cell[-2:]] + retrievals[name]
+            self._node(('report', name), 'report', self._report_function(name, experiment, cells[name]),
+                       *dependencies)
+        return self
+
+    def _build_dataset(self, experiment: Experiment, dataset: str) -> list:
+        config = experiment.config
+        topk, list_length = config['topk'], config.get('list_length', 10)
+        _, cutoffs = experiment._cutoffs()
+        load = self._node(
+            ('load', dataset, config.get('group_source', 'files'), tuple(config['ds_user_groups']),
+             tuple(config['ds_item_groups']), config['no_of_user_groups'], config['no_of_item_groups'],
+             repr(config.get('interaction_logs')), repr(config.get('interaction_store'))),
+            'load', lambda: experiment._load_dataset_groups(dataset))
+
+        cells, retrievals = [], []
+        for model_index, model in enumerate(experiment.models):
+            train = self._node(('train', dataset, model.name, _model_signature(model)), 'train',
+                               self._train_function(experiment, model), load)
+            rank = self._node(
+                ('rank', train.key, topk, repr(config.get('retrieval')), config.get('score_block_size', 1024)),
+                'rank', self._rank_function(experiment, dataset), load, train)
+            retrievals.append(self._node(('retrieval', rank.key), 'retrieval', lambda ranking: ranking[2], rank))
+
+            for user_group in config['ds_user_groups']:
+                for i_group in config['ds_item_groups']:
+                    indicators = self._node(
+                        ('indicators', rank.key, load.key, user_group, i_group), 'indicators',
+                        self._indicator_function(experiment, user_group, i_group), load, rank)
+                    for fair_mode in config['fairness_categories']:
+                        for user_eps, item_eps in experiment._epsilon_grid(fair_mode):
+                            # without fairness terms the programs of the sorted formulations are identical
+                            program = experiment.formulation
+                            if fair_mode == 'N' and program != 'reproduction':
+                                program = 'sorted'
+                            solve = self._node(
+                                ('solve', indicators.key, program, fair_mode, user_eps, item_eps, list_length,
+                                 repr(config.get('solver'))), 'solve',
+                                self._solve_function(experiment, dataset, train, user_group, i_group,
+                                                     fair_mode, user_eps, item_eps),
+                                load, rank, indicators)
+                            evaluate = self._node(
+                                ('evaluate', solve.key, tuple(cutoffs)), 'evaluate',
+                                self._evaluate_function(cutoffs), load, rank, indicators, solve)
+                            cells.append((dataset, model_index, train, user_group, i_group, fair_mode,
+                                          user_eps, item_eps, solve, evaluate))
+        return cells, retrievals
+
+    @staticmethod
+    def _train_function(experiment: Experiment, model):
+        def train(data):
+            # trained and evaluated by Cornac, as in run_experiment
+            exp = cornac.Experiment(eval_method=data['eval_method'], models=[deepcopy(model)],
+                                    metrics=experiment.metrics)
+            exp.run()
+            return exp.models[0]
+        return train
+
+    @staticmethod
+    def _rank_function(experiment: Experiment, dataset: str):
+        def rank(data, trained):
+            # S and P, with the retrieval reports of the ranking for the retrieval_recall.csv of every consumer
+            reports = []
+            S, P = experiment._load_ranking(model=trained, dataset=dataset, eval_method=data['eval_method'],
+                                            train_checkins=data['train_checkins'], reports=reports)
+            return S, P, reports
+        return rank
+
+    @staticmethod
+    def _indicator_function(experiment: Experiment, user_group: str, i_group: str):
+        def indicators(data, ranking):
+            P = ranking[1]
+            total_users, topk = data['eval_method'].total_users, experiment.config['topk']
+            U, _, _ = data['user_groups'][user_group]
+            shorthead_item_ids, longtail_item_ids = data['item_groups'][i_group]
+            Ahelp = load_ground_truth_index(total_users=total_users, topk=topk, P=P,
+                                            train_checkins=data['train_checkins'])
+            Ihelp = read_item_index(total_users=total_users, topk=topk,
+                                    no_item_groups=experiment.config['no_of_item_groups'], P=P,
+                                    shorthead_item_ids=shorthead_item_ids, longtail_item_ids=longtail_item_ids)
+            return {'U': U, 'Ahelp': Ahelp, 'Ihelp': Ihelp}
+        return indicators
+
+    def _solve_function(self, experiment: Experiment, dataset: str, train: Node, user_group: str, i_group: str,
+                        fair_mode: str, user_eps, item_eps):
+        def solve(data, ranking, indicators):
+            S = ranking[0]
+            cache = experiment._solution_cache()
+            if cache is not None and 'digest' not in indicators:
+                indicators['digest'] = experiment._inputs_digest(S, indicators['Ahelp'], indicators['U'],
+                                                                 indicators['Ihelp'], data['train_checkins'])
+            # the solve report travels with the solution, to the solves.csv of every consumer
+            reports = []
+            selection, item_totals = experiment._solve_setting(
+                fair_mode, user_eps, item_eps, eval_method=data['eval_method'], S=S, U=indicators['U'],
+                Ihelp=indicators['Ihelp'], Ahelp=indicators['Ahelp'], train_checkins=data['train_checkins'],
+                cell=dict(Dataset=dataset, Model=train.key[2], GUser=user_group, GItem=i_group), cache=cache,
+                inputs_digest=indicators.get('digest'), reports=reports)
+            return selection, item_totals, reports
+        return solve
+
+    @staticmethod
+    def _evaluate_function(cutoffs: list):
+        def evaluate(data, ranking, indicators, solution):
+            P = ranking[1]
+            selection = solution[0]
+            U = indicators['U']
+            evaluator = SelectionEvaluator(ground_truth=data['ground_truth'], pop_items=data['pop_items'],
+                                           total_users=data['eval_method'].total_users,
+                                           total_items=data['eval_method'].total_items, cutoffs=cutoffs,
+                                           active=U[:, 0] == 1, inactive=U[:, 1] == 1)
+            return evaluator.evaluate(selected_items(selection, P))
+        return evaluate
+
+    def _report_function(self, name: str, experiment: Experiment, cells: list):
+        def report(*results):
+            # the results of every cell come in pairs of (solution, evaluation), in the order of cells,
+            # followed by the retrieval reports of every ranking
+            path = os.path.join(self.results_path, name)
+            os.makedirs(path, exist_ok=True)
+            frames = {}
+            solutions, evaluations = results[0:2 * len(cells):2], results[1:2 * len(cells):2]
+            for reports in results[2 * len(cells):]:
+                experiment.retrieval_reports.extend(reports)
+            for cell, solution, evaluation in zip(cells, solutions, evaluations):
+                dataset, model_index, train, user_group, i_group, fair_mode, user_eps, item_eps, _, _ = cell
+                if (dataset, user_group, i_group, model_index) not in frames:
+                    frames[dataset, user_group, i_group, model_index] = (
+                        pd.DataFrame(columns=RESULT_COLUMNS), pd.DataFrame(columns=CUTOFF_COLUMNS))
+                results_df, cutoff_df = frames[dataset, user_group, i_group, model_index]
+                experiment.solve_reports.extend(solution[2])
+                experiment._write_cell_results(
+                    results_df=results_df, cutoff_df=cutoff_df, fair_mode=fair_mode, dataset=dataset,
+                    model_name=train.key[2], user_group=user_group, i_group=i_group, user_eps=user_eps,
+                    item_eps=item_eps, evaluation=evaluation, item_totals=tuple(solution[1]),
+                    total_users=len(solution[0]))
+
+            experiment_results = {}
+            for dataset in experiment.config['ds_names']:
+                # in the row order of run_experiment: user group, item group, model
+                keys = sorted((key for key in frames if key[0] == dataset),
+                              key=lambda key: (experiment.config['ds_user_groups'].index(key[1]),
+                                               experiment.config['ds_item_groups'].index(key[2]), key[3]))
+                experiment_results[dataset] = pd.concat([clean_results(frames[key][0]) for key in keys])
+                experiment_results[dataset].to_csv(os.path.join(path, f"results_{dataset}.csv"), index=False)
+                if experiment.config.get('cutoffs'):
+                    pd.concat([frames[key][1] for key in keys]).to_csv(
+                        os.path.join(path, f"results_{dataset}_cutoffs.csv"), index=False)
+                if experiment.config['boxplot']:
+                    create_boxplots(os.path.join(path, 'boxplots'), dataset, experiment_results[dataset])
+            if experiment.solve_reports:
+                pd.DataFrame(experiment.solve_reports).to_csv(os.path.join(path, 'solves.csv'), index=False)
+            if experiment.retrieval_reports:
+                pd.concat(experiment.retrieval_reports).to_csv(os.path.join(path, 'retrieval_recall.csv'),
+                                                               index=False)
+            return experiment_results
+        return report
+
+    def summary(self) -> pd.DataFrame:
+        # per stage the number of nodes the experiments ask for and the number left after merging
+        executed = {stage: 0 for stage in STAGES}
+        for node in self.nodes.values():
+            executed[node.stage] += 1
+        return pd.DataFrame({'Stage': STAGES, 'Requested': [self.requested[stage] for stage in STAGES],
+                             'Executed': [executed[stage] for stage in STAGES]})
+
+    def execute(self) -> dict:
+        """
+        Run all nodes in order, releasing every result once all of its consumers have run
+
+        Returns
+        ----------
+        experiment_results:
+          Per experiment name the results per dataset, as run_experiment returns them
+        """
+        self.results_path = os.path.join('results', datetime.now().strftime('%d%m%Y%H%M%S'))
+        os.makedirs(self.results_path)
+        print(self.summary().to_string(index=False))
+
+        results, remaining = {}, {key: node.consumers for key, node in self.nodes.items()}
+        for key, node in self.nodes.items():
+            results[key] = node.function(*[results[dependency.key] for dependency in node.dependencies])
+            for dependency in node.dependencies:
+                remaining[dependency.key] -= 1
+                if remaining[dependency.key] == 0:
+                    del results[dependency.key]
+        return {name: results[('report', name)] for name, _ in self.experiments}
+
+
+def run_planned(configs: list, models: list, metrics: list) -> dict:
+    """
+    Run several experiment configs with shared work
+
+    Parameters
+    ----------
+    configs:
+      A list of (config path, formulation) pairs, the formulation one of EXPERIMENTS, e.g.
+      [('table_reproduction.yaml', 'reproduction'), ('table_dcg_change.yaml', 'dcg_change'),
+      ('table_proportional.yaml', 'proportional')]
+    """
+    experiments = []
+    for config_path, formulation in configs:
+        name = f"{os.path.splitext(os.path.basename(config_path))[0]}_{formulation}"
+        experiments.append((name, EXPERIMENTS[formulation](config_path, models, metrics)))
+    return ExperimentPlanner(experiments).build().execute()
@@ -0,0 +1,211 @@
+import glob
+import os
+from copy import deepcopy
+
+import numpy as np
+import pandas as pd
+
+
+# memory and time of the python-mip model per W variable, measured on MovieLens100K (943 users,
+# topk 50); replaced per backend by the recorded solve times of earlier runs when there are any
+MIP_BYTES_PER_VARIABLE = 1600
+MIP_SECONDS_PER_VARIABLE = 6e-5
+# the solver backends of solves.csv whose times are calibrated, the greedy fallback is not a backend
+# to plan with (its rows carry the time the solver spent before it ran out)
+SOLVER_BACKENDS = ('solver', 'candidate_pool')
+# candidates per user in the final pool of the candidate_pool backend relative to its first prefix
+# (max(initial, list_length)), measured on MovieLens100K: pools of 15 grew to 15-23
+POOL_GROWTH = 1.6
+# streaming: seconds per scored (user, item) pair and per re-ranked candidate and setting
+STREAMING_SECONDS_PER_SCORE = 2e-9
+STREAMING_SECONDS_PER_CANDIDATE = 1e-7
+# memory of the interpreter, Cornac and the loaded dataset next to the arrays
+BASE_MB = 500
+
+
+def dataset_sizes(dataset: str, datasets_dir: str = 'datasets'):
+    """
+    Number of users, items and train interactions of a downloaded dataset, the users and items being
+    those Cornac keeps (the ones in the train set); None if the dataset is not downloaded
+    """
+    train_path = os.path.join(datasets_dir, dataset, f"{dataset}_train.txt")
+    if not os.path.exists(train_path):
+        return None
+    train = pd.read_csv(train_path, sep='\t', header=None, usecols=[0, 1])
+    return train[0].nunique(), train[1].nunique(), len(train)
+
+
+def settings_per_cell(config: dict) -> int:
+    # number of optimisations per (model, user group, item group) cell, as Experiment._epsilon_grid
+    sizes = {'N': 1, 'C': len(config.get('user_epsilon', [])), 'P': len(config.get('item_epsilon', [])),
+             'CP': len(config.get('user_epsilon', [])) * len(config.get('item_epsilon', []))}
+    return sum(sizes.get(fair_mode, 0) for fair_mode in config['fairness_categories'])
+
+
+def pool_candidates(config: dict) -> int:
+    # the expected candidates per user in the solver model of the candidate_pool backend
+    pool = ((config.get('solver') or {}).get('candidate_pool')) or {}
+    first = max(pool.get('initial', 15), config.get('list_length', 10))
+    return int(min(config['topk'], np.ceil(first * POOL_GROWTH)))
+
+
+def cell_estimates(users: int, items: int, config: dict,
+                   seconds_per_variable: float = MIP_SECONDS_PER_VARIABLE, candidates: int = None) -> dict:
+    """
+    Model size, memory and runtime of one cell of an in-memory run
+
+    Parameters
+    ----------
+    candidates:
+      The candidates per user in the solver model, topk for the full model (the default) and
+      pool_candidates for the candidate_pool backend
+
+    Returns
+    ----------
+    estimates:
+      'Variables', 'Constraints' and 'Nonzeros' of one optimisation problem, the 'Dense_MB' of S, P,
+      Ahelp and Ihelp, the 'Solver_MB' of the python-mip models solved at once (see concurrent_solves)
+      and the 'Cell_Hours' of all optimisations of the cell
+    """
+    topk = config['topk']
+    candidates = candidates or topk
+    user_groups, item_groups = config['no_of_user_groups'], config['no_of_item_groups']
+    variables = users * candidates + 4 * users + 3 * user_groups + item_groups
+    # cardinality, dcg, ndcg, precision and recall per user, the group sums and W <= 1
+    constraints = 5 * users + 3 * user_groups + item_groups + users * candidates
+    nonzeros = users * candidates * (5 + item_groups) + 3 * users * user_groups
+    dense_bytes = 8 * (users * items + users * topk * (2 + item_groups))
+    # the dense arrays are shared by the concurrent solves of a cell, every solve has a model of its own
+    models = 1
+    if config.get('concurrent_solves'):
+        models = min(config['concurrent_solves'].get('workers') or os.cpu_count() or 1, settings_per_cell(config))
+    return {'Variables': variables, 'Constraints': constraints, 'Nonzeros': nonzeros,
+            'Dense_MB': dense_bytes / 1024 ** 2,
+            'Solver_MB': models * users * candidates * MIP_BYTES_PER_VARIABLE / 1024 ** 2,
+            'Cell_Hours': settings_per_cell(config) * users * candidates * seconds_per_variable / 3600}
+
+
+def streaming_estimates(users: int, items: int, config: dict, chunk_size: int) -> dict:
+    # peak memory of a streamed chunk (scores, candidates and indicators) and the hours of a cell
+    topk, item_groups = config['topk'], config['no_of_item_groups']
+    chunk_bytes = 8 * chunk_size * (2 * items + topk * (3 + item_groups))
+    seconds = users * items * STREAMING_SECONDS_PER_SCORE \
+        + settings_per_cell(config) * users * topk * STREAMING_SECONDS_PER_CANDIDATE
+    return {'Chunk_MB': chunk_bytes / 1024 ** 2, 'Cell_Hours': seconds / 3600}
+
+
+def calibration(results_dir: str = 'results'):
+    """
+    Median solve seconds per W variable of every solver backend in the recorded solves (solves.csv of
+    earlier runs) and the recorded peak training memory of every dataset (training.csv)
+
+    Only the rows of actual solver solves count: solves.csv has one row per solved setting with the
+    Backend and the Variables of its model, cached solutions have no row and greedy fallbacks, as
+    well as records without a Backend column, are left out.
+    """
+    ratios, training_mb = {}, {}
+    for path in glob.glob(os.path.join(results_dir, '*', 'solves.csv')):
+        solves = pd.read_csv(path)
+        if 'Backend' not in solves.columns or 'Variables' not in solves.columns:
+            continue
+        solves = solves[solves['Backend'].isin(SOLVER_BACKENDS) & (solves['Variables'] > 0)]
+        for backend, rows in solves.groupby('Backend'):
+            ratios.setdefault(backend, []).extend(rows['Seconds'] / rows['Variables'])
+    for path in glob.glob(os.path.join(results_dir, '*', 'training.csv')):
+        for dataset, peak in pd.read_csv(path).groupby('Dataset')['Peak_Memory_MB']:
+            training_mb[dataset] = max(training_mb.get(dataset, 0), peak.max())
+    return {backend: float(np.median(values)) for backend, values in ratios.items()}, training_mb
+
+
+def plan(config: dict, memory_gb: float, hours: float = None, cores: int = None, models: int = 1,
+         results_dir: str = 'results', datasets_dir: str = 'datasets') -> pd.DataFrame:
+    """
+    Pick the backend, solver backend, chunk size and number of training workers of every dataset of a
+    config such that a run fits the memory budget (and, if given, the time budget per cell)
+
+    The in-memory optimisation is kept when its arrays and solver model fit, with the full solver
+    model if it fits and otherwise the smaller model of the candidate_pool backend; otherwise the run
+    is downgraded to the streaming mode with the largest chunk that fits, and datasets for which not
+    even that fits within both budgets are refused.
+    """
+    memory_mb = memory_gb * 1024
+    cores = cores or os.cpu_count()
+    seconds_per_variable, training_mb = calibration(results_dir)
+    # a config that already solves by candidate pools is planned with them only
+    solvers = ['candidate_pool'] if (config.get('solver') or {}).get('candidate_pool') is not None \
+        else ['solver', 'candidate_pool']
+
+    rows = []
+    for dataset in config['ds_names']:
+        sizes = dataset_sizes(dataset, datasets_dir)
+        if sizes is None:
+            rows.append({'Dataset': dataset, 'Backend': 'unknown', 'Reason': 'not downloaded'})
+            continue
+        users, items, interactions = sizes
+        row = dict(Dataset=dataset, Users=users, Items=items, Interactions=interactions)
+        reasons = []
+        for solver in solvers:
+            estimates = cell_estimates(
+                users, items, config, seconds_per_variable.get(solver, MIP_SECONDS_PER_VARIABLE),
+                candidates=pool_candidates(config) if solver == 'candidate_pool' else None)
+            in_memory_mb = BASE_MB + estimates['Dense_MB'] + estimates['Solver_MB']
+            row.update(estimates)
+            if in_memory_mb <= memory_mb and (hours is None or estimates['Cell_Hours'] <= hours):
+                row.update(Backend='in_memory', Solver=solver, Chunk_Size=None, Peak_MB=in_memory_mb,
+                           Reason='; '.join(reasons))
+                break
+            reasons.append(f"{solver} over the {'memory' if in_memory_mb > memory_mb else 'time'} budget")
+        else:
+            # the largest power of two chunk that fits
+            chunk_size = 65536
+            while chunk_size >= 64 and \
+                    BASE_MB + streaming_estimates(users, items, config, chunk_size)['Chunk_MB'] > memory_mb:
+                chunk_size //= 2
+            streaming = streaming_estimates(users, items, config, max(chunk_size, 64))
+            if chunk_size < 64:
+                row.update(Backend='refused', Solver=None, Chunk_Size=None, Peak_MB=in_memory_mb,
+                           Reason='not even a streamed chunk of 64 users fits the memory budget')
+            elif hours is not None and streaming['Cell_Hours'] > hours:
+                row.update(Backend='refused', Solver=None, Chunk_Size=None, Peak_MB=in_memory_mb,
+                           Cell_Hours=streaming['Cell_Hours'],
+                           Reason=f"even the streaming mode takes {streaming['Cell_Hours']:.3g} hours per cell")
+            else:
+                row.update(Backend='streaming', Solver=None, Chunk_Size=chunk_size,
+                           Peak_MB=BASE_MB + streaming['Chunk_MB'], Cell_Hours=streaming['Cell_Hours'],
+                           Reason=f"in-memory run with {'; '.join(reasons)}")
+
+        # training: one model per worker, each holding the train set and (at most) its dense scores
+        job_mb = training_mb.get(dataset, BASE_MB + 8 * 2 * users * items / 1024 ** 2)
+        row['Workers'] = int(max(1, min(cores, models, memory_mb // job_mb)))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def apply_plan(config: dict, planned: pd.DataFrame) -> dict:
+    """
+    The config with the plan applied: refused datasets are dropped, downgraded datasets get a
+    streaming override and datasets planned with the candidate_pool backend a solver override
+    (dataset_overrides), and the training uses the smallest planned worker count
+    """
+    config = deepcopy(config)
+    overrides = config.get('dataset_overrides') or {}
+    kept = []
+    for row in planned.to_dict('records'):
+        if row['Backend'] in ('refused', 'unknown'):
+            print(f"{row['Dataset']} is left out of the run: {row['Reason']}")
+            continue
+        kept.append(row['Dataset'])
+        if row['Backend'] == 'streaming':
+            streaming = dict(config.get('streaming') or {}, chunk_size=int(row['Chunk_Size']))
+            overrides.setdefault(row['Dataset'], {})['streaming'] = streaming
+        elif row['Solver'] == 'candidate_pool' and (config.get('solver') or {}).get('candidate_pool') is None:
+            solver = dict(config.get('solver') or {}, candidate_pool={})
+            overrides.setdefault(row['Dataset'], {})['solver'] = solver
+    config['ds_names'] = kept
+    if overrides:
+        config['dataset_overrides'] = overrides
+    if kept and config.get('training') is not None:
+        workers = int(planned[planned['Dataset'].isin(kept)]['Workers'].min())
+        config['training'] = dict(config['training'] or {}, processes=workers)
+    return config
+
@@ -0,0 +1,16 @@
+import os
+
+from tqdm.auto import tqdm as auto_tqdm
+
+
+# set to 0 to disable the progress bars, e.g. on batch nodes whose logs should not fill up with them
+PROGRESS_VARIABLE = 'CPFAIR_PROGRESS'
+
+
+def tqdm(iterable=None, **kwargs):
+    """
+    Progress bar over an iterable: a widget in notebooks, text in a terminal, none when disabled
+    through the CPFAIR_PROGRESS environment variable
+    """
+    kwargs.setdefault('disable', os.environ.get(PROGRESS_VARIABLE, '1') == '0')
+    return auto_tqdm(iterable, **kwargs)
@@ -0,0 +1,191 @@
+from copy import deepcopy
+import multiprocessing
+import os
+
+import pandas as pd
+
+from boxplot import create_boxplots
+from clean_results import clean_results
+from monitor import finish
+from training import _fit, thread_limit_environment
+
+
+# the columns of clean_results that are aggregated over the seeds
+AGGREGATED_COLUMNS = ['All', 'Active', 'Inactive', 'DCF', 'Nov.', 'Cov.', 'Short.', 'Long.', 'DPF', 'mCPF', 'mCPF/All',
+                      'delta (%)']
+
+
+# the report lists of an experiment and the files the replicated run writes them to, as run_experiment
+REPORT_FILES = {
+    'training_reports': 'training.csv',
+    'solve_reports': 'solves.csv',
+    'retrieval_reports': 'retrieval_recall.csv',
+    'retrieval_metric_reports': 'retrieval_metrics.csv',
+    'item_exposure_reports': 'item_exposure.csv',
+    'entropic_reports': 'entropic_gap.csv',
+    'bootstrap_reports': 'bootstrap.csv',
+}
+
+# the loaded datasets of a worker process, set once per process by _init_worker
+_datasets = {}
+
+
+def _init_worker(datasets: dict):
+    global _datasets
+    _datasets = datasets
+
+
+def seeded_model(model, seed: int):
+    # an unfitted copy of a Cornac model with another seed
+    model = deepcopy(model)
+    model.seed = seed
+    return model
+
+
+def _replicate_job(job):
+    """
+    Runs in a worker process: train one model with one seed and re-rank and evaluate it for every user
+    and item group, as Experiment._rank_model, returning every report of the cells with their seed
+    """
+    experiment_class, config, metrics, dataset, model_index, model, seed = job
+    data = _datasets[dataset]
+    experiment = experiment_class.from_config(config, models=[model], metrics=metrics)
+    experiment._start_reports()
+    _, model, _, report = _fit(((dataset, model_index, seed), model, data['eval_method'], metrics))
+    frames = experiment._rank_model(dataset, data, model)
+    experiment.training_reports.append(dict(Dataset=dataset, Model=model.name, **report))
+    experiment.bootstrap_reports = experiment._bootstrap_rows()
+    reports = {}
+    for name in REPORT_FILES:
+        rows = getattr(experiment, name)
+        if name == 'retrieval_reports':
+            # the recall curves are frames
+            reports[name] = [frame.assign(Seed=seed) for frame in rows]
+        else:
+            reports[name] = [dict(row, Seed=seed) for row in rows]
+    if experiment.bootstrap_pool is not None:
+        experiment.bootstrap_pool.shutdown()
+    finish()
+    return dataset, model_index, seed, frames, reports
+
+
+def aggregate_seeds(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mean, standard deviation, minimum and maximum over the seeds of every clean_results column
+
+    Parameters
+    ----------
+    results:
+      The clean results of all seeds with a 'Seed' column and, per seed, a 'Row' column numbering the
+      rows of a model (the settings appear in the same order for every seed)
+    """
+    grouped = results.groupby(['Dataset', 'Model', 'Row'], sort=False)
+    aggregated = grouped[AGGREGATED_COLUMNS].agg(['mean', 'std', 'min', 'max'])
+    aggregated.columns = [f"{column}_{statistic}" for column, statistic in aggregated.columns]
+    aggregated.insert(0, 'Seeds', grouped['Seed'].nunique())
+    aggregated.insert(0, 'Type', grouped['Type'].first())
+    return aggregated.reset_index().drop(columns='Row')
+
+
+class ReplicationRunner():
+    """
+    Runs the pipeline of an experiment for several seeds of every model in parallel
+
+    Every dataset is loaded, and its user and item groups built, once in the main process and sent
+    once to every worker process (spawn, with thread limits as the TrainingScheduler) by the pool's
+    initializer; every (dataset, model, seed) is then trained, re-ranked and evaluated in one of the
+    workers, at most processes at once.
+
+    Parameters
+    ----------
+    experiment:
+      The experiment (or one of its extensions) whose config and models are replicated
+    seeds:
+      The seeds every model is run with, replacing the seeds of the models
+    processes:
+      Number of worker processes, by default cores / threads_per_job
+    """
+
+    def __init__(self, experiment, seeds: list, processes: int = None, threads_per_job: int = 1):
+        self.experiment = experiment
+        self.seeds = seeds
+        self.processes = processes or max(1, os.cpu_count() // threads_per_job)
+        self.threads_per_job = threads_per_job
+
+    def _jobs(self, dataset: str) -> list:
+        config = dict(self.experiment.config)
+        # the workers run the cells themselves, without replicating again or training concurrently
+        config.pop('replication', None)
+        config.pop('training', None)
+        return [(type(self.experiment), config, self.experiment.metrics, dataset, model_index,
+                 seeded_model(model, seed), seed)
+                for model_index, model in enumerate(self.experiment.models) for seed in self.seeds]
+
+    def run(self, results_path: str) -> dict:
+        """
+        Run all seeds and write per dataset the results of every seed (results_<dataset>_seeds.csv),
+        their aggregates (replication_<dataset>.csv) and their means in the columns of the results of
+        run_experiment (results_<dataset>.csv), next to the reports of all seeds
+
+        Returns
+        ----------
+        replication_results:
+          Per dataset the aggregated results
+        """
+        config = self.experiment.config
+        jobs, datasets = [], {}
+        for dataset in config['ds_names']:
+            datasets[dataset] = self.experiment._load_dataset_groups(dataset)
+            jobs += self._jobs(dataset)
+
+        ranked, reports = {}, {name: [] for name in REPORT_FILES}
+        context = multiprocessing.get_context('spawn')
+        with thread_limit_environment(self.threads_per_job):
+            with context.Pool(processes=min(self.processes, len(jobs)), initializer=_init_worker,
+                              initargs=(datasets,)) as pool:
+                for dataset, model_index, seed, frames, job_reports in pool.imap_unordered(_replicate_job, jobs):
+                    print(f"Replicated {self.experiment.models[model_index].name} on {dataset} with seed {seed}")
+                    ranked[dataset, model_index, seed] = frames
+                    for name, rows in job_reports.items():
+                        reports[name] += rows
+
+        replication_results = {}
+        for dataset in config['ds_names']:
+            results = []
+            for seed in self.seeds:
+                # in the row order of run_experiment: user group, item group, model
+                seed_results = []
+                for user_group in config['ds_user_groups']:
+                    for i_group in config['ds_item_groups']:
+                        for model_index in range(len(self.experiment.models)):
+                            results_df, _ = ranked[dataset, model_index, seed][user_group, i_group]
+                            seed_results.append(clean_results(results_df))
+                seed_results = pd.concat(seed_results)
+                seed_results.insert(2, 'Seed', seed)
+                seed_results['Row'] = seed_results.groupby('Model').cumcount()
+                results.append(seed_results)
+            results = pd.concat(results)
+            results.drop(columns='Row').to_csv(os.path.join(results_path, f"results_{dataset}_seeds.csv"),
+                                               index=False)
+
+            replication_results[dataset] = aggregate_seeds(results)
+            replication_results[dataset].to_csv(os.path.join(results_path, f"replication_{dataset}.csv"),
+                                                index=False)
+            means = replication_results[dataset][['Dataset', 'Model', 'Type'] +
+                                                 [f"{column}_mean" for column in AGGREGATED_COLUMNS]]
+            means.columns = ['Dataset', 'Model', 'Type'] + AGGREGATED_COLUMNS
+            # rounded as clean_results
+            means = means.round(4)
+            means['delta (%)'] = means['delta (%)'].round(2)
+            means.to_csv(os.path.join(results_path, f"results_{dataset}.csv"), index=False)
+            if config['boxplot']:
+                # one box over all seeds and settings per fairness type
+                create_boxplots(os.path.join(results_path, 'boxplots'), dataset, results)
+
+        for name, rows in reports.items():
+            if rows:
+                report = pd.concat(rows) if name == 'retrieval_reports' else pd.DataFrame(rows)
+                report.to_csv(os.path.join(results_path, REPORT_FILES[name]), index=False)
+        if self.experiment.bootstrap_pool is not None:
+            self.experiment.bootstrap_pool.shutdown()
+        return replication_results
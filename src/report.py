@@ -0,0 +1,246 @@
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import pandas as pd
+
+
+# the columns of the paper tables, as clean_results writes them
+TABLE_COLUMNS = ['All', 'Active', 'Inactive', 'DCF', 'Nov.', 'Cov.', 'Short.', 'Long.', 'DPF', 'mCPF', 'delta (%)']
+ORDER = ['N', 'C', 'P', 'CP']
+# part of the digest of every output, to be increased when the rendering changes so that all outputs
+# are rendered again
+REPORT_VERSION = 1
+MANIFEST = 'report_manifest.json'
+
+
+def _run_name(run_dir: str) -> str:
+    return os.path.basename(os.path.normpath(run_dir))
+
+
+def result_files(run_dir: str) -> dict:
+    # the clean results of every dataset of a results/<run> directory
+    files = {}
+    for name in sorted(os.listdir(run_dir)):
+        if name.startswith('results_') and name.endswith('.csv') and not name.endswith(('_cutoffs.csv', '_seeds.csv')):
+            files[name[len('results_'):-len('.csv')]] = os.path.join(run_dir, name)
+    return files
+
+
+def _digest(kind: str, inputs: list) -> str:
+    # the digest of an output: its kind, the report version and the contents of its inputs
+    digest = hashlib.sha256(f"{kind}{REPORT_VERSION}".encode())
+    for path in inputs:
+        digest.update(path.encode())
+        with open(path, 'rb') as input_file:
+            digest.update(input_file.read())
+    return digest.hexdigest()
+
+
+def frontier_figure(df: pd.DataFrame, dataset: str):
+    """
+    Accuracy (nDCG, column 'All') against unfairness (mCPF) of every setting, per model, with the
+    frontier of settings that no other setting beats in both
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(6.4, 4.8))
+    ax = figure.subplots()
+    for model, rows in df.groupby('Model', sort=False):
+        ax.scatter(rows['mCPF'], rows['All'], label=model, alpha=0.8)
+        for _, row in rows.iterrows():
+            ax.annotate(row['Type'], (row['mCPF'], row['All']), textcoords='offset points', xytext=(3, 3), fontsize=8)
+
+    # from the fairest setting on, the settings with a higher nDCG than all fairer ones
+    points = df.sort_values(['mCPF', 'All'], ascending=[True, False])[['mCPF', 'All']].to_numpy()
+    frontier, best = [], -float('inf')
+    for unfairness, accuracy in points:
+        if accuracy > best:
+            frontier.append((unfairness, accuracy))
+            best = accuracy
+    ax.step([point[0] for point in frontier], [point[1] for point in frontier], where='post', color='grey',
+            linestyle='--', label='frontier')
+    ax.set_xlabel('mCPF', fontsize=13)
+    ax.set_ylabel('nDCG', fontsize=13)
+    ax.set_title(dataset, fontsize=14, weight='bold')
+    ax.legend(fontsize=9)
+    return figure
+
+
+def comparison_figure(frames: dict, dataset: str):
+    """
+    The mean nDCG and mCPF of every fairness type side by side: per model for the results of one run,
+    per run (the mean over its models) for several
+
+    Parameters
+    ----------
+    frames:
+      The clean results of the dataset per run name
+    """
+    import numpy as np
+    from matplotlib.figure import Figure
+
+    if len(frames) == 1:
+        df = next(iter(frames.values()))
+        groups = [(model, rows.groupby('Type')[['All', 'mCPF']].mean().reindex(ORDER))
+                  for model, rows in df.groupby('Model', sort=False)]
+    else:
+        groups = [(run, df.groupby('Type')[['All', 'mCPF']].mean().reindex(ORDER)) for run, df in frames.items()]
+
+    figure = Figure(figsize=(9.6, 4.8))
+    axes = figure.subplots(1, 2)
+    width = 0.8 / len(groups)
+    positions = np.arange(len(ORDER))
+    for ax, column in zip(axes, ('All', 'mCPF')):
+        for index, (label, means) in enumerate(groups):
+            ax.bar(positions + (index - (len(groups) - 1) / 2) * width, means[column].to_numpy(), width, label=label)
+        ax.set_xticks(positions)
+        ax.set_xticklabels(ORDER)
+        ax.set_xlabel('Type', fontsize=13, weight='bold')
+        ax.set_ylabel('nDCG' if column == 'All' else column, fontsize=13)
+    axes[1].legend(fontsize=8, bbox_to_anchor=(1.02, 1), loc='upper left')
+    figure.suptitle(dataset, fontsize=14, weight='bold')
+    return figure
+
+
+def latex_table(df: pd.DataFrame, dataset: str) -> str:
+    # the results of a dataset as a booktabs table, as in the paper
+    columns = [column for column in TABLE_COLUMNS if column in df.columns]
+    lines = [r"\begin{table}[ht]", r"\centering", f"\\caption{{{dataset}}}",
+             r"\begin{tabular}{ll" + 'r' * len(columns) + "}", r"\toprule",
+             ' & '.join(['Model', 'Type'] + [column.replace('%', r'\%') for column in columns]) + r" \\", r"\midrule"]
+    previous = None
+    for _, row in df.iterrows():
+        if previous is not None and row['Model'] != previous:
+            lines.append(r"\midrule")
+        previous = row['Model']
+        lines.append(' & '.join([str(row['Model']), str(row['Type'])] +
+                                [f"{row[column]:.4f}" if column != 'delta (%)' else f"{row[column]:.2f}"
+                                 for column in columns]) + r" \\")
+    lines += [r"\bottomrule", r"\end{tabular}", r"\end{table}", ""]
+    return '\n'.join(lines)
+
+
+def _render(job):
+    # runs in a worker process: render one output from its input files
+    kind, inputs, output, dataset, names = job
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    frames = {name: pd.read_csv(path) for name, path in zip(names, inputs)}
+    if kind == 'table':
+        with open(output, 'w') as table_file:
+            table_file.write(latex_table(frames[names[0]], dataset))
+        return output
+
+    if kind == 'boxplot':
+        from boxplot import boxplot_figure
+        figure = boxplot_figure(frames[names[0]])
+    elif kind == 'frontier':
+        figure = frontier_figure(frames[names[0]], dataset)
+    else:
+        figure = comparison_figure(frames, dataset)
+    figure.savefig(output, bbox_inches='tight')
+    return output
+
+
+class ReportGenerator():
+    """
+    Renders the tables and figures of stored results, for one or several results/<run> directories
+
+    Per run and dataset: the boxplot (boxplots/<dataset>.png, as run_experiment draws it), the
+    accuracy-fairness frontier (frontier/<dataset>.png), the paper table (tables/<dataset>.tex) and the
+    comparison of the models per fairness type (comparison/<dataset>.png); with several runs the
+    comparison puts the runs side by side instead. The outputs of a run go to output/<run>, the
+    comparisons to output, so that the stored runs are only read; with in_place the outputs of a run
+    are written into its own directory instead. Every output is rendered in a pool of worker processes
+    with the object-oriented matplotlib API (no display or pyplot state), and is skipped when it exists
+    and the digest of its inputs in the manifest of its directory is unchanged.
+
+    Parameters
+    ----------
+    runs:
+      The results/<run> directories
+    output:
+      The directory of the outputs, by default 'report'
+    processes:
+      Number of worker processes, by default the number of cores
+    force:
+      Render every output again
+    in_place:
+      Write the outputs and the manifest of every run into the run's directory, and the comparison of
+      a single run too
+    """
+
+    def __init__(self, runs: list, output: str = None, processes: int = None, force: bool = False,
+                 in_place: bool = False):
+        self.runs = runs
+        self.in_place = in_place
+        self.output = output or (runs[0] if in_place and len(runs) == 1 else 'report')
+        self.processes = processes or os.cpu_count()
+        self.force = force
+        names = [_run_name(run) for run in runs]
+        if not in_place and len(set(names)) < len(names):
+            raise ValueError(f"The runs {runs} share directory names, render them separately or in place!")
+
+    def _run_output(self, run: str) -> str:
+        # the directory of the outputs of one run
+        return run if self.in_place else os.path.join(self.output, _run_name(run))
+
+    def jobs(self) -> list:
+        # (kind, inputs, output, dataset, input names) of every output
+        jobs, datasets = [], {}
+        for run in self.runs:
+            run_output = self._run_output(run)
+            for dataset, path in result_files(run).items():
+                datasets.setdefault(dataset, []).append((_run_name(run), path))
+                jobs += [('boxplot', [path], os.path.join(run_output, 'boxplots', f"{dataset}.png"), dataset,
+                          ['run']),
+                         ('frontier', [path], os.path.join(run_output, 'frontier', f"{dataset}.png"), dataset,
+                          ['run']),
+                         ('table', [path], os.path.join(run_output, 'tables', f"{dataset}.tex"), dataset, ['run'])]
+        for dataset, runs in datasets.items():
+            jobs.append(('comparison', [path for _, path in runs],
+                         os.path.join(self.output, 'comparison', f"{dataset}.png"), dataset, [name for name, _ in runs]))
+        return jobs
+
+    def run(self) -> dict:
+        """
+        Render the outputs whose inputs changed
+
+        Returns
+        ----------
+        counts:
+          The number of outputs that were 'rendered' and 'skipped'
+        """
+        manifests, pending = {}, []
+        for job in self.jobs():
+            kind, inputs, output = job[:3]
+            root = os.path.dirname(os.path.dirname(output))
+            if root not in manifests:
+                manifest_path = os.path.join(root, MANIFEST)
+                manifests[root] = {}
+                if os.path.exists(manifest_path):
+                    with open(manifest_path) as manifest_file:
+                        manifests[root] = json.load(manifest_file)
+            name = os.path.relpath(output, root)
+            digest = _digest(kind, inputs)
+            if not self.force and os.path.exists(output) and manifests[root].get(name) == digest:
+                continue
+            pending.append((job, root, name, digest))
+
+        if len(pending) > 1 and self.processes > 1:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(pending)), mp_context=context) as pool:
+                rendered = list(pool.map(_render, [job for job, *_ in pending]))
+        else:
+            rendered = [_render(job) for job, *_ in pending]
+        for output, (_, root, name, digest) in zip(rendered, pending):
+            print(f"Wrote {output}")
+            manifests[root][name] = digest
+
+        for root, manifest in manifests.items():
+            os.makedirs(root, exist_ok=True)
+            with open(os.path.join(root, MANIFEST), 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        return {'rendered': len(pending), 'skipped': len(self.jobs()) - len(pending)}
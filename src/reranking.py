@@ -0,0 +1,117 @@
+import numpy as np
+
+
+# the optimisation problems of optimisation.py: the original reproduction, the corrected DCG
+# (experiment_dcg_change) and the group size proportional extension (extension_proportional)
+FORMULATIONS = ('reproduction', 'dcg_change', 'proportional')
+
+
+def reproduction_idcg(k: int) -> float:
+    # IDCG of the original natural logarithm nDCG of a list of k items, 7.137938133620551 for k = 10
+    return 1.0 + float(np.sum(1.0 / np.log(np.arange(k - 1) + 2)))
+
+
+def dcg_change_idcg(k: int) -> float:
+    # IDCG of a list of k items with log2 discounts, 4.543559338088346 for k = 10
+    return float(np.sum(1.0 / np.log2(np.arange(k) + 2)))
+
+
+def formulation_scores(formulation: str, S: np.array, topk: int) -> np.array:
+    """
+    The users x topk score coefficients of W as the formulation uses them: the original
+    reproduction reads the first topk columns of the unsorted S, the extensions sort S first.
+    """
+    if formulation == 'reproduction':
+        return S[:, :topk]
+    return -np.sort(-S, axis=1)[:, :topk]
+
+
+def proportional_sizes(U: np.array, Ihelp: np.array) -> dict:
+    # the group sizes as fairness_optimisation_proportional computes them
+    return {'active': U[:, 0].sum(), 'inactive': U[:, 1].sum(),
+            'shorthead': Ihelp[:, 0].sum(), 'longtail': Ihelp[:, 1].sum()}
+
+
+def objective_coefficients(formulation: str, fairness_mode: str, uepsilon, iepsilon, S: np.array,
+                           U: np.array, Ahelp: np.array, Ihelp: np.array, total_users: int = None,
+                           total_items: int = None, group_sizes: dict = None, k: int = 10) -> np.array:
+    """
+    Objective coefficient of every W[i][j] of a fairness optimisation problem
+
+    The group nDCG and item group exposure terms of the objectives are linear in W, so with the
+    epsilons fixed the problem separates per user: under the constraint sum_j W[i][j] == k the
+    optimum selects the k largest coefficients of every user. The arguments only need to cover
+    a chunk of users, the problem-wide quantities (total_users, total_items, group_sizes) are only
+    needed by the proportional formulation.
+
+    Parameters
+    ----------
+    S:
+      The chunk x topk scores as returned by formulation_scores
+    U, Ahelp, Ihelp:
+      The rows of the chunk's users in the user group, relevance and item group matrices
+    k:
+      The length of the recommendation lists
+
+    Returns
+    ----------
+    coefficients:
+      A chunk x topk matrix
+    """
+    coefficients = np.array(S, dtype=np.float64, copy=True)
+    topk = coefficients.shape[1]
+    discount = 1.0 / np.log2(np.arange(topk) + 2) / dcg_change_idcg(k)
+
+    if fairness_mode in ('C', 'CP'):
+        if formulation == 'reproduction':
+            # uepsilon * (group_ndcg_v[0] - group_ndcg_v[1]), group_ndcg_v summing the undiscounted user DCG
+            coefficients -= uepsilon * (U[:, 0] - U[:, 1])[:, None] * Ahelp
+        elif formulation == 'dcg_change':
+            coefficients -= uepsilon * (U[:, 1] - U[:, 0])[:, None] * Ahelp * discount
+        elif formulation == 'proportional':
+            weight = (U[:, 1] * group_sizes['inactive'] - U[:, 0] * group_sizes['active']) / total_users
+            coefficients -= uepsilon * weight[:, None] * Ahelp * discount
+        else:
+            raise ValueError(f"Unknown formulation '{formulation}'!")
+
+    if fairness_mode in ('P', 'CP'):
+        if formulation == 'proportional':
+            coefficients -= iepsilon * (Ihelp[:, :, 0] * group_sizes['shorthead']
+                                        - Ihelp[:, :, 1] * group_sizes['longtail']) / total_items
+        else:
+            coefficients -= iepsilon * (Ihelp[:, :, 0] - Ihelp[:, :, 1])
+
+    return coefficients
+
+
+def problem_coefficients(formulation: str, fairness_mode: str, uepsilon, iepsilon, topk: int, S: np.array,
+                         U: np.array, Ihelp: np.array, Ahelp: np.array, total_users: int, total_items: int,
+                         k: int = 10) -> np.array:
+    """
+    The users x topk objective coefficients of a whole optimisation problem, from the arguments of
+    the fairness_optimisation functions
+    """
+    group_sizes = proportional_sizes(U, Ihelp) if formulation == 'proportional' else None
+    return objective_coefficients(
+        formulation=formulation, fairness_mode=fairness_mode, uepsilon=uepsilon, iepsilon=iepsilon,
+        S=formulation_scores(formulation, S, topk), U=U, Ahelp=Ahelp[:, :topk], Ihelp=Ihelp[:, :topk],
+        total_users=total_users, total_items=total_items, group_sizes=group_sizes, k=k)
+
+
+def select_topk(coefficients: np.array, k: int) -> np.array:
+    """
+    Boolean chunk x topk selection of the k largest coefficients of every row, earlier
+    candidates winning ties
+    """
+    order = np.argsort(-coefficients, axis=1, kind='stable')[:, :k]
+    selection = np.zeros(coefficients.shape, dtype=bool)
+    np.put_along_axis(selection, order, True, axis=1)
+    return selection
+
+
+def selected_items(selection: np.array, P: np.array) -> np.array:
+    """
+    The chunk x k matrix of selected item indices in candidate (slot) order, as the metrics read them
+    """
+    k = int(selection[0].sum()) if len(selection) else 0
+    return P[selection].reshape(-1, k).astype(np.int64)
@@ -0,0 +1,188 @@
+import time
+
+import numpy as np
+import pandas as pd
+from progress import tqdm
+
+from clean_results import fairness_scores
+from matrices import get_model_factors, topk_indices
+
+
+class ClusteredMIPSIndex():
+    """
+    Inverted-file index for approximate maximum inner product search over item factors.
+
+    Items are augmented with an extra dimension sqrt(M^2 - |v|^2), which gives every item the
+    same norm M so that the inner product ranking of a query equals its cosine ranking, and then
+    clustered with spherical k-means. A query only scores the items in the n_probe clusters whose
+    centroids have the highest inner product with it; n_probe is the recall/latency knob.
+    """
+
+    def __init__(self, item_factors: np.array, n_clusters: int = None, n_iter: int = 10, seed: int = 123):
+        self.item_factors = np.asarray(item_factors)
+        total_items, dim = self.item_factors.shape
+        if n_clusters is None:
+            n_clusters = max(1, int(np.sqrt(total_items)))
+        n_clusters = min(n_clusters, total_items)
+
+        norms = np.linalg.norm(self.item_factors, axis=1)
+        augmented = np.hstack([self.item_factors, np.sqrt(np.maximum(norms.max() ** 2 - norms ** 2, 0))[:, None]])
+        augmented /= np.maximum(np.linalg.norm(augmented, axis=1, keepdims=True), 1e-12)
+
+        rng = np.random.RandomState(seed)
+        centroids = augmented[rng.choice(total_items, n_clusters, replace=False)]
+        for _ in range(n_iter):
+            assignment = augmented.dot(centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, augmented)
+            counts = np.bincount(assignment, minlength=n_clusters)
+            # re-seed empty clusters with random items
+            empty = counts == 0
+            sums[empty] = augmented[rng.choice(total_items, empty.sum(), replace=False)]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        assignment = augmented.dot(centroids.T).argmax(axis=1)
+
+        # queries have a zero in the augmented dimension, so only the factor part of a centroid matters
+        self.centroids = centroids[:, :dim]
+        self.n_clusters = n_clusters
+
+        # padded cluster membership lists, -1 marks padding
+        counts = np.bincount(assignment, minlength=n_clusters)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        slots = np.arange(total_items) - offsets[assignment[order]]
+        self.members = -np.ones((n_clusters, counts.max()), dtype=np.int64)
+        self.members[assignment[order], slots] = order
+
+    def search(self, user_factors: np.array, topk: int, n_probe: int = 8):
+        """
+        Approximate topk items with the highest inner product for every row of user_factors
+
+        Returns
+        ----------
+        scores:
+          A len(user_factors) x topk matrix of inner products, best first
+        indices:
+          A len(user_factors) x topk matrix of item indices
+        """
+        n_probe = min(n_probe, self.n_clusters)
+        probes = topk_indices(user_factors.dot(self.centroids.T), n_probe)
+        candidates = self.members[probes].reshape(len(user_factors), -1)
+        valid = candidates >= 0
+
+        scores = np.einsum('ud,ucd->uc', user_factors, self.item_factors[np.where(valid, candidates, 0)])
+        scores[~valid] = -np.inf
+
+        top = topk_indices(scores, topk)
+        scores, indices = np.take_along_axis(scores, top, axis=1), np.take_along_axis(candidates, top, axis=1)
+
+        # users whose probed clusters hold fewer than topk items are scored exhaustively
+        short = valid.sum(axis=1) < topk
+        if short.any():
+            exhaustive = user_factors[short].dot(self.item_factors.T)
+            indices[short] = topk_indices(exhaustive, topk)
+            scores[short] = np.take_along_axis(exhaustive, indices[short], axis=1)
+        return scores, indices
+
+
+def build_item_index(model, total_items: int, n_clusters: int = None, seed: int = 123):
+    """
+    Build a ClusteredMIPSIndex over the item factors of a trained model, None for models
+    that do not expose their factors.
+    """
+    factors = get_model_factors(model)
+    if factors is None or factors[1].shape[0] != total_items:
+        return None
+    return ClusteredMIPSIndex(factors[1], n_clusters=n_clusters, seed=seed)
+
+
+def load_approximate_ranking_matrices(model, total_users, total_items, topk, index: ClusteredMIPSIndex,
+                                      n_probe=8, block_size=1024):
+    # S saves the scores of the topk ranked items (best first), not the full user x item scores.
+    # Formulations that sort S (dcg change, proportional) see the same values as with the exact S.
+    # P includes the indices of topk ranked items
+    user_factors, _, link = get_model_factors(model)
+    S = np.zeros((total_users, topk))
+    P = np.zeros((total_users, topk))
+
+    print(model.name)
+    for start in tqdm(range(0, total_users, block_size)):
+        stop = min(start + block_size, total_users)
+        scores, top = index.search(user_factors[start:stop], topk=topk, n_probe=n_probe)
+        S[start:stop] = scores if link is None else link(scores)
+        P[start:stop] = top
+
+    return S, P
+
+
+def retrieval_recall(exact_P: np.array, approx_P: np.array, k: int = None) -> float:
+    """
+    Mean fraction of the exact top-k items that the approximate top-k also retrieves
+    """
+    k = exact_P.shape[1] if k is None else k
+    exact, approx = exact_P[:, :k].astype(np.int64), approx_P[:, :k].astype(np.int64)
+    hits = (exact[:, :, None] == approx[:, None, :]).any(axis=2)
+    return float(hits.mean())
+
+
+def cpfair_metrics(evaluation: dict, item_totals, total_users: int, list_length: int) -> dict:
+    """
+    nDCG of all, active and inactive users, DCF, the short-head and longtail exposure, DPF and mCPF of a
+    selection as clean_results computes them, from its evaluation at the list length
+    (SelectionEvaluator.evaluate()[list_length]) and its item group totals
+    """
+    active, inactive = np.float64(evaluation['active'][0]), np.float64(evaluation['inactive'][0])
+    short, long = item_totals[0] / (total_users * list_length), item_totals[1] / (total_users * list_length)
+    dcf, dpf, mcpf = fairness_scores(active, inactive, short, long)
+    return {'All': evaluation['all'][0], 'Active': active, 'Inactive': inactive, 'DCF': dcf, 'Short.': short,
+            'Long.': long, 'DPF': dpf, 'mCPF': mcpf}
+
+
+def recall_report(model, total_users: int, total_items: int, topk: int, train_checkins=None,
+                  n_clusters: int = None, n_probes: list = (1, 2, 4, 8, 16, 32),
+                  sample_users: int = 2000, seed: int = 123) -> pd.DataFrame:
+    """
+    Compare approximate against exhaustive retrieval on a sample of users
+
+    Returns
+    ----------
+    report:
+      One row per n_probe with recall@topk and recall@10 against the exact ranking, the share of
+      the exact top-k items that are train check-ins (the relevance the optimisation sees, Ahelp)
+      that is retained, and the retrieval time per user and speed-up over exhaustive scoring
+    """
+    index = build_item_index(model, total_items, n_clusters=n_clusters, seed=seed)
+    if index is None:
+        raise ValueError(f"Model '{model.name}' does not expose user and item factors!")
+    user_factors = get_model_factors(model)[0]
+
+    rng = np.random.RandomState(seed)
+    users = np.sort(rng.choice(total_users, min(sample_users, total_users), replace=False))
+
+    start_time = time.perf_counter()
+    exact_P = user_factors[users].dot(index.item_factors.T)
+    exact_P = topk_indices(exact_P, topk)
+    exact_seconds = time.perf_counter() - start_time
+
+    def checkin_hits(P):
+        if train_checkins is None:
+            return None
+        return np.array([[item in train_checkins[uid] for item in row] for uid, row in zip(users, P)])
+
+    exact_hits = checkin_hits(exact_P)
+    rows = []
+    for n_probe in n_probes:
+        start_time = time.perf_counter()
+        _, approx_P = index.search(user_factors[users], topk=topk, n_probe=n_probe)
+        seconds = time.perf_counter() - start_time
+        approx_hits = checkin_hits(approx_P)
+        rows.append({
+            'n_probe': n_probe,
+            'n_clusters': index.n_clusters,
+            f'recall@{topk}': retrieval_recall(exact_P, approx_P),
+            'recall@10': retrieval_recall(exact_P, approx_P, k=min(10, topk)),
+            'checkin_retention': np.nan if exact_hits is None else approx_hits.sum() / max(exact_hits.sum(), 1),
+            'ms_per_user': 1000 * seconds / len(users),
+            'speedup': exact_seconds / max(seconds, 1e-12),
+        })
+    return pd.DataFrame(rows)
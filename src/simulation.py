@@ -0,0 +1,161 @@
+import time
+
+import numpy as np
+
+from bootstrap import fairness_metrics, user_columns
+from groups import group_matrix
+from matrices import contains_interactions, get_model_factors, interaction_keys, item_index_block, topk_indices
+from metrics import user_metrics
+from reranking import formulation_scores, objective_coefficients, select_topk, selected_items
+
+
+def fold_in(item_factors: np.array, items: np.array, regularisation: float) -> np.array:
+    # user factors that best reproduce the user's interactions: ridge regression on the item factors
+    V = item_factors[items]
+    gram = V.T.dot(V) + regularisation * np.eye(V.shape[1])
+    return np.linalg.solve(gram, V.sum(axis=0))
+
+
+class FeedbackSimulation():
+    """
+    Multi-round feedback loop of a fair re-ranking: every round a sample of users visits, gets its
+    re-ranked list, consumes some of the recommended items, and the consumed items are added to the
+    train interactions, the item popularity and the user activity, which in turn move users and items
+    between the groups of the next rounds.
+
+    The state (interactions.InteractionState) is updated incrementally and only the visitors are
+    re-ranked, so a round costs time proportional to the visitors and their new interactions. The
+    re-ranking selects the k largest objective coefficients per user, the optimum for fixed epsilons
+    (see reranking.objective_coefficients). With refresh 'fold_in' the users with new interactions
+    of a factor model get new user factors by ridge regression on the item factors of all their
+    interactions and are rescored, an incremental retraining of the user side only.
+
+    Consumption: a recommended item at position j is consumed with probability click_probability /
+    log2(j + 2) if it is in the user's ground truth, and with probability noise / log2(j + 2) otherwise.
+
+    Parameters
+    ----------
+    setting:
+      The (fairness mode, user epsilon, item epsilon) of the re-ranking
+    S, P:
+      The users x items scores and users x topk candidates of the model, rows of refreshed users are
+      replaced in copies
+    state:
+      The interactions.InteractionState, updated in place
+    model:
+      The trained model, only used for refresh 'fold_in'
+    """
+
+    def __init__(self, formulation: str, setting: tuple, S: np.array, P: np.array, state, ground_truth,
+                 topk: int, k: int = 10, no_user_groups: int = 2, no_item_groups: int = 2, model=None,
+                 visit_share: float = 0.05, click_probability: float = 0.5, noise: float = 0.01,
+                 refresh: str = 'none', regularisation: float = 0.1, seed: int = 0):
+        self.formulation = formulation
+        self.setting = setting
+        self.state = state
+        self.topk = topk
+        self.k = k
+        self.no_user_groups = no_user_groups
+        self.no_item_groups = no_item_groups
+        self.visit_share = visit_share
+        self.click_probability = click_probability
+        self.noise = noise
+        self.regularisation = regularisation
+        self.rng = np.random.default_rng(seed)
+        self.round_number = 0
+
+        self.factors = get_model_factors(model) if refresh == 'fold_in' and model is not None else None
+        if refresh == 'fold_in' and self.factors is None:
+            print("The model does not expose its factors, simulating without refreshing the scores")
+        if self.factors is not None:
+            S, P = S.copy(), P.copy()
+            self.user_factors = self.factors[0].copy()
+        self.S, self.P = S, P
+
+        self.ground_truth_keys = interaction_keys(ground_truth, state.total_items)
+        self.ground_truth_sizes = np.zeros(state.total_users)
+        for uid, items in ground_truth.items():
+            self.ground_truth_sizes[uid] = len(items)
+        self.discounts = 1.0 / np.log2(np.arange(k) + 2)
+
+    def _group_sizes(self):
+        # the group sizes of fairness_optimisation_proportional, every item having a group
+        total_users, active = float(self.state.total_users), float(self.state.users.size)
+        return {'active': active, 'inactive': total_users - active, 'shorthead': total_users, 'longtail': total_users}
+
+    def _recommend(self, visitors: np.array):
+        S_rows = formulation_scores(self.formulation, self.S[visitors], self.topk)
+        P_rows = self.P[visitors, :self.topk].astype(np.int64)
+        Ahelp = self.state.contains(visitors, P_rows).astype(np.float64)
+        Ihelp = item_index_block(P_rows, self.state.items.membership, self.no_item_groups)
+        U = group_matrix(self.state.users.membership[visitors], self.no_user_groups)
+        fair_mode, user_eps, item_eps = self.setting
+        coefficients = objective_coefficients(
+            formulation=self.formulation, fairness_mode=fair_mode, uepsilon=user_eps, iepsilon=item_eps, S=S_rows,
+            U=U, Ahelp=Ahelp, Ihelp=Ihelp, total_users=self.state.total_users, total_items=self.state.total_items,
+            group_sizes=self._group_sizes() if self.formulation == 'proportional' else None, k=self.k)
+        selection = select_topk(coefficients, self.k)
+        return selected_items(selection, P_rows), selection, Ihelp, U
+
+    def _refresh(self, users: np.array):
+        # new user factors and candidates for the users with new interactions
+        _, item_factors, link = self.factors
+        for uid in users.tolist():
+            self.user_factors[uid] = fold_in(item_factors, self.state.items_of(uid), self.regularisation)
+        scores = self.user_factors[users].dot(item_factors.T)
+        if link is not None:
+            scores = link(scores)
+        self.S[users] = scores
+        self.P[users] = topk_indices(scores, self.P.shape[1])
+
+    def round(self) -> dict:
+        """
+        Simulate one round
+
+        Returns
+        ----------
+        trajectory:
+          The round's accuracy and fairness of the visitors' lists (nDCG, DCF, DPF, mCPF as in
+          clean_results, novelty) and the changes to the state
+        """
+        start = time.time()
+        self.round_number += 1
+        total_users = self.state.total_users
+        visitors = np.sort(self.rng.choice(total_users, size=max(1, int(round(self.visit_share * total_users))),
+                                           replace=False))
+        predicted, selection, Ihelp, U = self._recommend(visitors)
+
+        # accuracy of the lists before they are consumed
+        evaluated = self.ground_truth_sizes[visitors] > 0
+        metrics = user_metrics(visitors[evaluated], predicted[evaluated], [self.k], self.ground_truth_keys,
+                               self.ground_truth_sizes, self.state.total_items, self.state.item_counts, total_users)
+        ndcg = np.full(len(visitors), np.nan)
+        ndcg[evaluated] = metrics[self.k]['ndcg']
+        columns = user_columns(ndcg, active=U[:, 0] == 1, inactive=U[:, 1] == 1,
+                               short=(Ihelp[:, :, 0] * selection).sum(axis=1),
+                               long=(Ihelp[:, :, 1] * selection).sum(axis=1))
+        sums = columns.sum(axis=0)
+        ndcg_all, dcf, dpf, mcpf = fairness_metrics(sums)
+
+        # simulated consumption
+        relevant = contains_interactions(self.ground_truth_keys, visitors, predicted, self.state.total_items)
+        probability = np.where(relevant, self.click_probability, self.noise) * self.discounts
+        rows, positions = np.nonzero(self.rng.random(predicted.shape) < probability)
+        uids, _, switched_users, switched_items = self.state.add(visitors[rows], predicted[rows, positions])
+
+        refreshed = np.unique(uids)
+        if self.factors is not None and len(refreshed):
+            self._refresh(refreshed)
+
+        return {'Round': self.round_number, 'Visitors': len(visitors), 'Clicks': len(rows),
+                'New_Interactions': len(uids), 'Interactions': len(self.state), 'nDCG': ndcg_all,
+                'Active': sums[2] / sums[3] if sums[3] else np.nan,
+                'Inactive': sums[4] / sums[5] if sums[5] else np.nan,
+                'DCF': dcf, 'DPF': dpf, 'mCPF': mcpf,
+                'Nov.': float(metrics[self.k]['novelty'].mean()) if evaluated.any() else np.nan,
+                'Switched_Users': len(switched_users), 'Switched_Items': len(switched_items),
+                'Refreshed_Users': len(refreshed) if self.factors is not None else 0,
+                'Seconds': round(time.time() - start, 4)}
+
+    def run(self, rounds: int) -> list:
+        return [self.round() for _ in range(rounds)]
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+def array_digest(*arrays) -> str:
+    """
+    Content hash of a sequence of arrays, including their dtypes and shapes
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+class SolutionCache():
+    """
+    Content-addressed disk cache of solved re-ranking problems
+
+    Every entry holds the boolean users x topk selection of W (bit-packed) and the exposure of every
+    item group, keyed by a hash of all inputs of the optimisation. The least recently used entries
+    are evicted once the cache grows beyond max_mb.
+
+    Parameters
+    ----------
+    cache_dir:
+      Directory of the cache entries
+    max_mb:
+      Size limit of the cache directory in megabytes
+    """
+
+    def __init__(self, cache_dir: str = 'solution_cache', max_mb: float = 512):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 ** 2
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(inputs_digest: str, **settings) -> str:
+        """
+        The key of one problem: the digest of its arrays (array_digest) and its scalar settings, such
+        as the formulation, fairness mode, epsilons, topk and solver settings
+        """
+        description = inputs_digest + repr(sorted(settings.items()))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str):
+        """
+        The (selection, item_totals) of a cached problem, or None
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                shape = tuple(entry['shape'])
+                selection = np.unpackbits(entry['selection'])[:shape[0] * shape[1]].reshape(shape).astype(bool)
+                item_totals = entry['item_totals']
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        # mark as recently used for the eviction, unless another process or thread evicted it meanwhile
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return selection, item_totals
+
+    def put(self, key: str, selection: np.array, item_totals: np.array):
+        path = self._path(key)
+        # written under a temporary name first, so an interrupted write is never read as an entry
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(temporary_path, selection=np.packbits(selection), shape=np.array(selection.shape),
+                            item_totals=np.asarray(item_totals, dtype=np.float64))
+        os.replace(temporary_path, path)
+        self._evict()
+
+    def _evict(self):
+        # entries can disappear while this runs, evicted by another process or solve thread
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz') and '.tmp' not in name:
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.cache_dir, name)))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def problem_key(inputs_digest: str, config: dict, formulation: str, optimisation: str, fair_mode: str,
+                user_eps, item_eps) -> str:
+    """
+    The cache key of one optimisation of a cell: the digest of its arrays and every setting of the
+    config and the experiment that changes the solution
+
+    Parameters
+    ----------
+    optimisation:
+      The qualified name of the optimisation function, e.g. 'optimisation.fairness_optimisation'
+    """
+    return SolutionCache.key(
+        inputs_digest, formulation=formulation, optimisation=optimisation, fair_mode=fair_mode, user_eps=user_eps,
+        item_eps=item_eps, topk=config['topk'], list_length=config.get('list_length', 10),
+        no_item_groups=config['no_of_item_groups'], no_user_groups=config['no_of_user_groups'],
+        solver=config.get('solver'))
@@ -0,0 +1,252 @@
+import numpy as np
+from progress import tqdm
+
+from monitor import record
+
+from matrices import contains_interactions, interaction_keys, item_index_block, iter_score_blocks
+from metrics import SelectionEvaluator
+from reranking import formulation_scores, objective_coefficients, select_topk, selected_items
+
+
+# the fairness modes re-ranked by a soft backend and its exposure target; N and C keep the exact
+# selection, so that N stays the unconstrained baseline of the delta column of the results
+BACKEND_MODES = ('P', 'CP')
+
+def ranking_chunks(formulation: str, topk: int, chunk_size: int, total_users: int, total_items: int,
+                   model=None, S: np.array = None, P: np.array = None):
+    """
+    Factory of (start, stop, S rows, P rows) chunk iterators over the users
+
+    With a model, every chunk is scored on the fly (iter_score_blocks), so the dense score matrix
+    never exists; otherwise the given S and P are sliced. The S rows are the topk score coefficients
+    of the formulation (formulation_scores).
+    """
+    def chunks():
+        if model is not None:
+            blocks = iter_score_blocks(model=model, total_users=total_users, total_items=total_items,
+                                       topk=topk, block_size=chunk_size)
+            for start, stop, scores, top in blocks:
+                record(stage='scoring', users=stop - start)
+                if formulation == 'reproduction':
+                    yield start, stop, scores[:, :topk], top
+                else:
+                    yield start, stop, np.take_along_axis(scores, top, axis=1), top
+        else:
+            for start in range(0, total_users, chunk_size):
+                stop = min(start + chunk_size, total_users)
+                yield start, stop, formulation_scores(formulation, S[start:stop], topk), P[start:stop, :topk]
+    return chunks
+
+
+class StreamingCell():
+    """
+    Re-ranking and evaluation of one (dataset, model, user group, item group) cell, streamed over
+    chunks of users
+
+    Every chunk goes through indicator construction (its Ahelp and Ihelp rows), re-ranking for each
+    fairness setting and metric accumulation before the next chunk is produced, so peak memory is
+    bounded by the chunk size instead of the full users x items and users x topk x groups arrays.
+    The re-ranking selects the k largest objective coefficients per user, which is the optimum of
+    the optimisation problem for fixed epsilons (see reranking.objective_coefficients).
+    """
+
+    def __init__(self, chunks, formulation: str, U: np.array, item_labels: np.array, train_checkins,
+                 ground_truth, pop_items: dict, total_users: int, total_items: int, no_item_groups: int,
+                 k: int = 10, cutoffs: list = None, backend=None):
+        self.chunks = chunks
+        self.formulation = formulation
+        self.U = U
+        self.item_labels = item_labels
+        self.total_users = total_users
+        self.total_items = total_items
+        self.no_item_groups = no_item_groups
+        self.k = k
+        self.cutoffs = sorted(set(cutoffs or []) | {k})
+        # optional soft re-ranking (entropic.EntropicReranking) instead of the exact top-k selection
+        self.backend = backend
+        self.potentials = {}
+        self.ground_truth = ground_truth
+        self.pop_items = pop_items
+
+        self.train_keys = interaction_keys(train_checkins, total_items)
+        self.group_sizes = self._group_sizes() if formulation == 'proportional' else None
+
+    def _group_sizes(self):
+        # the user and item group sizes of fairness_optimisation_proportional; the item group sizes are
+        # sums over the first two candidate slots of Ihelp, which takes a pass unless every item has a group
+        sizes = {'active': self.U[:, 0].sum(), 'inactive': self.U[:, 1].sum()}
+        if (self.item_labels >= 0).all() and (self.item_labels < self.no_item_groups).all():
+            sizes['shorthead'] = sizes['longtail'] = float(self.total_users)
+        else:
+            sizes['shorthead'] = sizes['longtail'] = 0.0
+            for _, _, _, P_rows in self.chunks():
+                sizes['shorthead'] += item_index_block(P_rows[:, 0:1], self.item_labels, self.no_item_groups).sum()
+                sizes['longtail'] += item_index_block(P_rows[:, 1:2], self.item_labels, self.no_item_groups).sum()
+        return sizes
+
+    def _indicators(self, start, stop, P_rows):
+        Ahelp = contains_interactions(self.train_keys, np.arange(start, stop), P_rows, self.total_items)
+        Ihelp = item_index_block(P_rows, self.item_labels, self.no_item_groups)
+        return Ahelp.astype(np.float64), Ihelp
+
+    def _coefficients(self, setting, start, stop, S_rows, Ahelp, Ihelp):
+        fair_mode, user_eps, item_eps = setting
+        return objective_coefficients(
+            formulation=self.formulation, fairness_mode=fair_mode, uepsilon=user_eps, iepsilon=item_eps,
+            S=S_rows, U=self.U[start:stop], Ahelp=Ahelp, Ihelp=Ihelp, total_users=self.total_users,
+            total_items=self.total_items, group_sizes=self.group_sizes, k=self.k)
+
+    def coefficient_chunks(self, setting):
+        # factory of iterators over the (objective coefficients, Ihelp) of every chunk for one setting
+        def chunks():
+            for start, stop, S_rows, P_rows in self.chunks():
+                Ahelp, Ihelp = self._indicators(start, stop, P_rows)
+                yield self._coefficients(setting, start, stop, S_rows, Ahelp, Ihelp), Ihelp
+        return chunks
+
+    def uses_backend(self, setting) -> bool:
+        # whether the setting is re-ranked by the soft backend instead of the exact selection
+        return self.backend is not None and setting[0] in BACKEND_MODES
+
+    def _select(self, setting, start, stop, S_rows, Ahelp, Ihelp):
+        coefficients = self._coefficients(setting, start, stop, S_rows, Ahelp, Ihelp)
+        if self.uses_backend(setting):
+            if setting not in self.potentials:
+                self.potentials[setting] = self.backend.fit(self.coefficient_chunks(setting), self.total_users)
+            return self.backend.select(coefficients, Ihelp, self.potentials[setting])
+        return select_topk(coefficients, self.k)
+
+    def _shifted_topk(self, setting, multiplier: float):
+        # the objective and longtail exposure of the k largest coefficients plus multiplier for every
+        # longtail candidate, in one pass over the chunks
+        objective, longtail = 0.0, 0.0
+        for start, stop, S_rows, P_rows in self.chunks():
+            Ahelp, Ihelp = self._indicators(start, stop, P_rows)
+            shifted = self._coefficients(setting, start, stop, S_rows, Ahelp, Ihelp) + multiplier * Ihelp[:, :, 1]
+            selection = select_topk(shifted, self.k)
+            objective += shifted[selection].sum()
+            longtail += Ihelp[:, :, 1][selection].sum()
+        return objective, longtail
+
+    def exact_objective(self, setting, long_tail_share: float = None, iterations: int = 50) -> float:
+        """
+        The optimum of the problem for fixed epsilons: the k largest coefficients of every user, and
+        with a longtail exposure target the optimum of the same problem under the constraint that the
+        longtail group gets at least long_tail_share of all exposure
+
+        The constrained optimum is the minimum over multipliers >= 0 of the Lagrangian dual
+        sum_i topk(c_i + multiplier * longtail_i) - multiplier * target, a convex function of the
+        multiplier that equals the optimum of the linear program; it is found by bisection over its
+        subgradient, the longtail exposure of the shifted selection minus the target. None if the
+        target is not reachable within the candidates.
+        """
+        objective, longtail = self._shifted_topk(setting, 0.0)
+        if long_tail_share is None:
+            return objective
+        target = long_tail_share * self.k * self.total_users
+        if longtail >= target:
+            return objective
+
+        low, high = 0.0, 1.0
+        while self._shifted_topk(setting, high)[1] < target:
+            if high >= 2 ** 20:
+                return None
+            low, high = high, 2 * high
+        for _ in range(iterations):
+            middle = (low + high) / 2
+            if self._shifted_topk(setting, middle)[1] < target:
+                low = middle
+            else:
+                high = middle
+        return min(self._shifted_topk(setting, multiplier)[0] - multiplier * target for multiplier in (low, high))
+
+    def objective_gap(self, setting) -> dict:
+        """
+        The objective of the selection of the backend against the exact optimum under the same longtail
+        exposure target (exact_objective), the error of the soft re-ranking and its rounding
+        """
+        selected, longtail = 0.0, 0.0
+        for start, stop, S_rows, P_rows in self.chunks():
+            Ahelp, Ihelp = self._indicators(start, stop, P_rows)
+            coefficients = self._coefficients(setting, start, stop, S_rows, Ahelp, Ihelp)
+            selection = self._select(setting, start, stop, S_rows, Ahelp, Ihelp)
+            selected += coefficients[selection].sum()
+            longtail += Ihelp[:, :, 1][selection].sum()
+        long_tail_share = getattr(self.backend, 'long_tail_share', None) if self.uses_backend(setting) else None
+        exact = self.exact_objective(setting, long_tail_share)
+        return {'Objective_Exact': exact, 'Objective': selected,
+                'Gap': None if exact is None else (exact - selected) / max(abs(exact), 1e-10),
+                'Longtail_Share': longtail / (self.k * self.total_users), 'Longtail_Target': long_tail_share}
+
+    def item_totals(self, setting) -> np.array:
+        # exposure of every item group (item_group of the optimisation) for one fairness setting
+        totals = np.zeros(self.no_item_groups)
+        for start, stop, S_rows, P_rows in self.chunks():
+            Ahelp, Ihelp = self._indicators(start, stop, P_rows)
+            selection = self._select(setting, start, stop, S_rows, Ahelp, Ihelp)
+            totals += (Ihelp * selection[:, :, None]).sum(axis=(0, 1))
+        return totals
+
+    def refine_item_epsilon(self, fair_mode: str, user_eps, long_share: float, iterations: int = 20) -> float:
+        """
+        Iteratively refine the item group multiplier such that the longtail group (group 1) gets
+        long_share of all exposure, by bisection over streamed passes
+        """
+        def share(item_eps):
+            totals = self.item_totals((fair_mode, user_eps, item_eps))
+            return totals[1] / (self.k * self.total_users)
+
+        low, high = 0.0, 1.0
+        while share(high) < long_share:
+            if high >= 2 ** 20:
+                print(f"A longtail share of {long_share} is not reachable within the candidates, "
+                      f"using the largest reachable share {share(high):.4f}")
+                return high
+            low, high = high, 2 * high
+        for _ in range(iterations):
+            middle = (low + high) / 2
+            if share(middle) < long_share:
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def run(self, settings: list, active: np.array, inactive: np.array) -> list:
+        """
+        Re-rank and evaluate all fairness settings in one pass over the chunks
+
+        Parameters
+        ----------
+        settings:
+          A list of (fairness mode, user epsilon, item epsilon)
+        active, inactive:
+          Boolean masks of the users in the two user groups
+
+        Returns
+        ----------
+        results:
+          Per setting a dictionary with the (ndcg, precision, recall, novelty, coverage) tuples of
+          'all', 'active' and 'inactive' users at the list length k, as metric_on_all and
+          metric_per_group, the same per cutoff under 'cutoffs' (SelectionEvaluator.result) and the
+          'item_totals' of every item group
+        """
+        evaluator = SelectionEvaluator(ground_truth=self.ground_truth, pop_items=self.pop_items,
+                                       total_users=self.total_users, total_items=self.total_items,
+                                       cutoffs=self.cutoffs, active=active, inactive=inactive)
+        states = [evaluator.new_state() for _ in settings]
+        totals = [np.zeros(self.no_item_groups) for _ in settings]
+
+        for start, stop, S_rows, P_rows in tqdm(self.chunks()):
+            uids = np.arange(start, stop)
+            Ahelp, Ihelp = self._indicators(start, stop, P_rows)
+
+            for setting, state, total in zip(settings, states, totals):
+                selection = self._select(setting, start, stop, S_rows, Ahelp, Ihelp)
+                total += (Ihelp * selection[:, :, None]).sum(axis=(0, 1))
+                evaluator.add(state, uids, selected_items(selection, P_rows))
+
+        results = []
+        for state, total in zip(states, totals):
+            evaluation = evaluator.result(state)
+            results.append(dict(evaluation[self.k], cutoffs=evaluation, item_totals=total))
+        return results
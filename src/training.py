@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+import multiprocessing
+import os
+import pickle
+import resource
+import time
+
+from monitor import finish, record
+
+
+# environment variables read by the numeric libraries (BLAS, OpenMP, numexpr, TensorFlow) when
+# they start their thread pools
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS')
+# Cornac models that hold a TensorFlow graph and session once fitted, which cannot be pickled back from
+# a worker process; they are trained in the main process. Other models that fail to pickle are trained
+# again in the main process.
+IN_PROCESS_MODELS = ('NeuMF', 'GMF', 'MLP', 'CDL', 'CDR', 'CVAE', 'ConvMF')
+
+
+@contextmanager
+def thread_limit_environment(threads: int):
+    """
+    Set the thread limits of the numeric libraries for the processes started inside the block,
+    restoring the previous environment afterwards. Libraries that are already loaded in the current
+    process are not affected.
+    """
+    previous = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    os.environ.update({name: str(threads) for name in THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _peak_memory_mb() -> float:
+    # peak resident memory of the current process, ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def _fit(job):
+    # fit and evaluate one model as cornac.Experiment.run does
+    key, model, eval_method, metrics = job
+    record(stage='training')
+    start = time.time()
+    test_result, _ = eval_method.evaluate(model=model, metrics=metrics, user_based=True, show_validation=False)
+    seconds = time.time() - start
+    return key, model, test_result, {'Train_Seconds': round(seconds, 2), 'Peak_Memory_MB': round(_peak_memory_mb(), 1)}
+
+
+def _train_job(job):
+    # runs in a fresh worker process: the fitted model is returned pickled, None if it cannot be pickled
+    key, model, test_result, report = _fit(job)
+    try:
+        model = pickle.dumps(model)
+    except Exception as error:
+        print(f"{type(model).__name__} of {key} cannot be returned from its worker ({error}), "
+              f"it is trained again in the main process")
+        model = None
+    # the pool may terminate the worker once the result is returned, without running atexit
+    finish()
+    return key, model, test_result, report
+
+
+class TrainingScheduler():
+    """
+    Trains (dataset, model) jobs concurrently, every job in its own process
+
+    Worker processes are started fresh for every job (spawn, maxtasksperchild=1), so the thread
+    limits of the numeric libraries apply to every job and the peak memory of a worker is the peak
+    memory of its job. Jobs are returned as they finish. Fitted models are pickled back to the main
+    process; the models of IN_PROCESS_MODELS, and models that turn out not to pickle, are trained in the
+    main process once the workers are done (their peak memory is that of the main process).
+    """
+
+    def __init__(self, processes: int = None, threads_per_job: int = 1):
+        self.processes = processes or max(1, os.cpu_count() // threads_per_job)
+        self.threads_per_job = threads_per_job
+
+    def run(self, jobs: list):
+        """
+        Train all jobs
+
+        Parameters
+        ----------
+        jobs:
+          A list of (key, model, eval_method, metrics), the model being an unfitted Cornac model
+          and metrics the Cornac metrics evaluated after training
+
+        Yields
+        ----------
+        (key, model, test_result, report):
+          The key of the job, the fitted model, Cornac's test result and a dictionary with the
+          training time ('Train_Seconds', including Cornac's evaluation) and the peak memory
+          of the job ('Peak_Memory_MB')
+        """
+        in_process = [job for job in jobs if type(job[1]).__name__ in IN_PROCESS_MODELS]
+        workers = [job for job in jobs if type(job[1]).__name__ not in IN_PROCESS_MODELS]
+        if workers:
+            # the unfitted models, to train the ones that do not pickle again
+            unfitted = {job[0]: job for job in workers}
+            context = multiprocessing.get_context('spawn')
+            with thread_limit_environment(self.threads_per_job):
+                pool = context.Pool(processes=min(self.processes, len(workers)), maxtasksperchild=1)
+                try:
+                    for key, model, test_result, report in pool.imap_unordered(_train_job, workers):
+                        if model is None:
+                            in_process.append(unfitted[key])
+                            continue
+                        yield key, pickle.loads(model), test_result, report
+                finally:
+                    pool.terminate()
+                    pool.join()
+        for job in in_process:
+            yield _fit(job)
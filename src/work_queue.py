@@ -0,0 +1,251 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+
+
+# states of a task: pending (claimable), leased (claimed by a worker until lease_until), done, failed
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    UNIQUE (kind, payload)
+);
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class Task():
+
+    def __init__(self, task_id: int, kind: str, payload: dict, attempts: int):
+        self.id = task_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+
+
+class WorkQueue():
+    """
+    Work queue in an SQLite database on a shared directory, without a broker: any number of worker
+    processes, on any host that mounts the directory, claim tasks with a lease that they renew while
+    they work (heartbeat). A task whose lease expired, because its worker crashed or hung, is claimed
+    again by the next worker, up to max_attempts times.
+
+    Every change is a short IMMEDIATE transaction, so concurrent workers serialise on the database
+    lock. Tasks are unique by (kind, payload): enqueueing a task twice, or completing a task that was
+    re-claimed after its lease expired, leaves a single task. The shared directory needs working file
+    locks (e.g. a local disk or NFS with locking), which SQLite relies on.
+
+    Parameters
+    ----------
+    path:
+      The database file, created if it does not exist
+    lease_seconds:
+      The time a claimed task stays leased without a heartbeat
+    max_attempts:
+      The number of claims after which a task that keeps failing or expiring is marked failed
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # a connection per operation, short transactions that never hold the lock between calls
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return _Transaction(connection)
+
+    def set_metadata(self, **values):
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                                   [(name, json.dumps(value)) for name, value in values.items()])
+
+    def metadata(self) -> dict:
+        with self._connect() as connection:
+            return {name: json.loads(value) for name, value in connection.execute("SELECT * FROM metadata")}
+
+    def enqueue(self, tasks: list, connection=None) -> int:
+        """
+        Add (kind, payload) tasks, the payloads being JSON serialisable; existing tasks are kept
+
+        Returns
+        ----------
+        The number of tasks that were new
+        """
+        rows = [(kind, json.dumps(payload, sort_keys=True)) for kind, payload in tasks]
+        if connection is None:
+            with self._connect() as connection:
+                return self.enqueue(tasks, connection)
+        before = connection.total_changes
+        connection.executemany("INSERT OR IGNORE INTO tasks (kind, payload) VALUES (?, ?)", rows)
+        return connection.total_changes - before
+
+    def claim(self, worker: str, kinds: list = None):
+        """
+        Lease the oldest pending (or expired) task to a worker
+
+        Returns
+        ----------
+        The claimed Task, or None if no task can be claimed now
+        """
+        now = time.time()
+        kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})" if kinds else ""
+        with self._connect() as connection:
+            # expired leases of tasks without attempts left fail, the others become claimable again
+            connection.execute("UPDATE tasks SET state = 'failed', error = 'lease expired' "
+                               "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                               (now, self.max_attempts))
+            row = connection.execute(
+                f"SELECT id, kind, payload, attempts FROM tasks WHERE (state = 'pending' OR "
+                f"(state = 'leased' AND lease_until < ?)) {kind_filter} ORDER BY id LIMIT 1",
+                [now] + list(kinds or [])).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, "
+                               "attempts = attempts + 1 WHERE id = ?", (worker, now + self.lease_seconds, row[0]))
+        return Task(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def renew(self, task: Task, worker: str) -> bool:
+        # extend the lease of a task the worker still holds
+        with self._connect() as connection:
+            connection.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                               (time.time() + self.lease_seconds, task.id, worker))
+            return connection.total_changes > 0
+
+    def complete(self, task: Task, result=None, followups: list = ()):
+        # mark a task done and enqueue the tasks that depend on it, in one transaction
+        with self._connect() as connection:
+            connection.execute("UPDATE tasks SET state = 'done', lease_until = NULL, result = ? "
+                               "WHERE id = ? AND state != 'done'", (json.dumps(result), task.id))
+            self.enqueue(followups, connection)
+
+    def fail(self, task: Task, error: str):
+        # release a task after an error, to be retried while it has attempts left
+        with self._connect() as connection:
+            connection.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                               "lease_until = NULL, error = ? WHERE id = ? AND state = 'leased'",
+                               (self.max_attempts, error, task.id))
+
+    def counts(self) -> dict:
+        # the number of tasks in every state
+        with self._connect() as connection:
+            return dict(connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def finished(self) -> bool:
+        # no task is pending or leased, expired leases included
+        counts = self.counts()
+        return not counts.get('pending') and not counts.get('leased')
+
+    def tasks(self, kind: str = None, state: str = None) -> list:
+        # (kind, payload, state, attempts, error, result) of the tasks, in order of creation
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT kind, payload, state, attempts, error, result FROM tasks "
+                "WHERE (? IS NULL OR kind = ?) AND (? IS NULL OR state = ?) ORDER BY id",
+                (kind, kind, state, state)).fetchall()
+        return [(kind, json.loads(payload), state, attempts, error, None if result is None else json.loads(result))
+                for kind, payload, state, attempts, error, result in rows]
+
+
+def result_rows(queue: WorkQueue, kind: str) -> list:
+    # the report rows of the tasks of a kind that returned a result: the payload with the result, in order
+    return [dict(payload, **result) for _, payload, _, _, _, result in queue.tasks(kind=kind) if result]
+
+
+class _Transaction():
+    # an IMMEDIATE transaction on a connection, committed (or rolled back) and closed on exit
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exception_type, exception, traceback):
+        try:
+            self.connection.execute("COMMIT" if exception_type is None else "ROLLBACK")
+        finally:
+            self.connection.close()
+
+
+def _beat(path: str, lease_seconds: float, task: Task, worker: str, parent: int, stopped):
+    # runs in the heartbeat process until the task is done or the worker process is gone
+    queue = WorkQueue(path, lease_seconds=lease_seconds)
+    while not stopped.wait(lease_seconds / 3) and os.getppid() == parent:
+        if not queue.renew(task, worker):
+            print(f"Lost the lease of task {task.id}, another worker may run it too")
+
+
+class Heartbeat():
+    """
+    Renews the lease of a task every third of the lease time while the block runs
+
+    The renewals come from a separate process, so that work holding the GIL for a long time (e.g. model
+    training in compiled code) does not let the lease expire; the process stops with the block or as
+    soon as the worker process is gone.
+    """
+
+    def __init__(self, queue: WorkQueue, task: Task, worker: str):
+        context = multiprocessing.get_context('spawn')
+        self.stopped = context.Event()
+        self.process = context.Process(target=_beat, args=(queue.path, queue.lease_seconds, task, worker,
+                                                           os.getpid(), self.stopped), daemon=True)
+
+    def __enter__(self):
+        self.process.start()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.stopped.set()
+        self.process.join()
+
+
+def run_worker(queue: WorkQueue, worker: str, handlers: dict, poll_seconds: float = 5, max_tasks: int = None) -> int:
+    """
+    Claim and run tasks until the queue is finished (or max_tasks ran)
+
+    Parameters
+    ----------
+    handlers:
+      Per task kind a function of the payload returning (result, followups): a JSON serialisable result
+      stored with the task and the (kind, payload) tasks that can run once this one is done
+
+    Returns
+    ----------
+    The number of tasks this worker completed
+    """
+    completed = 0
+    while max_tasks is None or completed < max_tasks:
+        task = queue.claim(worker, kinds=list(handlers))
+        if task is None:
+            if queue.finished():
+                break
+            # other workers hold the remaining tasks, which may expire or enqueue new ones
+            time.sleep(poll_seconds)
+            continue
+        print(f"{worker}: {task.kind} {task.payload} (attempt {task.attempts})")
+        try:
+            with Heartbeat(queue, task, worker):
+                result, followups = handlers[task.kind](task.payload)
+        except Exception as error:
+            print(f"{worker}: {task.kind} {task.payload} failed: {error!r}")
+            queue.fail(task, repr(error))
+            continue
+        queue.complete(task, result, followups)
+        completed += 1
+    return completed
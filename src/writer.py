@@ -0,0 +1,98 @@
+import atexit
+import multiprocessing
+import os
+import queue
+
+from boxplot import create_boxplots
+from monitor import finish, record
+
+
+def write_csv(frame, path: str, append: bool = False):
+    # a result table, or rows appended to a trace whose header is written by the first rows
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if append and os.path.exists(path):
+        frame.to_csv(path, mode='a', header=False, index=False)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def _drain(tasks, errors):
+    # the writer process: run the writes in order until the end of the queue
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    record(stage='writing')
+    while True:
+        task = tasks.get()
+        if task is None:
+            finish()
+            return
+        function, args = task
+        try:
+            function(*args)
+        except Exception as error:
+            errors.put(f"{function.__name__}: {error!r}")
+
+
+class ResultWriter():
+    """
+    Writes result tables, traces and figures in a background process while the computation continues
+
+    The writes wait in a bounded queue: submit only blocks while max_pending writes are waiting
+    (backpressure), so the compute stages never wait for the disk or matplotlib otherwise. The writes
+    run in order in one spawned process, which keeps matplotlib and its global state out of the
+    computing process. close (also called on exit) waits until every write is done and raises the
+    errors of failed writes.
+
+    Parameters
+    ----------
+    max_pending:
+      The number of writes that can wait before submit blocks
+    background:
+      With False every write runs immediately in the calling process, e.g. for debugging
+    """
+
+    def __init__(self, max_pending: int = 16, background: bool = True):
+        self.process = None
+        self.closed = False
+        if background:
+            context = multiprocessing.get_context('spawn')
+            self.tasks = context.Queue(maxsize=max_pending)
+            self.errors = context.Queue()
+            self.process = context.Process(target=_drain, args=(self.tasks, self.errors), daemon=True)
+            self.process.start()
+            atexit.register(self.close)
+
+    def submit(self, function, *args):
+        # run function(*args) in the writer, function and arguments have to be picklable
+        if self.process is None:
+            function(*args)
+        else:
+            self.tasks.put((function, args))
+
+    def write_csv(self, frame, path: str, append: bool = False):
+        self.submit(write_csv, frame, path, append)
+
+    def boxplots(self, path: str, dataset: str, frame):
+        self.submit(create_boxplots, path, dataset, frame)
+
+    def close(self):
+        # flush: wait for every submitted write
+        if self.process is None or self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.tasks.put(None)
+        self.process.join()
+        errors = []
+        while True:
+            try:
+                errors.append(self.errors.get(timeout=0.1))
+            except queue.Empty:
+                break
+        if errors:
+            raise RuntimeError(f"Writing the results failed: {'; '.join(errors)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
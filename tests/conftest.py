@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules of src are imported flat, as from the src folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture
+def toy_dataset(tmp_path, monkeypatch):
+    """
+    A small dataset 'Toy' in datasets/ of a temporary working directory, with item popularity decreasing
+    with the item id so that the item groups differ
+    """
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    users, items = 60, 80
+    popularity = np.arange(items, 0, -1) / np.arange(items, 0, -1).sum()
+    os.makedirs(os.path.join('datasets', 'Toy'))
+    for split, per_user in (('train', 8), ('tune', 1), ('test', 2)):
+        rows = [(user, item, 1) for user in range(users)
+                for item in rng.choice(items, per_user, replace=False, p=popularity)]
+        pd.DataFrame(rows).to_csv(os.path.join('datasets', 'Toy', f"Toy_{split}.txt"), sep='\t', header=False,
+                                  index=False)
+    return 'Toy'
@@ -0,0 +1,30 @@
+import numpy as np
+
+from bootstrap import Bootstrap, user_columns
+
+
+def _setting(ndcg, active, short):
+    return user_columns(ndcg, active=active, inactive=~active, short=short, long=10 - short)
+
+
+def test_one_sided_differences_never_give_a_zero_p_value():
+    rng = np.random.RandomState(0)
+    users, replicates = 300, 199
+    active = np.arange(users) < 50
+    baseline = _setting(rng.rand(users), active, rng.randint(6, 10, users))
+    # every user is better off and gets more longtail items, so every replicate lies on one side of 0
+    better = _setting(baseline[:, 0] + 0.5, active, baseline[:, 6] - 3)
+    rows = Bootstrap(replicates=replicates, seed=1).compare([baseline, better], baseline=0)
+    compared = [row for row in rows if 'P_Value' in row]
+    ndcg = [row for row in compared if row['Metric'] == 'nDCG'][0]
+    assert ndcg['Diff_CI_Low'] > 0
+    assert np.isclose(ndcg['P_Value'], 2 / (replicates + 1))
+    assert all(0 < row['P_Value'] <= 1 for row in compared)
+
+
+def test_identical_settings_give_a_p_value_of_one():
+    rng = np.random.RandomState(0)
+    active = np.arange(100) < 20
+    setting = _setting(rng.rand(100), active, rng.randint(0, 10, 100))
+    rows = Bootstrap(replicates=99, seed=1).compare([setting, setting.copy()], baseline=0)
+    assert all(row['P_Value'] == 1.0 for row in rows if 'P_Value' in row)
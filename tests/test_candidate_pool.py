@@ -0,0 +1,24 @@
+import numpy as np
+
+from candidate_pool import CandidatePoolGeneration
+from reranking import select_topk
+
+
+def test_pools_reach_the_topk_optimum():
+    rng = np.random.RandomState(0)
+    # ranking order with a few strong candidates deep in the list
+    coefficients = np.sort(rng.rand(100, 50), axis=1)[:, ::-1] + (rng.rand(100, 50) < 0.05)
+    selection, info = CandidatePoolGeneration(k=10, initial=12, columns=5).solve(coefficients)
+    assert info['status'] == 'OPTIMAL' and info['converged']
+    assert np.isclose(info['objective'], coefficients[select_topk(coefficients, 10)].sum())
+    assert np.isclose(info['bound'], info['objective']) and info['gap'] < 1e-9
+    assert (info['pool'] < 50).all()
+
+
+def test_round_limit_is_not_optimal():
+    rng = np.random.RandomState(1)
+    coefficients = rng.rand(50, 50)
+    selection, info = CandidatePoolGeneration(k=10, initial=10, columns=1, max_rounds=2).solve(coefficients)
+    assert info['status'] == 'ROUND_LIMIT' and not info['converged']
+    assert selection.sum(axis=1).tolist() == [10] * 50
+    assert info['bound'] > info['objective'] and info['gap'] > 0
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from bootstrap import fairness_metrics
+from clean_results import clean_results
+from retrieval import cpfair_metrics
+
+
+def test_fairness_metrics_agree_across_clean_results_retrieval_and_bootstrap():
+    # one setting of 4 users (2 active) with 10 items each, 28 of them short-head
+    ndcg = np.array([0.4, 0.2, 0.1, 0.05])
+    active = np.array([True, True, False, False])
+    short, long = np.array([9, 7, 6, 6]), np.array([1, 3, 4, 4])
+    raw = pd.DataFrame([{'Dataset': 'Toy', 'Model': 'PMF', 'Type': 'N', 'ndcg_ALL': ndcg.mean(),
+                         'ndcg_ACT': ndcg[active].mean(), 'ndcg_INACT': ndcg[~active].mean(), 'Nov_ALL': 1.0,
+                         'Cov_ALL': 10.0, 'Short_Items': short.sum(), 'Long_Items': long.sum(),
+                         'All_Items': '40==40.0'}])
+    cleaned = clean_results(raw).iloc[0]
+
+    evaluation = {'all': [ndcg.mean()], 'active': [ndcg[active].mean()], 'inactive': [ndcg[~active].mean()]}
+    retrieved = cpfair_metrics(evaluation, (short.sum(), long.sum()), total_users=4, list_length=10)
+
+    sums = np.array([ndcg.sum(), 4, ndcg[active].sum(), 2, ndcg[~active].sum(), 2, short.sum(), long.sum()])
+    bootstrapped = dict(zip(('All', 'DCF', 'DPF', 'mCPF'), fairness_metrics(sums)))
+
+    assert np.isclose(cleaned['DPF'], 0.4) and np.isclose(cleaned['mCPF'], 0.5 * 0.4 + 0.5 * cleaned['DCF'])
+    for name in ('All', 'DCF', 'DPF', 'mCPF'):
+        assert np.isclose(retrieved[name], cleaned[name], atol=1e-4)
+        assert np.isclose(bootstrapped[name], cleaned[name], atol=1e-4)
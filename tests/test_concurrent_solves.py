@@ -0,0 +1,41 @@
+import os
+
+import cornac
+import pandas as pd
+
+from experiment_dcg_change import ExperimentDCG
+
+
+CONFIG = {'ds_names': ['Toy'], 'ds_user_groups': ['005'], 'ds_item_groups': ['020'], 'group_source': 'derived',
+          'no_of_user_groups': 2, 'no_of_item_groups': 2, 'topk': 20, 'list_length': 5,
+          'fairness_categories': ['N', 'C', 'P', 'CP'], 'user_epsilon': [0.5], 'item_epsilon': [0.5]}
+
+
+def _rank(config: dict, dataset: str):
+    # the result frames and solve reports of one model on every cell of the dataset
+    model = cornac.models.PMF(k=5, max_iter=20, seed=1, name='PMF')
+    experiment = ExperimentDCG.from_config(config, [model], [])
+    experiment._start_reports()
+    data = experiment._load_dataset_groups(dataset)
+    model.fit(data['eval_method'].train_set)
+    return experiment, experiment._rank_model(dataset, data, model)
+
+
+def test_concurrent_solves_equal_sequential_solves(toy_dataset, monkeypatch):
+    # four cores, also where the tests run on fewer
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    concurrent = dict(CONFIG, concurrent_solves={'workers': 4, 'solver_threads': 1})
+    experiment, frames = _rank(concurrent, toy_dataset)
+    assert experiment._concurrent_solves(4) == (4, 1)
+    sequential_experiment, sequential_frames = _rank(dict(CONFIG), toy_dataset)
+    assert sequential_experiment._concurrent_solves(4) == (1, None)
+
+    assert frames.keys() == sequential_frames.keys()
+    for key in frames:
+        for frame, sequential_frame in zip(frames[key], sequential_frames[key]):
+            pd.testing.assert_frame_equal(frame, sequential_frame)
+    # the solve reports are in the order of the settings, whichever thread finished first
+    columns = ['Type', 'User_EPS', 'Item_EPS', 'Status', 'Objective']
+    assert [[report[column] for column in columns] for report in experiment.solve_reports] == \
+        [[report[column] for column in columns] for report in sequential_experiment.solve_reports]
+    assert [report['Type'] for report in experiment.solve_reports] == ['N', 'C', 'P', 'CP']
@@ -0,0 +1,42 @@
+import cornac
+import numpy as np
+import pandas as pd
+
+from cpfair import _write_cells
+from equivalence import COMPARED_COLUMNS, EquivalenceHarness, compare_columns, summary
+from experiment_dcg_change import ExperimentDCG
+from optimisation import fairness_optimisation_dcg_change
+
+
+CONFIG = {'ds_names': ['Toy'], 'ds_user_groups': ['005'], 'ds_item_groups': ['020'], 'group_source': 'derived',
+          'no_of_user_groups': 2, 'no_of_item_groups': 2, 'topk': 20, 'list_length': 5,
+          'fairness_categories': ['N', 'C', 'P', 'CP'], 'user_epsilon': [0.5], 'item_epsilon': [0.5],
+          'streaming': {'chunk_size': 16}}
+
+
+def test_compare_columns():
+    reference = pd.DataFrame({column: [0.5, 0.2] for column in COMPARED_COLUMNS})
+    frame = reference.copy()
+    frame.loc[0, 'mCPF'] = 0.8
+    frame.loc[1, 'DCF'] = np.nan
+    # relative to 1 + the reference, a value missing on one side only is never equal
+    (first, first_column), (second, second_column) = compare_columns(frame, reference)
+    assert (round(first, 6), first_column) == (0.2, 'mCPF')
+    assert (second, second_column) == (np.inf, 'DCF')
+    assert compare_columns(reference, reference) == [(0.0, '-'), (0.0, '-')]
+
+
+def test_backends_match_the_reference_on_frozen_cells(toy_dataset):
+    model = cornac.models.PMF(k=5, max_iter=20, seed=1, name='PMF')
+    experiment = ExperimentDCG.from_config(dict(CONFIG), [model], [])
+    experiment._start_reports()
+    data = experiment._load_dataset_groups(toy_dataset)
+    model.fit(data['eval_method'].train_set)
+    _write_cells(experiment, 'cells', toy_dataset, data, 0, model)
+
+    harness = EquivalenceHarness(experiment, 'dcg_change', fairness_optimisation_dcg_change,
+                                 backends=['closed_form', 'candidate_pool', 'streaming'])
+    comparison = harness.run('cells')
+    assert len(comparison) == 4 * 4 and comparison['Passed'].all()
+    backends = summary(comparison).set_index('Backend')
+    assert backends['Settings'].tolist() == [4] * 4 and (backends['Passed'] == 4).all()
@@ -0,0 +1,54 @@
+from cornac.data import Reader
+from cornac.eval_methods import BaseMethod
+
+from dataset_utils import read_train_data
+from interactions import InteractionState
+
+
+TRAIN = [('u1', 'i1'), ('u1', 'i1'), ('u1', 'i2'), ('u2', 'i1'), ('u3', 'i3'), ('u3', 'i2')]
+APPENDED = [('u2', 'i1'), ('u2', 'i1'), ('u2', 'i3'), ('u4', 'i2')]
+
+
+def _write(path: str, lines: list):
+    with open(path, 'w') as lines_file:
+        lines_file.writelines(f"{user}\t{item}\t1\n" for user, item in lines)
+
+
+def _state(tmp_path):
+    # the state of a train file with a repeated line, next to read_train_data of the same file
+    train_path = str(tmp_path / 'train.txt')
+    _write(train_path, TRAIN)
+    _write(str(tmp_path / 'test.txt'), [('u1', 'i3'), ('u2', 'i2')])
+    reader = Reader()
+    eval_method = BaseMethod.from_splits(train_data=reader.read(train_path, fmt='UIR', sep='\t'),
+                                         test_data=reader.read(str(tmp_path / 'test.txt'), fmt='UIR', sep='\t'),
+                                         rating_threshold=1.0, exclude_unknowns=True, verbose=False)
+    train_checkins, pop_items = read_train_data(train_path, eval_method=eval_method)
+    state = InteractionState(train_checkins, eval_method.total_users, eval_method.total_items, 0.34, 0.34,
+                             uid_map=eval_method.train_set.uid_map, iid_map=eval_method.train_set.iid_map,
+                             pop_items=pop_items)
+    return state, train_checkins, pop_items
+
+
+def test_counts_match_read_train_data(tmp_path):
+    state, train_checkins, pop_items = _state(tmp_path)
+    assert state.pop_items() == pop_items and pop_items[state.iid_map['i1']] == 3
+    assert state.train_checkins() == train_checkins
+
+    # the state after appended lines counts as read_train_data of the train file with those lines
+    log = str(tmp_path / 'log.txt')
+    _write(log, APPENDED)
+    uids, _, _, _ = state.ingest_file(log)
+    assert len(uids) == 2
+    counts = {}
+    for _, item in TRAIN + APPENDED:
+        counts[state.iid_map[item]] = counts.get(state.iid_map[item], 0) + 1
+    assert state.pop_items() == counts
+    # the user groups count distinct items: u1, u3 and u2 with two items each, one of them active
+    assert state.user_counts.tolist()[:3] == [2, 2, 2] and state.users.size == 1
+
+    path = str(tmp_path / 'store.npz')
+    state.save(path)
+    loaded = InteractionState.load(path)
+    assert loaded.pop_items() == state.pop_items()
+    assert (loaded.items.membership == state.items.membership).all()
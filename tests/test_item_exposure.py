@@ -0,0 +1,24 @@
+import numpy as np
+
+from item_exposure import ItemExposureDualAscent, exposure_feasible
+
+
+def test_exposure_feasible():
+    # two users choosing one of their candidates: items 0 and 1 can both be recommended once,
+    # but item 2 is a candidate of nobody and cannot reach a floor of one recommendation
+    incidence = np.array([[0, 1], [0, 1]])
+    assert exposure_feasible(incidence, np.array([1.0, 1.0, 0.0]), np.array([1.0, 1.0, 1.0]), k=1)
+    assert not exposure_feasible(incidence, np.array([1.0, 1.0, 1.0]), np.array([2.0, 2.0, 2.0]), k=1)
+    # item 0 cannot be recommended and item 1 only once, so the two users cannot both get a recommendation
+    assert not exposure_feasible(incidence, np.zeros(2), np.array([0.0, 1.0]), k=1)
+
+
+def test_infeasible_bounds_are_reported():
+    coefficients = np.array([[2.0, 1.0], [3.0, 1.0]])
+    incidence = np.array([[0, 1], [0, 1]])
+    selection, info = ItemExposureDualAscent(k=1).solve(coefficients, incidence, np.array([1.0, 1.0, 1.0]),
+                                                        np.array([2.0, 2.0, 2.0]))
+    assert info['status'] == 'INFEASIBLE' and info['iterations'] == 0
+    selection, info = ItemExposureDualAscent(k=1).solve(coefficients, incidence, np.zeros(2), np.ones(2))
+    assert info['status'] == 'CONVERGED' and info['violation'] == 0
+    assert selection.sum(axis=0).tolist() == [1, 1]
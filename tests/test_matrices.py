@@ -0,0 +1,44 @@
+import cornac
+from cornac.data import Dataset
+import numpy as np
+
+from matrices import load_ground_truth_index, load_ranking_matrices, read_item_index
+
+
+def _trained_pmf(users=30, items=40, seed=0):
+    rng = np.random.default_rng(seed)
+    triples = [(str(user), str(item), 1.0) for user in range(users)
+               for item in rng.choice(items, 6, replace=False)]
+    model = cornac.models.PMF(k=4, max_iter=10, seed=seed, verbose=False)
+    model.fit(Dataset.from_uir(triples, seed=seed))
+    return model
+
+
+def test_blocked_ranking_matches_scoring_every_user():
+    model = _trained_pmf()
+    total_users, total_items = model.train_set.num_users, model.train_set.num_items
+    S, P = load_ranking_matrices(model, total_users, total_items, topk=10, block_size=7)
+    for uid in range(total_users):
+        # as the ranking loop before the blocked products
+        scores = model.score(uid)
+        assert np.allclose(S[uid], scores)
+        assert P[uid].tolist() == list(reversed(scores.argsort()))[:10]
+
+
+def test_indicators_match_the_loops():
+    rng = np.random.default_rng(1)
+    total_users, total_items, topk = 20, 50, 8
+    P = np.array([rng.choice(total_items, topk, replace=False) for _ in range(total_users)], dtype=np.float64)
+    train_checkins = {uid: set(rng.choice(total_items, 10, replace=False).tolist()) for uid in range(total_users)}
+    shorthead, longtail = set(range(10)), set(range(10, 45))
+
+    Ahelp, Ihelp = np.zeros((total_users, topk)), np.zeros((total_users, topk, 2))
+    for uid in range(total_users):
+        for j in range(topk):
+            Ahelp[uid][j] = P[uid][j] in train_checkins[uid]
+            if P[uid][j] in shorthead:
+                Ihelp[uid][j][0] = 1
+            elif P[uid][j] in longtail:
+                Ihelp[uid][j][1] = 1
+    assert (load_ground_truth_index(total_users, topk, P, train_checkins) == Ahelp).all()
+    assert (read_item_index(total_users, topk, 2, P, shorthead, longtail) == Ihelp).all()
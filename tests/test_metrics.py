@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from metrics import SelectionEvaluator, metric_on_all, metric_per_group, ndcgk, precisionk, recallk
+
+
+def _ranked_lists(total_users=40, total_items=60, topk=20, k=10, seed=0):
+    # P, a selection of k of the topk candidates of every user (kept in rank order) and their items
+    rng = np.random.default_rng(seed)
+    P = np.array([rng.choice(total_items, topk, replace=False) for _ in range(total_users)])
+    selection = np.zeros((total_users, topk), dtype=bool)
+    for uid in range(total_users):
+        selection[uid, np.sort(rng.choice(topk, k, replace=False))] = True
+    return P, selection, P[selection].reshape(total_users, k)
+
+
+def test_selection_evaluator_matches_the_per_user_metrics():
+    total_users, total_items = 40, 60
+    rng = np.random.default_rng(1)
+    P, selection, predicted = _ranked_lists(total_users, total_items)
+    # a few users without test items are skipped, as by the loops
+    ground_truth = {uid: set(rng.choice(total_items, 5, replace=False).tolist()) for uid in range(total_users)
+                    if uid % 7}
+    pop_items = {item: int(rng.integers(1, 30)) for item in range(total_items - 5)}
+    active = np.arange(total_users) < 10
+    eval_method = SimpleNamespace(total_users=total_users)
+    W = [[SimpleNamespace(x=float(chosen)) for chosen in row] for row in selection]
+
+    evaluator = SelectionEvaluator(ground_truth=ground_truth, pop_items=pop_items, total_users=total_users,
+                                   total_items=total_items, cutoffs=[5, 10], active=active, inactive=~active)
+    results = evaluator.evaluate(predicted, block_size=16)
+    assert results[10]['all'] == pytest.approx(metric_on_all(W, ground_truth, pop_items, P, eval_method, k=10))
+    assert results[10]['active'] == pytest.approx(
+        metric_per_group(np.flatnonzero(active).tolist(), W, ground_truth, pop_items, P, eval_method, k=10))
+    assert results[10]['inactive'] == pytest.approx(
+        metric_per_group(np.flatnonzero(~active).tolist(), W, ground_truth, pop_items, P, eval_method, k=10))
+
+    # a shorter cutoff reads the first items of the same lists
+    users = [uid for uid in range(total_users) if uid in ground_truth]
+    for position, metric in enumerate((ndcgk, precisionk, recallk)):
+        expected = np.mean([metric(actual=ground_truth[uid], predicted=predicted[uid, :5].tolist())
+                            for uid in users])
+        assert results[5]['all'][position] == pytest.approx(round(expected, 5))
@@ -0,0 +1,53 @@
+import json
+import multiprocessing
+import os
+import time
+
+import monitor
+from monitor import METRICS_FILE, PROCESS_DIR, STATUS_FILE, RunMonitor, finish, record
+
+
+def _worker():
+    # a process started by the monitored run, which inherits its environment
+    record(stage='solving', cells=2, status='OPTIMAL', seconds=1.5)
+    record(status='FEASIBLE', seconds=0.5)
+    finish()
+
+
+def test_status_merges_the_processes_of_a_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(monitor, '_recorder', None)
+    run_dir = str(tmp_path / 'run')
+    with RunMonitor(run_dir, total_cells=8, interval=60) as run_monitor:
+        record(stage='scoring', users=100)
+        record(cells=1, status='OPTIMAL', seconds=1.0)
+        process = multiprocessing.get_context('spawn').Process(target=_worker)
+        process.start()
+        process.join()
+        # a process that stopped reporting without finishing
+        with open(os.path.join(run_dir, PROCESS_DIR, 'lost-1.json'), 'w') as lost:
+            json.dump(dict(process='lost-1', pid=1, stage='training', started=time.time() - 1000,
+                           updated=time.time() - 1000, finished=False, rss_mb=10.0, statuses={}, cells=0,
+                           users_scored=0, solves=0, solve_seconds=0.0), lost)
+        running = run_monitor.publish()
+        assert running['stages'] == {monitor._recorder.name: 'scoring'}
+    assert os.environ.get(monitor.MONITOR_VARIABLE) is None
+
+    with open(os.path.join(run_dir, STATUS_FILE)) as status_file:
+        status = json.load(status_file)
+    assert status['state'] == 'finished' and status['stale_processes'] == ['lost-1']
+    assert (status['completed'], status['remaining'], status['users_scored']) == (3, 5, 100)
+    assert status['solver_statuses'] == {'OPTIMAL': 2, 'FEASIBLE': 1} and status['solve_seconds'] == 3.0
+    assert status['eta_seconds'] is not None and status['processes'] == 0
+
+    with open(os.path.join(run_dir, METRICS_FILE)) as metrics_file:
+        metrics = metrics_file.read().splitlines()
+    run = os.path.basename(run_dir)
+    assert f'cpfair_up{{run="{run}"}} 0' in metrics
+    assert f'cpfair_solver_status_total{{run="{run}",status="OPTIMAL"}} 2' in metrics
+    assert f'cpfair_stale_processes{{run="{run}"}} 1' in metrics
+
+
+def test_the_monitor_counts_queue_tasks(tmp_path):
+    counts = {'done': 3, 'failed': 1, 'pending': 4, 'leased': 2}
+    status = RunMonitor(str(tmp_path), tasks=lambda: counts).status()
+    assert (status['completed'], status['remaining'], status['tasks']) == (4, 6, counts)
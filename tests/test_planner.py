@@ -0,0 +1,45 @@
+import os
+
+import cornac
+import pandas as pd
+
+from experiment_dcg_change import ExperimentDCG
+from extension_proportional import ExtensionProportional
+from planner import ExperimentPlanner
+
+
+CONFIG = {'ds_names': ['Toy'], 'ds_user_groups': ['005'], 'ds_item_groups': ['020'], 'group_source': 'derived',
+          'no_of_user_groups': 2, 'no_of_item_groups': 2, 'topk': 20, 'list_length': 5, 'boxplot': False,
+          'fairness_categories': ['N', 'C'], 'user_epsilon': [0.5], 'item_epsilon': [0.5],
+          'retrieval': {'n_clusters': 4, 'n_probe': 4, 'report': True}}
+
+
+def _experiments(config: dict) -> list:
+    models = [cornac.models.PMF(k=5, max_iter=20, seed=1, name='PMF')]
+    return [('dcg_change', ExperimentDCG.from_config(dict(config), models, [])),
+            ('proportional', ExtensionProportional.from_config(dict(config), models, []))]
+
+
+def test_interaction_logs_are_part_of_the_load_key():
+    logged = dict(CONFIG, interaction_logs={'Toy': 'logs/toy.tsv'})
+    planner = ExperimentPlanner([('plain', _experiments(CONFIG)[0][1]), ('logged', _experiments(logged)[0][1])])
+    planner.build()
+    summary = planner.summary().set_index('Stage')
+    # the logged interactions change the indicators, but not the train split the model is trained on
+    assert summary.loc['load'].tolist() == [2, 2] and summary.loc['train'].tolist() == [2, 1]
+    assert summary.loc['indicators'].tolist() == [2, 2]
+
+
+def test_merged_nodes_report_to_every_consumer(toy_dataset):
+    planner = ExperimentPlanner(_experiments(CONFIG)).build()
+    summary = planner.summary().set_index('Stage')
+    # the formulations share the ranking and the programs without fairness terms
+    assert summary.loc['rank'].tolist() == [2, 1] and summary.loc['solve'].tolist() == [4, 3]
+
+    planner.execute()
+    for name in ('dcg_change', 'proportional'):
+        path = os.path.join(planner.results_path, name)
+        solves = pd.read_csv(os.path.join(path, 'solves.csv'))
+        assert solves['Type'].tolist() == ['N', 'C']
+        assert len(pd.read_csv(os.path.join(path, 'retrieval_recall.csv'))) > 0
+        assert len(pd.read_csv(os.path.join(path, 'results_Toy.csv'))) == 2
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+
+from preflight import BASE_MB, apply_plan, calibration, plan
+
+
+CONFIG = {'ds_names': ['Toy'], 'topk': 50, 'list_length': 10, 'no_of_user_groups': 2, 'no_of_item_groups': 2,
+          'fairness_categories': ['N', 'C'], 'user_epsilon': [0.5]}
+
+
+def _write_dataset(datasets_dir, users=1000, items=2000):
+    os.makedirs(os.path.join(datasets_dir, 'Toy'))
+    train = pd.DataFrame({'user': [u for u in range(users) for _ in range(2)],
+                          'item': [(2 * u + i) % items for u in range(users) for i in range(2)], 'rating': 1})
+    train.to_csv(os.path.join(datasets_dir, 'Toy', 'Toy_train.txt'), sep='\t', header=False, index=False)
+
+
+def test_calibration_uses_only_solver_solves(tmp_path):
+    run = tmp_path / 'results' / 'run'
+    run.mkdir(parents=True)
+    pd.DataFrame({'Dataset': 'Toy', 'Backend': ['solver', 'solver', 'greedy', 'candidate_pool'],
+                  'Seconds': [1.0, 3.0, 600.0, 0.5], 'Variables': [1000, 1000, 1000, 500]}).to_csv(
+        run / 'solves.csv', index=False)
+    # a record without backends cannot be told apart from fallbacks and is left out
+    old = tmp_path / 'results' / 'old'
+    old.mkdir()
+    pd.DataFrame({'Dataset': ['Toy'], 'Seconds': [100.0]}).to_csv(old / 'solves.csv', index=False)
+    seconds, _ = calibration(str(tmp_path / 'results'))
+    assert seconds == {'solver': 0.002, 'candidate_pool': 0.001}
+
+
+def test_plan_falls_back_to_candidate_pools_then_refuses_over_time(tmp_path):
+    datasets_dir = str(tmp_path / 'datasets')
+    _write_dataset(datasets_dir)
+    arguments = dict(results_dir=str(tmp_path / 'results'), datasets_dir=datasets_dir)
+
+    full = plan(CONFIG, memory_gb=16, **arguments).iloc[0]
+    assert (full['Backend'], full['Solver']) == ('in_memory', 'solver')
+
+    # the full model of 1000 x 50 variables is over a budget that the pools of about 24 fit
+    budget = (full['Peak_MB'] - full['Solver_MB'] / 2) / 1024
+    pooled = plan(CONFIG, memory_gb=budget, **arguments)
+    assert (pooled.iloc[0]['Backend'], pooled.iloc[0]['Solver']) == ('in_memory', 'candidate_pool')
+    assert apply_plan(CONFIG, pooled)['dataset_overrides']['Toy']['solver'] == {'candidate_pool': {}}
+
+    # only a streamed chunk fits next to the interpreter, but not a time budget below its own estimate
+    memory_gb = (BASE_MB + 5) / 1024
+    streamed = plan(CONFIG, memory_gb=memory_gb, **arguments).iloc[0]
+    assert streamed['Backend'] == 'streaming'
+    refused = plan(CONFIG, memory_gb=memory_gb, hours=streamed['Cell_Hours'] / 2, **arguments)
+    assert refused.iloc[0]['Backend'] == 'refused'
+    assert apply_plan(CONFIG, refused)['ds_names'] == []
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+
+from experiment_dcg_change import ExperimentDCG
+from replication import AGGREGATED_COLUMNS, aggregate_seeds
+
+
+def test_aggregate_seeds():
+    # two seeds of one model, each with the N and C rows of a cell
+    results = pd.DataFrame({'Dataset': 'Toy', 'Model': 'PMF', 'Type': ['N', 'C', 'N', 'C'], 'Row': [0, 1, 0, 1],
+                            'Seed': [1, 1, 2, 2]})
+    for offset, column in enumerate(AGGREGATED_COLUMNS):
+        results[column] = [offset + 1.0, offset + 2.0, offset + 3.0, offset + 6.0]
+    aggregated = aggregate_seeds(results)
+    assert aggregated['Type'].tolist() == ['N', 'C'] and aggregated['Seeds'].tolist() == [2, 2]
+    assert aggregated['All_mean'].tolist() == [2.0, 4.0]
+    assert aggregated['mCPF_min'].tolist() == [10.0, 11.0] and aggregated['mCPF_max'].tolist() == [12.0, 15.0]
+    assert aggregated['DCF_std'].round(6).tolist() == [1.414214, 2.828427]
+
+
+def test_replication_refuses_external_candidates():
+    config = {'fairness_categories': ['N'], 'replication': {'seeds': [1, 2]},
+              'external_candidates': {'Toy': {'path': 'candidates/Toy.parquet'}}}
+    with pytest.raises(ValueError, match='replication'):
+        ExperimentDCG.from_config(config, models=[], metrics=[])
@@ -0,0 +1,46 @@
+import numpy as np
+
+from groups import top_share_groups
+from interactions import KEY_BASE, InteractionState
+from matrices import topk_indices
+from simulation import FeedbackSimulation
+
+
+def _simulation(seed=0, users=80, items=60, topk=20):
+    rng = np.random.default_rng(seed)
+    train_checkins = {uid: set(rng.choice(items, rng.integers(1, 8), replace=False).tolist()) for uid in range(users)}
+    ground_truth = {uid: set(rng.choice(items, 5, replace=False).tolist()) for uid in range(users)}
+    state = InteractionState(train_checkins, users, items, 0.1, 0.2)
+    S = rng.random((users, items))
+    return FeedbackSimulation('dcg_change', ('CP', 0.5, 0.5), S=S, P=topk_indices(S, topk), state=state,
+                              ground_truth=ground_truth, topk=topk, k=5, visit_share=0.5, click_probability=0.8,
+                              noise=0.2, seed=seed)
+
+
+def test_incremental_state_matches_a_rebuild():
+    simulation = _simulation()
+    interactions, clicks = len(simulation.state), simulation.state.item_counts.sum()
+    for _ in range(5):
+        trajectory = simulation.round()
+        interactions += trajectory['New_Interactions']
+        clicks += trajectory['Clicks']
+        assert len(simulation.state) == interactions
+    state = simulation.state
+    assert interactions > len(_simulation().state)
+
+    # user activity counts the distinct items of the interactions, item popularity every click
+    keys = state.keys()
+    assert (state.user_counts == np.bincount(keys // KEY_BASE, minlength=state.total_users)).all()
+    assert state.item_counts.sum() == clicks
+    assert (state.item_counts >= np.bincount(keys % KEY_BASE, minlength=state.total_items)).all()
+    # the group sizes of the updated state are those of a rebuild from its counts
+    for groups, counts in ((state.users, state.user_counts), (state.items, state.item_counts)):
+        assert (groups.membership == 0).sum() == (top_share_groups(counts, groups.share) == 0).sum()
+        # ties may keep other members than a rebuild, but never a smaller count
+        assert counts[groups.membership == 0].min() >= counts[groups.membership == 1].max()
+
+
+def test_simulation_is_reproducible():
+    trajectories = [[{name: value for name, value in row.items() if name != 'Seconds'} for row in
+                     _simulation(seed=3).run(3)] for _ in range(2)]
+    assert trajectories[0] == trajectories[1]
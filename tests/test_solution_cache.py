@@ -0,0 +1,44 @@
+import os
+import time
+
+import numpy as np
+
+from solution_cache import SolutionCache, array_digest, problem_key
+
+
+CONFIG = {'topk': 50, 'list_length': 10, 'no_of_item_groups': 2, 'no_of_user_groups': 2,
+          'solver': {'max_seconds': 60}}
+
+
+def test_problem_key_changes_with_the_inputs_and_the_solver():
+    digest = array_digest(np.arange(6).reshape(2, 3))
+    key = problem_key(digest, CONFIG, 'dcg_change', 'optimisation.fairness_optimisation_dcg_change', 'C', 0.5, 0.5)
+    assert key == problem_key(digest, dict(CONFIG), 'dcg_change', 'optimisation.fairness_optimisation_dcg_change',
+                              'C', 0.5, 0.5)
+    for config in (dict(CONFIG, solver={'max_seconds': 60, 'max_gap': 0.01}), dict(CONFIG, solver=None),
+                   dict(CONFIG, list_length=20)):
+        assert key != problem_key(digest, config, 'dcg_change', 'optimisation.fairness_optimisation_dcg_change',
+                                  'C', 0.5, 0.5)
+    # the same values in another dtype or shape are other inputs
+    assert digest != array_digest(np.arange(6, dtype=np.int32).reshape(2, 3))
+    assert digest != array_digest(np.arange(6).reshape(3, 2))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    rng = np.random.default_rng(0)
+    selections = {name: rng.random((200, 50)) < 0.2 for name in ('first', 'second', 'third')}
+    cache = SolutionCache(str(tmp_path), max_mb=1)
+    cache.put('first', selections['first'], np.array([3.0, 7.0]))
+    selection, item_totals = cache.get('first')
+    assert (selection == selections['first']).all() and item_totals.tolist() == [3.0, 7.0]
+
+    # room for two entries; the first one is read after the second was written, so the second goes
+    size = os.path.getsize(tmp_path / 'first.npz')
+    cache = SolutionCache(str(tmp_path), max_mb=2.5 * size / 1024 ** 2)
+    cache.put('second', selections['second'], np.zeros(2))
+    for offset, name in ((200, 'first'), (100, 'second')):
+        os.utime(tmp_path / f"{name}.npz", (time.time() - offset, time.time() - offset))
+    assert cache.get('first') is not None
+    cache.put('third', selections['third'], np.zeros(2))
+    assert cache.get('second') is None
+    assert cache.get('first') is not None and cache.get('third') is not None
@@ -0,0 +1,45 @@
+import numpy as np
+
+from entropic import EntropicReranking
+from streaming import StreamingCell, ranking_chunks
+
+
+def _cell(backend=None, formulation='dcg_change'):
+    # a synthetic cell of 200 users and 300 items, re-ranked in chunks of 64 users
+    rng = np.random.RandomState(0)
+    users, items, topk = 200, 300, 20
+    S = rng.rand(users, items)
+    P = np.argsort(-S, axis=1)[:, :topk]
+    U = np.zeros((users, 2))
+    U[:20, 0] = 1
+    U[20:, 1] = 1
+    chunks = ranking_chunks(formulation, topk=topk, chunk_size=64, total_users=users, total_items=items, S=S, P=P)
+    return StreamingCell(chunks, formulation=formulation, U=U, item_labels=(rng.rand(items) < 0.7).astype(int),
+                         train_checkins={u: set(rng.choice(items, 5, replace=False).tolist()) for u in range(users)},
+                         ground_truth={u: set(rng.choice(items, 3, replace=False).tolist()) for u in range(users)},
+                         pop_items={i: 1 for i in range(items)}, total_users=users, total_items=items,
+                         no_item_groups=2, k=5, backend=backend)
+
+
+def test_entropic_backend_keeps_n_and_c_exact():
+    settings = [('N', None, None), ('C', 0.5, None), ('P', None, 0.001), ('CP', 0.5, 0.001)]
+    active, inactive = np.arange(200) < 20, np.arange(200) >= 20
+    default = _cell().run(settings, active=active, inactive=inactive)
+    entropic = _cell(EntropicReranking(k=5, temperature=0.05, long_tail_share=0.8)).run(
+        settings, active=active, inactive=inactive)
+
+    for exact, soft in zip(default[:2], entropic[:2]):
+        assert exact['all'] == soft['all']
+        np.testing.assert_array_equal(exact['item_totals'], soft['item_totals'])
+    # the target applies to P and CP
+    assert entropic[2]['item_totals'][1] > default[2]['item_totals'][1]
+
+
+def test_objective_gap_against_the_optimum_under_the_target():
+    cell = _cell(EntropicReranking(k=5, temperature=0.05, long_tail_share=0.8))
+    setting = ('P', None, 0.001)
+    gap = cell.objective_gap(setting)
+    # the reference meets the same target, so it is below the unconstrained optimum
+    assert gap['Objective_Exact'] < cell.exact_objective(setting)
+    assert gap['Objective'] <= gap['Objective_Exact'] + 1e-9
+    assert cell.objective_gap(('N', None, None))['Gap'] == 0.0
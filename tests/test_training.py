@@ -0,0 +1,37 @@
+import os
+
+import cornac
+from cornac.eval_methods import BaseMethod
+import numpy as np
+
+from training import THREAD_VARIABLES, TrainingScheduler, _fit, thread_limit_environment
+
+
+def _eval_method(users=30, items=40, seed=0):
+    rng = np.random.default_rng(seed)
+    train = [(str(user), str(item), 1.0) for user in range(users) for item in rng.choice(items, 6, replace=False)]
+    test = [(str(user), str(item), 1.0) for user in range(users) for item in rng.choice(items, 2, replace=False)]
+    return BaseMethod.from_splits(train_data=train, test_data=test, rating_threshold=1.0, exclude_unknowns=True,
+                                  verbose=False)
+
+
+def test_scheduler_trains_as_the_main_process():
+    eval_method = _eval_method()
+    metrics = [cornac.metrics.Recall(k=5)]
+    jobs = [((name, seed), cornac.models.PMF(k=4, max_iter=10, seed=seed, name=name), eval_method, metrics)
+            for name, seed in (('first', 1), ('second', 2))]
+    trained = {key: (model, test_result) for key, model, test_result, _ in TrainingScheduler(processes=2).run(jobs)}
+    assert set(trained) == {('first', 1), ('second', 2)}
+    for job in jobs:
+        _, model, test_result, report = _fit(job)
+        assert np.allclose(trained[job[0]][0].U, model.U) and np.allclose(trained[job[0]][0].V, model.V)
+        assert trained[job[0]][1].metric_avg_results['Recall@5'] == test_result.metric_avg_results['Recall@5']
+        assert set(report) == {'Train_Seconds', 'Peak_Memory_MB'}
+
+
+def test_thread_limit_environment_is_restored(monkeypatch):
+    monkeypatch.setenv('OMP_NUM_THREADS', '3')
+    monkeypatch.delenv('MKL_NUM_THREADS', raising=False)
+    with thread_limit_environment(1):
+        assert all(os.environ[name] == '1' for name in THREAD_VARIABLES)
+    assert os.environ['OMP_NUM_THREADS'] == '3' and 'MKL_NUM_THREADS' not in os.environ
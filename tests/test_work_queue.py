@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from work_queue import WorkQueue, result_rows, run_worker
+
+
+LEASE_SECONDS = 1.0
+
+
+def _handlers(directory: str) -> dict:
+    # rank and solve tasks shaped as the ones of cpfair: every rank task enqueues the solves of its cells
+    def rank_task(payload):
+        if payload['model'] == 1 and not os.path.exists(os.path.join(directory, 'hung')):
+            # the first attempt of this task hangs until its worker is killed
+            with open(os.path.join(directory, 'hung'), 'w') as marker:
+                marker.write(str(os.getpid()))
+            time.sleep(120)
+        return {'Model': f"model{payload['model']}"}, [('solve', {'model': payload['model'], 'setting': setting})
+                                                       for setting in range(3)]
+
+    def solve_task(payload):
+        return {'Objective': 10 * payload['model'] + payload['setting']}, []
+
+    return {'rank': rank_task, 'solve': solve_task}
+
+
+def _work(path: str, worker: str, directory: str):
+    run_worker(WorkQueue(path, lease_seconds=LEASE_SECONDS), worker, _handlers(directory), poll_seconds=0.05)
+
+
+def _queue(path: str) -> WorkQueue:
+    queue = WorkQueue(path, lease_seconds=LEASE_SECONDS)
+    queue.enqueue([('rank', {'model': model}) for model in range(3)])
+    return queue
+
+
+def test_killed_worker_task_is_retried_and_reduces_to_the_same_tables(tmp_path):
+    # the reference: one worker in this process, without failures
+    reference_dir = tmp_path / 'reference'
+    reference_dir.mkdir()
+    (reference_dir / 'hung').write_text('')
+    reference = _queue(str(reference_dir / 'queue.sqlite'))
+    assert run_worker(reference, 'reference', _handlers(str(reference_dir)), poll_seconds=0.05) == 12
+
+    path = str(tmp_path / 'queue.sqlite')
+    queue = _queue(path)
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_work, args=(path, f"worker{index}", str(tmp_path))) for index in range(3)]
+    for worker in workers:
+        worker.start()
+    deadline = time.time() + 60
+    while not (tmp_path / 'hung').exists() or not (tmp_path / 'hung').read_text():
+        assert time.time() < deadline, "no worker claimed the hanging task"
+        time.sleep(0.05)
+    hung = int((tmp_path / 'hung').read_text())
+    os.kill(hung, signal.SIGKILL)
+    for worker in workers:
+        worker.join(timeout=60)
+        assert not worker.is_alive()
+
+    assert queue.finished() and queue.counts() == {'done': 12}
+    # the killed task was claimed again once its lease expired
+    attempts = {payload['model']: attempts for _, payload, _, attempts, _, _ in queue.tasks(kind='rank')}
+    assert attempts == {0: 1, 1: 2, 2: 1}
+    for kind in ('rank', 'solve'):
+        assert sorted(result_rows(queue, kind), key=str) == sorted(result_rows(reference, kind), key=str)
+
+
+def test_tasks_fail_after_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=LEASE_SECONDS, max_attempts=2)
+    queue.enqueue([('broken', {'task': 0})])
+
+    def broken(payload):
+        raise RuntimeError('always fails')
+
+    assert run_worker(queue, 'worker', {'broken': broken}, poll_seconds=0.05) == 0
+    assert queue.tasks(kind='broken')[0][2:5] == ('failed', 2, "RuntimeError('always fails')")
+
+    # a task claimed by workers that disappear without renewing its lease
+    queue.enqueue([('expiring', {'task': 1})])
+    for _ in range(2):
+        assert queue.claim('gone', kinds=['expiring']) is not None
+        time.sleep(LEASE_SECONDS * 1.1)
+    assert queue.claim('next', kinds=['expiring']) is None
+    assert queue.tasks(kind='expiring')[0][2:5] == ('failed', 2, 'lease expired')
+    assert queue.finished()
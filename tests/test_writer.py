@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from writer import ResultWriter
+
+
+def test_writes_are_flushed_in_order_on_close(tmp_path):
+    trace = str(tmp_path / 'traces' / 'trace.csv')
+    writer = ResultWriter(max_pending=2)
+    for round_number in range(5):
+        writer.write_csv(pd.DataFrame({'Round': [round_number], 'Value': [round_number / 2]}), trace, append=True)
+    writer.write_csv(pd.DataFrame({'Type': ['N', 'C']}), str(tmp_path / 'results.csv'))
+    writer.close()
+    assert pd.read_csv(trace)['Round'].tolist() == [0, 1, 2, 3, 4]
+    assert pd.read_csv(tmp_path / 'results.csv')['Type'].tolist() == ['N', 'C']
+
+
+def test_failed_writes_are_raised_on_close(tmp_path):
+    (tmp_path / 'file').write_text('')
+    with pytest.raises(RuntimeError, match='write_csv'):
+        with ResultWriter() as writer:
+            # the directory of this table is a file
+            writer.write_csv(pd.DataFrame({'Type': ['N']}), str(tmp_path / 'file' / 'results.csv'))
+            writer.write_csv(pd.DataFrame({'Type': ['N']}), str(tmp_path / 'results.csv'))
+    # the writes after a failed one still run
+    assert (tmp_path / 'results.csv').exists()
+
+
+def test_foreground_writes_run_immediately(tmp_path):
+    writer = ResultWriter(background=False)
+    writer.write_csv(pd.DataFrame({'Type': ['N']}), str(tmp_path / 'results.csv'))
+    assert (tmp_path / 'results.csv').exists()
+    writer.close()